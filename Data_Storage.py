@@ -1,12 +1,41 @@
 import os
+import sys
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import json
 import time
+import zlib
+import random
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from urllib.parse import urlparse
 from datetime import datetime, timedelta, timezone
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.bulk_batch import BulkWriteBatch
+from google.api_core.exceptions import InvalidArgument, FailedPrecondition, OutOfRange, MethodNotImplemented
+
+from dashboard_cache import invalidate_dashboard_cache
+from telemetry_fields import (
+    TelemetryAggregator, fields_for_device, decode_telemetry_payload, device_doc_id, SOFTWARE_VERSION_FIELD,
+)
+from telemetry_rollups import (
+    ROLLUP_BASE_MINUTES, rollup_bucket_start, rollup_values, sample_bucket, plan_rollup_batches,
+)
+from telemetry_writer import (
+    TelemetryWriter, PermanentWriteError, WRITE_BACKOFF_BASE, WRITE_BACKOFF_MAX,
+)
+import sync_manifest
+from sync_manifest import HashManifest, content_hash, BULK_READ_CHUNK, BULK_WRITE_CHUNK
+from telemetry_spool import TelemetrySpool, SpoolDrainer, TELEMETRY_SPOOL_DIR, DEAD_LETTER_DIR
+from telemetry_buckets import (
+    BUCKET_COLLECTION, BUCKET_SUBCOLLECTION, writes_records, writes_buckets,
+    group_into_buckets, build_bucket_update,
+)
 
 # -------------------------------
 # Configuration & Logging Setup
@@ -24,7 +53,9 @@ logger.addHandler(file_handler)
 CLIENT_ID = os.getenv("STARLINK_CLIENT_ID", "b2b070d3-4fa6-41f0-8266-f8c2643e0016")
 CLIENT_SECRET = os.getenv("STARLINK_CLIENT_SECRET", "Ghana@2029@!--Ghana@2029@!$$Ghana@2029@!")
 
-token_cache = {"access_token": None}
+TOKEN_CACHE_PATH = os.getenv("STARLINK_TOKEN_CACHE", ".starlink_token.json")
+# Refresh this many seconds before the token expires
+TOKEN_REFRESH_MARGIN = int(os.getenv("STARLINK_TOKEN_REFRESH_MARGIN", "300"))
 
 # -------------------------------
 # Firebase Initialization
@@ -45,129 +76,433 @@ logger.debug("[DEBUG] Attempting to initialize Firestore client.")
 db = firestore.client()
 logger.info("[DEBUG] Firestore client initialized successfully.")
 
+# -------------------------------
+# HTTP Client (pooled, keep-alive)
+# -------------------------------
+# Cap on simultaneous requests per API host once sync stages run in parallel
+HOST_CONCURRENCY = int(os.getenv("STARLINK_HOST_CONCURRENCY", "4"))
+HTTP_POOL_CONNECTIONS = int(os.getenv("STARLINK_HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("STARLINK_HTTP_POOL_MAXSIZE", str(max(HOST_CONCURRENCY, 10))))
+HTTP_MAX_RETRIES = int(os.getenv("STARLINK_HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("STARLINK_HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("STARLINK_HTTP_BACKOFF_MAX", "20"))
+HTTP2_ENABLED = os.getenv("STARLINK_HTTP2", "false").lower() in ("1", "true", "yes")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+def host_semaphore(url):
+    host = urlparse(url).netloc
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return host_semaphores[host]
+
+class StarlinkHttpClient:
+    """
+    Shared HTTP client for the Starlink API and token endpoint.
+    Keeps connections alive in a pool (requests.Session, or httpx with HTTP/2 when
+    STARLINK_HTTP2 is set and httpx[http2] is installed), negotiates gzip, and retries
+    429/5xx and connection errors with jittered exponential backoff.
+    """
+
+    def __init__(self):
+        self.http2 = False
+        if HTTP2_ENABLED:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+                )
+                self._retry_errors = (httpx.TransportError,)
+                self.http2 = True
+            except ImportError:
+                logger.warning("STARLINK_HTTP2 set but httpx[http2] is not installed; using requests.")
+        if not self.http2:
+            self._client = requests.Session()
+            self._retry_errors = (requests.ConnectionError, requests.Timeout)
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0
+            )
+            self._client.mount("https://", adapter)
+            self._client.mount("http://", adapter)
+            self._adapter = adapter
+        self._client.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", 10)
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            try:
+                with host_semaphore(url):
+                    response = self._client.request(method, url, **kwargs)
+            except self._retry_errors as e:
+                if attempt >= HTTP_MAX_RETRIES:
+                    raise
+                self._backoff(attempt, None, f"{type(e).__name__} on {url}")
+                continue
+            finally:
+                with self._stats_lock:
+                    self._requests += 1
+            if response.status_code in RETRY_STATUSES and attempt < HTTP_MAX_RETRIES:
+                self._backoff(attempt, response.headers.get("Retry-After"), f"HTTP {response.status_code} on {url}")
+                continue
+            return response
+
+    def _backoff(self, attempt, retry_after, reason):
+        with self._stats_lock:
+            self._retries += 1
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            # Full jitter: uniform over [0, base * 2^attempt]
+            delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+        logger.warning(f"{reason}; retrying in {delay:.2f}s (attempt {attempt + 1}/{HTTP_MAX_RETRIES})")
+        time.sleep(delay)
+
+    def stats(self):
+        """Request, retry and connection counts; reuse rate = requests served per new connection."""
+        connections = None
+        if not self.http2:
+            pools = self._adapter.poolmanager.pools
+            connections = sum(pools[key].num_connections for key in pools.keys())
+        with self._stats_lock:
+            requests_made = self._requests
+            retries = self._retries
+        reuse_rate = None
+        if connections is not None and requests_made:
+            reuse_rate = max(0.0, 1 - connections / requests_made)
+        return {
+            "requests": requests_made,
+            "retries": retries,
+            "connections_opened": connections,
+            "connection_reuse_rate": reuse_rate,
+            "http2": self.http2,
+        }
+
+http_client = StarlinkHttpClient()
+
+def get_http_stats():
+    return http_client.stats()
+
+# -------------------------------
+# OAuth Token Lifecycle
+# -------------------------------
+class TokenManager:
+    """
+    Holds the Starlink API access token with its expiry.
+    - get_token() returns the cached token while it is valid, refreshing otherwise
+    - concurrent callers share one in-flight refresh (single flight)
+    - a background timer refreshes TOKEN_REFRESH_MARGIN seconds before expiry
+    - the token is persisted to 'cache_path' so restarts don't need a new one
+    """
+
+    def __init__(self, fetch_token, cache_path=TOKEN_CACHE_PATH, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self._fetch_token = fetch_token  # () -> (access_token, expires_in_seconds)
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._timer = None
+        self.access_token = None
+        self.expires_at = 0.0
+        self._load()
+
+    def get_token(self):
+        if self.access_token and time.time() < self.expires_at - self.refresh_margin / 2:
+            return self.access_token
+        return self.refresh()
+
+    def refresh(self, stale_token=None):
+        """
+        Fetch a new token. With 'stale_token' (e.g. after a 401), a refresh that
+        already replaced that token counts, so a burst of 401s costs one fetch.
+        """
+        with self._lock:
+            if stale_token is not None and self.access_token and self.access_token != stale_token:
+                return self.access_token
+            future = self._inflight
+            leader = future is None
+            if leader:
+                future = self._inflight = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            access_token, expires_in = self._fetch_token()
+            with self._lock:
+                self.access_token = access_token
+                self.expires_at = time.time() + expires_in
+            self._save()
+            self._schedule(expires_in - self.refresh_margin)
+            future.set_result(access_token)
+            return access_token
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight = None
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, 1), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Background token refresh failed, retrying in 30s: {e}")
+            self._schedule(30)
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+            if cached.get("expires_at", 0) - self.refresh_margin > time.time():
+                self.access_token = cached["access_token"]
+                self.expires_at = cached["expires_at"]
+                self._schedule(self.expires_at - self.refresh_margin - time.time())
+                logger.info("Loaded cached access token from disk.")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable token cache {self.cache_path}: {e}")
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.cache_path}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"access_token": self.access_token, "expires_at": self.expires_at}, f)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning(f"Could not persist access token to {self.cache_path}: {e}")
+
 # -------------------------------
 # API Client Functions
 # -------------------------------
-def fetch_access_token():
+def request_access_token():
+    """Client-credentials grant; returns (access_token, expires_in_seconds)."""
+    response = http_client.request(
+        'POST',
+        'https://api.starlink.com/auth/connect/token',
+        headers={'Content-type': 'application/x-www-form-urlencoded'},
+        data={
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+            'grant_type': 'client_credentials',
+        },
+        timeout=10
+    )
+    response.raise_for_status()
+    data = response.json()
+    access_token = data.get('access_token')
+    if not access_token:
+        raise ValueError("Access token not received in the response.")
+    logger.info("Access token updated successfully.")
+    return access_token, int(data.get('expires_in', 3600))
+
+token_manager = TokenManager(request_access_token)
+
+def fetch_access_token(stale_token=None):
     try:
-        response = requests.post(
-            'https://api.starlink.com/auth/connect/token',
-            headers={'Content-type': 'application/x-www-form-urlencoded'},
-            data={
-                'client_id': CLIENT_ID,
-                'client_secret': CLIENT_SECRET,
-                'grant_type': 'client_credentials',
-            },
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
-        access_token = data.get('access_token')
-        if not access_token:
-            raise ValueError("Access token not received in the response.")
-        token_cache["access_token"] = access_token
-        logger.info("Access token updated successfully.")
+        return token_manager.refresh(stale_token)
     except Exception as e:
         logger.error(f"Error fetching access token: {e}")
         raise
 
 def get_header():
-    if not token_cache["access_token"]:
-        fetch_access_token()
     return {
         "Accept": "application/json",
-        "Authorization": f"Bearer {token_cache['access_token']}"
+        "Authorization": f"Bearer {token_manager.get_token()}"
     }
 
 def make_authorized_request(url, method, **kwargs):
     try:
         kwargs['headers'] = get_header()
-        response = requests.request(method, url, **kwargs, timeout=10)
+        kwargs.setdefault('timeout', 10)
+        response = http_client.request(method, url, **kwargs)
         if response.status_code == 401:
             logger.info("Access token expired or unauthorized; refreshing token.")
-            fetch_access_token()
+            fetch_access_token(stale_token=kwargs['headers']['Authorization'][len("Bearer "):])
             kwargs['headers'] = get_header()
-            response = requests.request(method, url, **kwargs, timeout=10)
+            response = http_client.request(method, url, **kwargs)
         response.raise_for_status()
         return response
     except Exception as e:
         logger.error(f"Error during request to {url}: {e}")
         raise
 
-def fetch_all_pages(url, method='GET', params=None, data=None, json_data=None, **kwargs):
+# Pages fetched ahead of the consumer when the API reports a total count
+PAGE_PREFETCH = int(os.getenv("STARLINK_PAGE_PREFETCH", "3"))
+# Pages handed to a store function but not yet stored (bounds memory per stage)
+MAX_PENDING_STORE_PAGES = 2
+
+def parse_page(result, limit):
+    """Return (items, is_last_page, total_count) for any of the API's page shapes."""
+    total_count = None
+    if isinstance(result, dict):
+        if "results" in result:
+            items = result.get("results", [])
+        elif "content" in result and isinstance(result["content"], dict):
+            items = result["content"].get("results", [])
+        else:
+            items = result.get('items') or result.get('data') or []
+    elif isinstance(result, list):
+        items = result
+    else:
+        items = []
+
+    if isinstance(result, dict) and "content" in result:
+        content = result["content"]
+        is_last_page = content.get("isLastPage", False) or len(items) < limit
+        total_count = content.get("totalCount")
+    else:
+        is_last_page = len(items) < limit
+        if isinstance(result, dict):
+            total_count = result.get("totalCount")
+    return items, is_last_page, total_count
+
+def fetch_page(url, method, page, limit, params=None, data=None, json_data=None, **kwargs):
+    # Copies, so prefetched pages never share a params/payload dict
+    params = dict(params or {})
+    json_data = dict(json_data) if json_data is not None else None
     if method.upper() == 'GET':
-        if params is None:
-            params = {}
-        page = params.get('page', 0)
-        limit = params.get('limit', 50)
+        params['page'] = page
+        params['limit'] = limit
     elif method.upper() == 'POST':
-        if json_data is None:
-            json_data = {}
-        page = json_data.get('pageIndex', 0)
-        limit = json_data.get('pageLimit', 50)
+        json_data = json_data or {}
+        json_data['pageIndex'] = page
+        json_data['pageLimit'] = limit
+
+    response = make_authorized_request(url, method, params=params, data=data, json=json_data, **kwargs)
+    result = response.json()
+    items, is_last_page, total_count = parse_page(result, limit)
+    logger.info(f"Page {page} of {url}: {len(items)} items")
+    logger.debug(f"Page {page} response: {result}")
+    return items, is_last_page, total_count
+
+def iter_pages(url, method='GET', params=None, data=None, json_data=None, prefetch=PAGE_PREFETCH, **kwargs):
+    """
+    Yield the item list of each page in order as it arrives.
+    Once the first page reports a total count, up to 'prefetch' following pages
+    are fetched concurrently; otherwise pages are fetched one after another.
+    """
+    if method.upper() == 'GET':
+        page = (params or {}).get('page', 0)
+        limit = (params or {}).get('limit', 50)
+    elif method.upper() == 'POST':
+        page = (json_data or {}).get('pageIndex', 0)
+        limit = (json_data or {}).get('pageLimit', 50)
     else:
         page = 0
         limit = 50
 
-    all_items = []
-    while True:
-        if method.upper() == 'GET':
-            params['page'] = page
-            params['limit'] = limit
-        elif method.upper() == 'POST':
-            json_data['pageIndex'] = page
-            json_data['pageLimit'] = limit
-
-        response = make_authorized_request(url, method, params=params, data=data, json=json_data, **kwargs)
-        result = response.json()
-        logger.info(f"Page {page} response: {result}")
-
-        if isinstance(result, dict):
-            if "results" in result:
-                items = result.get("results", [])
-            elif "content" in result and isinstance(result["content"], dict):
-                items = result["content"].get("results", [])
-            else:
-                items = result.get('items') or result.get('data') or []
-        elif isinstance(result, list):
-            items = result
-        else:
-            items = []
+    def get(page_number):
+        return fetch_page(url, method, page_number, limit, params=params, data=data, json_data=json_data, **kwargs)
+
+    items, is_last_page, total_count = get(page)
+    yield items
+    if is_last_page:
+        return
+
+    if total_count is not None and prefetch > 1:
+        last_page = -(-int(total_count) // limit) - 1
+        next_page = page + 1
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="page-prefetch") as executor:
+            pending = deque()
+            while next_page <= last_page or pending:
+                while next_page <= last_page and len(pending) < prefetch:
+                    pending.append(executor.submit(get, next_page))
+                    next_page += 1
+                items, is_last_page, _ = pending.popleft().result()
+                yield items
+                if is_last_page:
+                    for future in pending:
+                        future.cancel()
+                    return
+        return
+
+    while not is_last_page:
+        page += 1
+        items, is_last_page, _ = get(page)
+        yield items
 
-        all_items.extend(items)
+def iter_items(url, method='GET', params=None, data=None, json_data=None, **kwargs):
+    """Yield individual items across all pages without holding them all in memory."""
+    for items in iter_pages(url, method, params=params, data=data, json_data=json_data, **kwargs):
+        yield from items
 
-        if isinstance(result, dict) and "content" in result:
-            if result["content"].get("isLastPage", False) or len(items) < limit:
-                break
-        elif len(items) < limit:
-            break
-
-        page += 1
+def fetch_all_pages(url, method='GET', params=None, data=None, json_data=None, **kwargs):
+    return list(iter_items(url, method, params=params, data=data, json_data=json_data, **kwargs))
 
-    return all_items
+def fetch_and_store_pages(url, store_page, method='GET', params=None, json_data=None):
+    """
+    Stream pages into 'store_page' on a background thread, so storing page N overlaps
+    with fetching page N+1. Pages are stored in order and at most
+    MAX_PENDING_STORE_PAGES are held at once. Returns the number of items stored.
+    """
+    total = 0
+    with ThreadPoolExecutor(max_workers=1) as store_executor:
+        pending = deque()
+        for items in iter_pages(url, method, params=params, json_data=json_data):
+            total += len(items)
+            pending.append(store_executor.submit(store_page, items))
+            while len(pending) > MAX_PENDING_STORE_PAGES:
+                pending.popleft().result()
+        for future in pending:
+            future.result()
+    return total
 
 # -------------------------------
 # Firestore Storage Functions
 # -------------------------------
+hash_manifest = HashManifest()
+# Values per Firestore "in" filter
+FIRESTORE_IN_LIMIT = 30
+
+def forget_hashes(paths):
+    """Drop manifest entries for deleted documents, so recreating one is never skipped."""
+    hash_manifest.forget(paths)
+
+def bulk_upsert_if_changed(entries, merge=False):
+    """
+    Bulk version of update_if_changed for a list of (doc_ref, new_data) pairs, skipping
+    documents the sync manifest vouches for. Returns the number of documents written.
+    """
+    return sync_manifest.bulk_upsert_if_changed(
+        db, hash_manifest, entries, merge=merge, commit=commit_batch, invalidate=invalidate_dashboard_cache,
+    )
+
 def update_if_changed(doc_ref, new_data, merge=False):
     """
     Updates a document in Firestore only if 'new_data' differs from what's already stored.
+    Cached dashboard responses built from the document are invalidated on write.
     """
     try:
         existing = doc_ref.get()
         if existing.exists:
             existing_data = existing.to_dict()
-            if json.dumps(existing_data, sort_keys=True) == json.dumps(new_data, sort_keys=True):
+            if content_hash(existing_data) == content_hash(new_data):
                 logger.info(f"Document {doc_ref.id} unchanged, skipping update")
                 return False
             else:
                 doc_ref.set(new_data, merge=merge)
                 logger.info(f"Document {doc_ref.id} updated with new data")
-                return True
         else:
             doc_ref.set(new_data)
             logger.info(f"Document {doc_ref.id} created with new data")
-            return True
+        service_line = new_data.get("serviceLineNumber") if isinstance(new_data, dict) else None
+        invalidate_dashboard_cache(doc_ref.path, f"service_lines/{service_line}" if service_line else None)
+        return True
     except Exception as e:
         logger.error(f"Error updating document {doc_ref.id}: {e}")
         raise
@@ -185,6 +520,24 @@ def store_account(account_data):
     except Exception as e:
         logger.error(f"Error storing account: {e}")
 
+def store_accounts(accounts):
+    try:
+        entries = [
+            (
+                db.collection('accounts').document(acc.get('accountNumber')),
+                {
+                    "account_name": acc.get("accountName"),
+                    "account_number": acc.get("accountNumber"),
+                    "region_code": acc.get("regionCode")
+                },
+            )
+            for acc in accounts if acc.get('accountNumber')
+        ]
+        bulk_upsert_if_changed(entries)
+        logger.info(f"Stored {len(entries)} accounts")
+    except Exception as e:
+        logger.error(f"Error storing accounts: {e}")
+
 def store_billing_record_global(record):
     """
     Store billing record in a top-level 'billing_records' collection for dashboard compatibility.
@@ -212,6 +565,22 @@ def store_billing_record(account_number, record):
     except Exception as e:
         logger.error(f"Error storing billing record for service line {record.get('serviceLineNumber')}: {e}")
 
+def store_billing_records(account_number, records):
+    """Bulk store_billing_record: per-account subcollection plus the global collection."""
+    try:
+        entries = []
+        for record in records:
+            service_line = record.get("serviceLineNumber", "unknown")
+            start_date = record.get("startDate", "unknown")
+            end_date = record.get("endDate", "unknown")
+            subcollection = f"billing_records_{service_line}"
+            billing_doc_id = f"{record.get('startDate')}_{record.get('endDate')}"
+            entries.append((db.collection('accounts').document(account_number).collection(subcollection).document(billing_doc_id), record))
+            entries.append((db.collection('billing_records').document(f"{service_line}_{start_date}_{end_date}"), record))
+        bulk_upsert_if_changed(entries)
+    except Exception as e:
+        logger.error(f"Error storing billing records for account {account_number}: {e}")
+
 def store_address(address_data):
     try:
         doc_id = address_data.get('addressReferenceId')
@@ -223,6 +592,19 @@ def store_address(address_data):
     except Exception as e:
         logger.error(f"Error storing address: {e}")
 
+def store_addresses(addresses):
+    try:
+        entries = []
+        for addr in addresses:
+            doc_id = addr.get('addressReferenceId')
+            if not doc_id:
+                logger.error("Address missing reference ID")
+                continue
+            entries.append((db.collection('addresses').document(doc_id), addr))
+        bulk_upsert_if_changed(entries)
+    except Exception as e:
+        logger.error(f"Error storing addresses: {e}")
+
 def store_single_address(address_data):
     try:
         content = address_data.get("content", address_data)
@@ -234,12 +616,10 @@ def store_single_address(address_data):
 
 def store_router_configs(configs):
     try:
-        for config in configs:
-            doc_id = config.get('configId')
-            if not doc_id:
-                continue
-            doc_ref = db.collection('router_configs').document(doc_id)
-            update_if_changed(doc_ref, config)
+        bulk_upsert_if_changed([
+            (db.collection('router_configs').document(config.get('configId')), config)
+            for config in configs if config.get('configId')
+        ])
     except Exception as e:
         logger.error(f"Error storing router configs: {e}")
 
@@ -259,12 +639,10 @@ def store_single_router_config(config_data):
 
 def store_service_lines(service_lines):
     try:
-        for line in service_lines:
-            doc_id = line.get('serviceLineNumber')
-            if not doc_id:
-                continue
-            doc_ref = db.collection('service_lines').document(doc_id)
-            update_if_changed(doc_ref, line)
+        bulk_upsert_if_changed([
+            (db.collection('service_lines').document(line.get('serviceLineNumber')), line)
+            for line in service_lines if line.get('serviceLineNumber')
+        ])
     except Exception as e:
         logger.error(f"Error storing service lines: {e}")
 
@@ -279,14 +657,97 @@ def store_single_service_line(line_data):
 
 def store_user_terminals(user_terminals):
     try:
-        for ut in user_terminals:
-            doc_id = ut.get('userTerminalId')
-            if doc_id:
-                doc_ref = db.collection('user_terminals').document(doc_id)
-                update_if_changed(doc_ref, ut)
+        bulk_upsert_if_changed([
+            (db.collection('user_terminals').document(ut.get('userTerminalId')), ut)
+            for ut in user_terminals if ut.get('userTerminalId')
+        ])
+        store_service_line_device_index(user_terminals)
     except Exception as e:
         logger.error(f"Error storing user terminals: {e}")
 
+def read_docs(collection, doc_ids):
+    """{doc_id: data} for the existing docs among 'doc_ids', read with get_all in chunks."""
+    refs = [db.collection(collection).document(doc_id) for doc_id in dict.fromkeys(doc_ids) if doc_id]
+    found = {}
+    for i in range(0, len(refs), BULK_READ_CHUNK):
+        for snap in db.get_all(refs[i:i + BULK_READ_CHUNK]):
+            if snap.exists:
+                found[snap.id] = snap.to_dict()
+    return found
+
+def store_service_line_device_index(user_terminals):
+    """
+    Maintain service_line_devices/{serviceLineNumber}: everything the dashboard needs
+    to resolve a service line's devices in one point read (terminal and router IDs
+    with their telemetry doc IDs, serials and the formatted address). The first
+    terminal seen for a service line wins, like the query it replaces. Entries left
+    behind by terminals that moved to another service line are deleted.
+    """
+    terminals = {}
+    for ut in user_terminals:
+        service_line_number = ut.get('serviceLineNumber')
+        if service_line_number and ut.get('userTerminalId') and service_line_number not in terminals:
+            terminals[service_line_number] = ut
+    if not terminals:
+        return 0
+
+    service_lines = read_docs('service_lines', terminals)
+    addresses = read_docs('addresses', [(sl or {}).get('addressReferenceId') for sl in service_lines.values()])
+
+    entries = []
+    for service_line_number, ut in terminals.items():
+        router_ids = [
+            r.get('routerId') for r in ut.get('routers') or []
+            if isinstance(r, dict) and r.get('routerId')
+        ]
+        address_ref_id = service_lines.get(service_line_number, {}).get('addressReferenceId')
+        entries.append((db.collection('service_line_devices').document(service_line_number), {
+            'serviceLineNumber': service_line_number,
+            'userTerminalId': ut['userTerminalId'],
+            'userTerminalDocId': device_doc_id('u', ut['userTerminalId']),
+            'routerIds': router_ids,
+            'routerDocIds': [device_doc_id('r', router_id) for router_id in router_ids],
+            'kitSerialNumber': ut.get('kitSerialNumber'),
+            'dishSerialNumber': ut.get('dishSerialNumber'),
+            'addressReferenceId': address_ref_id,
+            'formattedAddress': addresses.get(address_ref_id, {}).get('formattedAddress') if address_ref_id else None,
+        }))
+    written = bulk_upsert_if_changed(entries)
+    prune_service_line_device_index(user_terminals, terminals)
+    return written
+
+def prune_service_line_device_index(user_terminals, indexed):
+    """
+    Delete service_line_devices entries that still point at one of 'user_terminals'
+    under a service line it no longer belongs to (moved or unassigned terminals).
+    'indexed' is the {serviceLineNumber: terminal} just written; those entries were
+    rewritten already. Returns the number of entries deleted.
+    """
+    current = {ut['userTerminalId']: ut.get('serviceLineNumber') for ut in user_terminals if ut.get('userTerminalId')}
+    terminal_ids = list(current)
+    stale = []
+    for i in range(0, len(terminal_ids), FIRESTORE_IN_LIMIT):
+        query = db.collection('service_line_devices').where(
+            'userTerminalId', 'in', terminal_ids[i:i + FIRESTORE_IN_LIMIT]
+        )
+        for snap in query.stream():
+            if snap.id not in indexed and current.get(snap.to_dict().get('userTerminalId')) != snap.id:
+                stale.append(snap.reference)
+    if not stale:
+        return 0
+
+    for i in range(0, len(stale), BULK_WRITE_CHUNK):
+        batch = db.batch()
+        for doc_ref in stale[i:i + BULK_WRITE_CHUNK]:
+            batch.delete(doc_ref)
+        commit_batch(batch)
+    forget_hashes(doc_ref.path for doc_ref in stale)
+    invalidate_dashboard_cache(*(
+        tag for doc_ref in stale for tag in (doc_ref.path, f"service_lines/{doc_ref.id}")
+    ))
+    logger.info(f"Removed {len(stale)} stale service line device index entries: {[r.id for r in stale]}")
+    return len(stale)
+
 def fix_nested_arrays(data):
     if isinstance(data, list):
         new_list = []
@@ -304,154 +765,690 @@ def fix_nested_arrays(data):
 # -------------------------------
 # Telemetry Storage & Aggregation
 # -------------------------------
-def commit_batch(batch, attempt=1, max_attempts=3):
-    try:
-        batch.commit()
-    except Exception as e:
-        if attempt < max_attempts:
-            wait_time = 2 ** attempt  # Exponential backoff: 2, 4, 8 seconds...
-            time.sleep(wait_time)
-            return commit_batch(batch, attempt + 1, max_attempts)
-        else:
-            raise e
+def commit_batch(batch, max_attempts=3):
+    """Commit an atomic WriteBatch, retrying the whole batch with jittered backoff."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return batch.commit()
+        except Exception:
+            if attempt >= max_attempts:
+                raise
+            time.sleep(random.uniform(0, min(WRITE_BACKOFF_MAX, WRITE_BACKOFF_BASE * 2 ** attempt)))
+
+def is_permanent_write_error(error):
+    return isinstance(error, (PermanentWriteError, InvalidArgument, FailedPrecondition, OutOfRange, MethodNotImplemented))
+
+def new_telemetry_writer():
+    """TelemetryWriter committing BulkWriteBatches through this process's Firestore client."""
+    return TelemetryWriter(lambda: BulkWriteBatch(db), is_permanent=is_permanent_write_error)
+
+def build_summary_update(device_type, aggregator, last_timestamp_ns):
+    """
+    Merge-update that folds one ingest batch into telemetry_summary/{device}.
+    min/max/count/sum use server-side transforms, so no read is needed first.
+    """
+    stats = aggregator.result()
+    fields = {}
+    for field in fields_for_device(device_type):
+        field_stats = stats[field.name]
+        if not field_stats["count"]:
+            continue
+        entry = {"last": field_stats["last"], "count": firestore.Increment(field_stats["count"])}
+        if "sum" in field_stats:
+            entry["min"] = firestore.Minimum(field_stats["min"])
+            entry["max"] = firestore.Maximum(field_stats["max"])
+            entry["sum"] = firestore.Increment(field_stats["sum"])
+        fields[field.name] = entry
+
+    update = {
+        "deviceType": device_type,
+        "fields": fields,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+    if last_timestamp_ns:
+        update["lastTimestampNs"] = firestore.Maximum(int(last_timestamp_ns))
+    version_field = SOFTWARE_VERSION_FIELD.get(device_type)
+    if version_field and stats.get(version_field, {}).get("last"):
+        update["softwareVersion"] = stats[version_field]["last"]
+    return update
 
 def store_telemetry(telemetry_data):
     try:
-        data = telemetry_data.get("data", {})
-        values = data.get("values", [])
-        column_names = data.get("columnNamesByDeviceType", {})
+        write_telemetry(telemetry_data)
+    except Exception as e:
+        logger.error(f"Error storing telemetry: {e}")
 
-        max_batch_size = 200
-        batch = db.batch()
-        writes_in_batch = 0
+def summary_watermarks(device_ids):
+    """lastTimestampNs already folded into each device's telemetry_summary doc."""
+    refs = [db.collection("telemetry_summary").document(device_id) for device_id in device_ids]
+    return {
+        snap.id: (snap.to_dict() or {}).get("lastTimestampNs", 0)
+        for snap in db.get_all(refs) if snap.exists
+    }
 
+def raise_for_failed_writes(failed_writes, what):
+    """Raise for TelemetryWriter failures: PermanentWriteError if none of them is worth retrying."""
+    if not failed_writes:
+        return
+    error_class = PermanentWriteError if all(f.permanent for f in failed_writes) else RuntimeError
+    raise error_class(f"{len(failed_writes)} {what} writes failed, e.g. {failed_writes[0].path}: {failed_writes[0].error}")
 
-        routers_encountered = set()
+def bucket_ref(device_id, start_ts):
+    return db.collection(BUCKET_COLLECTION).document(device_id).collection(BUCKET_SUBCOLLECTION).document(str(start_ts))
 
-        for record in values:
-            if not record:
-                continue
+def write_telemetry(telemetry_data, replay=False):
+    """
+    Store one telemetry stream batch; raises if any write still fails after retries.
+    Raw records go first, summaries only once every raw write has landed. Raw
+    records are keyed by UtcTimestampNs, so a failed batch can simply be stored
+    again; pass replay=True then, so samples the summary docs already include are
+    not counted twice.
+    """
+    data = telemetry_data.get("data", {})
+    values = data.get("values", [])
+    column_names = data.get("columnNamesByDeviceType", {})
+
+    decoded_batches = decode_telemetry_payload(values, column_names)
+    watermarks = {}
+    if replay:
+        watermarks = summary_watermarks({d for decoded in decoded_batches for d in decoded.device_rows})
+
+    writer = new_telemetry_writer()
+
+    routers_encountered = set()
+    # router_id -> [device_type, aggregator, last UtcTimestampNs] for the summary docs
+    device_summaries = {}
+    # router_id -> [(UtcTimestampNs, ping, signal)] for the 15m rollups
+    device_rollup_samples = {}
+
+    for decoded in decoded_batches:
+        device_type = decoded.device_type
+        fields = fields_for_device(device_type)
+        field_names = [f.name for f in fields]
+        timestamps = decoded.timestamps
+        pings = decoded.column("PingLatencyMsAvg", 0)
+        signals = decoded.column("SignalQuality", 0)
+
+        for router_id, rows in decoded.device_rows.items():
+            routers_encountered.add(router_id)
 
-            device_type = record[0]
-            cols = column_names.get(device_type, [])
-            record_dict = dict(zip(cols, record))
-
-            # Convert UtcTimestampNs -> ISO8601
-            utc_timestamp_ns = record_dict.get("UtcTimestampNs")
-            if utc_timestamp_ns:
-                ts_seconds = int(utc_timestamp_ns) // 1_000_000_000
-                dt_utc = datetime.fromtimestamp(ts_seconds, tz=timezone.utc)
-                iso_str = dt_utc.isoformat()
-                record_dict["timestamp"] = iso_str
-
-            # Identify router
-            router_id = record_dict.get("DeviceId")
-            if not router_id:
-                continue
+            summary = device_summaries.get(router_id)
+            if summary is None:
+                summary = device_summaries[router_id] = [device_type, TelemetryAggregator(fields), None]
+            watermark = watermarks.get(router_id)
+            summary_rows = [r for r in rows if timestamps[r] > watermark] if watermark else None
+            summary[1].add_columns(decoded.device_columns(router_id, field_names, summary_rows))
+
+            samples = [
+                (timestamps[r], *rollup_values(pings[r], signals[r]))
+                for r in rows if timestamps[r]
+            ]
+            if samples:
+                summary[2] = samples[-1][0]
+                device_rollup_samples.setdefault(router_id, []).extend(samples)
+
+            if writes_records():
+                # Doc ID from UtcTimestampNs to avoid duplicates
+                records_ref = db.collection("telemetry_raw").document(router_id).collection("records")
+                for r in rows:
+                    doc_ref = records_ref.document(str(timestamps[r])) if timestamps[r] else records_ref.document()
+                    writer.set(doc_ref, decoded.record(r))
+
+            if writes_buckets():
+                bucket_samples = group_into_buckets((timestamps[r], decoded.record(r)) for r in rows if timestamps[r])
+                for start_ts, bucket in bucket_samples.items():
+                    writer.set(bucket_ref(router_id, start_ts), build_bucket_update(device_type, start_ts, bucket), merge=True)
+
+    raise_for_failed_writes(writer.close(), "telemetry")
+
+    summary_writer = new_telemetry_writer()
+    for r_id, (device_type, aggregator, last_timestamp_ns) in device_summaries.items():
+        summary_ref = db.collection("telemetry_summary").document(r_id)
+        summary_writer.set(summary_ref, build_summary_update(device_type, aggregator, last_timestamp_ns), merge=True)
+    raise_for_failed_writes(summary_writer.close(), "telemetry summary")
+
+    fold_into_rollups(device_rollup_samples)
 
+    try:
+        apply_retention({
+            r_id: [sample[0] for sample in device_rollup_samples.get(r_id, ())]
+            for r_id in routers_encountered
+        })
+    except Exception as e:
+        logger.error(f"Error applying telemetry retention: {e}")
 
-            routers_encountered.add(router_id)
+    invalidate_dashboard_cache(*(f"telemetry_raw/{r_id}" for r_id in routers_encountered))
 
-            # Construct doc ID from UtcTimestampNs to avoid duplicates
-            if utc_timestamp_ns:
-                doc_id = str(utc_timestamp_ns)
-            else:
-                doc_id = db.collection("telemetry_raw").document(router_id).collection("records").document().id
+    logger.info("Stored telemetry data (appended as new docs).")
 
-            doc_ref = (
-                db.collection("telemetry_raw")
-                .document(router_id)
-                .collection("records")
-                .document(doc_id)
-            )
+# ---------------------------------------------------------
+# Bucketed Layout Migration
+# ---------------------------------------------------------
+def device_type_for_doc(device_doc_id, record):
+    if record.get("DeviceType"):
+        return record["DeviceType"]
+    return "r" if device_doc_id.startswith("Router-") else "u"
 
-            batch.set(doc_ref, record_dict)
-            writes_in_batch += 1
+def migrate_telemetry_to_buckets(device_ids=None, page_size=1000):
+    """
+    Copy per-sample telemetry_raw records into the bucketed layout. Safe to re-run,
+    since bucket writes are keyed merges. Run with TELEMETRY_LAYOUT=both so new data
+    lands in both formats meanwhile, then switch to "buckets" once it completes.
+    """
+    if device_ids:
+        device_refs = [db.collection("telemetry_raw").document(d) for d in device_ids]
+    else:
+        device_refs = db.collection("telemetry_raw").list_documents()
+
+    writer = new_telemetry_writer()
+    migrated = 0
+    buckets_written = 0
+    for device_ref in device_refs:
+        device_type = None
+        samples = []
+        last_ts = None
+        while True:
+            query = device_ref.collection("records").order_by("UtcTimestampNs").limit(page_size)
+            if last_ts is not None:
+                query = query.start_after({"UtcTimestampNs": last_ts})
+            page = list(query.stream())
+            for snap in page:
+                record = snap.to_dict()
+                last_ts = record.get("UtcTimestampNs")
+                try:
+                    ts = int(last_ts)
+                except (TypeError, ValueError):
+                    continue
+                device_type = device_type or device_type_for_doc(device_ref.id, record)
+                samples.append((ts, record))
+            if len(page) < page_size:
+                break
+        for start_ts, bucket in group_into_buckets(samples).items():
+            writer.set(bucket_ref(device_ref.id, start_ts), build_bucket_update(device_type, start_ts, bucket), merge=True)
+            buckets_written += 1
+        migrated += len(samples)
+        logger.info(f"Migrating {device_ref.id}: {len(samples)} records")
+
+    failed = writer.close()
+    logger.info(
+        f"Migrated {migrated} telemetry records into {buckets_written} bucket docs "
+        f"({len(failed)} bucket writes failed)."
+    )
+    return migrated, failed
 
-            if writes_in_batch >= max_batch_size:
-                commit_batch(batch)
-                batch = db.batch()
-                writes_in_batch = 0
+# ---------------------------------------------------------
+# Retention
+# ---------------------------------------------------------
+# telemetry_raw/{device}/records is trimmed with timestamp-cutoff range deletes,
+# so a pass only reads the documents it removes (no offset scans):
+#   - "count": keep the newest TELEMETRY_RETENTION_COUNT samples per device. The
+#     cutoff comes from the timestamps this process has ingested; the first time
+#     a process sees a device without a full window, the window is seeded with
+#     one read of the newest stored timestamps (so one-shot runs that see a single
+#     small batch still prune). After that a device is only queried when its
+#     cutoff has moved.
+#   - "age": drop samples older than TELEMETRY_RETENTION_SECONDS with one
+#     collection-group query for the whole fleet, at most every
+#     TELEMETRY_RETENTION_INTERVAL seconds.
+# Bucketed telemetry (telemetry_buckets.py) is kept for
+# TELEMETRY_BUCKET_RETENTION_SECONDS, dropping whole bucket docs the same way.
+# Deletes from every device go through one TelemetryWriter.
+TELEMETRY_RETENTION_MODE = os.getenv("TELEMETRY_RETENTION_MODE", "count")
+TELEMETRY_RETENTION_COUNT = int(os.getenv("TELEMETRY_RETENTION_COUNT", "30"))
+TELEMETRY_RETENTION_SECONDS = int(os.getenv("TELEMETRY_RETENTION_SECONDS", str(24 * 3600)))
+TELEMETRY_RETENTION_INTERVAL = int(os.getenv("TELEMETRY_RETENTION_INTERVAL", "300"))
+TELEMETRY_BUCKET_RETENTION_SECONDS = int(os.getenv("TELEMETRY_BUCKET_RETENTION_SECONDS", str(30 * 24 * 3600)))
+
+class RetentionTracker:
+    """Newest timestamps seen per device and the cutoff last applied to each."""
+
+    def __init__(self, keep_count=TELEMETRY_RETENTION_COUNT):
+        self.keep_count = keep_count
+        self._recent = {}   # device_id -> ascending list of the newest keep_count timestamps
+        self._applied = {}  # device_id -> cutoff already pruned up to
+        self._seeded = set()  # devices whose window includes what was already stored
+        self._last_pass = {}  # pass name -> monotonic time it last ran
+        self._lock = threading.Lock()
+
+    def observe(self, device_id, timestamps):
+        with self._lock:
+            merged = set(self._recent.get(device_id, ()))
+            merged.update(timestamps)
+            self._recent[device_id] = sorted(merged)[-self.keep_count:]
+
+    def unseeded(self, device_ids):
+        """Devices without a full window that have not been seeded from Firestore yet."""
+        with self._lock:
+            return [
+                device_id for device_id in device_ids
+                if device_id not in self._seeded and len(self._recent.get(device_id, ())) < self.keep_count
+            ]
+
+    def seed(self, device_id, timestamps):
+        self.observe(device_id, timestamps)
+        with self._lock:
+            self._seeded.add(device_id)
+
+    def pending_cutoffs(self, device_ids):
+        """{device_id: cutoff} for devices with a full window whose cutoff has advanced."""
+        cutoffs = {}
+        with self._lock:
+            for device_id in device_ids:
+                recent = self._recent.get(device_id, ())
+                if len(recent) < self.keep_count:
+                    continue
+                cutoff = recent[0]
+                if cutoff > self._applied.get(device_id, 0):
+                    cutoffs[device_id] = cutoff
+        return cutoffs
+
+    def mark_applied(self, cutoffs):
+        with self._lock:
+            for device_id, cutoff in cutoffs.items():
+                self._applied[device_id] = max(cutoff, self._applied.get(device_id, 0))
+
+    def pass_due(self, name, now):
+        with self._lock:
+            if now - self._last_pass.get(name, float("-inf")) < TELEMETRY_RETENTION_INTERVAL:
+                return False
+            self._last_pass[name] = now
+            return True
 
-        if writes_in_batch > 0:
-            commit_batch(batch)
+retention_tracker = RetentionTracker()
 
-        for r_id in routers_encountered:
-            prune_old_records(r_id, keep_count=30)
-        
+RETENTION_SEED_WORKERS = 8
 
-        logger.info("Stored telemetry data (appended as new docs).")
+def newest_record_timestamps(device_id, count=TELEMETRY_RETENTION_COUNT):
+    """UtcTimestampNs of the newest 'count' stored records of a device."""
+    query = (
+        db.collection("telemetry_raw").document(device_id).collection("records")
+          .order_by("UtcTimestampNs", direction=firestore.Query.DESCENDING)
+          .limit(count)
+          .select(["UtcTimestampNs"])
+    )
+    return [snap.get("UtcTimestampNs") for snap in query.stream()]
+
+def apply_retention(device_timestamps, mode=TELEMETRY_RETENTION_MODE):
+    """
+    Trim telemetry_raw (and telemetry_buckets) after an ingest. 'device_timestamps'
+    maps each device in the batch to the UtcTimestampNs values just written.
+    Returns the delete count.
+    """
+    queries = []
+    cutoffs = {}
+    if mode not in ("count", "age"):
+        logger.error(f"Unknown TELEMETRY_RETENTION_MODE '{mode}'; skipping record retention.")
+    elif writes_records() and mode == "count":
+        for device_id, timestamps in device_timestamps.items():
+            retention_tracker.observe(device_id, timestamps)
+        unseeded = retention_tracker.unseeded(device_timestamps)
+        if unseeded:
+            with ThreadPoolExecutor(max_workers=RETENTION_SEED_WORKERS) as executor:
+                for device_id, stored in zip(unseeded, executor.map(newest_record_timestamps, unseeded)):
+                    retention_tracker.seed(device_id, stored)
+        cutoffs = retention_tracker.pending_cutoffs(device_timestamps)
+        for device_id, cutoff in cutoffs.items():
+            records_ref = db.collection("telemetry_raw").document(device_id).collection("records")
+            queries.append(records_ref.where("UtcTimestampNs", "<", cutoff))
+    elif writes_records() and retention_tracker.pass_due("age", time.monotonic()):
+        cutoff = time.time_ns() - TELEMETRY_RETENTION_SECONDS * 1_000_000_000
+        queries.append(db.collection_group("records").where("UtcTimestampNs", "<", cutoff))
+
+    if writes_buckets() and retention_tracker.pass_due("buckets", time.monotonic()):
+        cutoff_s = int(time.time()) - TELEMETRY_BUCKET_RETENTION_SECONDS
+        queries.append(db.collection_group(BUCKET_SUBCOLLECTION).where("startTs", "<", cutoff_s))
+
+    if not queries:
+        return 0
+
+    deleter = new_telemetry_writer()
+    deleted = 0
+    try:
+        for query in queries:
+            for doc_snapshot in query.select([]).stream():
+                if not doc_snapshot.reference.path.startswith(("telemetry_raw/", f"{BUCKET_COLLECTION}/")):
+                    continue
+                deleter.delete(doc_snapshot.reference)
+                deleted += 1
+    finally:
+        failed = deleter.close()
+    if not failed:
+        retention_tracker.mark_applied(cutoffs)
+    logger.info(f"Retention ({mode}) deleted {deleted - len(failed)} telemetry records across {len(queries)} queries.")
+    return deleted - len(failed)
 
-    except Exception as e:
-        logger.error(f"Error storing telemetry: {e}")
 
 # ---------------------------------------------------------
-# Aggregation
+# Incremental Rollups
 # ---------------------------------------------------------
-def prune_old_records(router_id, keep_count=30):
-    try:
-        subcol_ref = db.collection("telemetry_raw").document(router_id).collection("records")
-        old_records_query = (
-            subcol_ref
-            .order_by("UtcTimestampNs", direction=firestore.Query.DESCENDING)
-            .offset(keep_count)  # skip the newest 'keep_count'
-        )
-        
-        # We can delete in batches of (say) 200 to avoid batch-size limits
-        max_batch_size = 200
+# Ingest folds every new record into fixed 15m buckets (telemetry_rollup_15m).
+# Coarser stored tiers are derived from the next finer tier, and the published
+# windows (telemetry_15m ... telemetry_30d) sum a handful of bucket docs, so the
+# cost follows new data rather than total retained history. See telemetry_rollups
+# for how replays and late samples are told apart.
+# Stored tiers: name -> (bucket minutes, source tier)
+ROLLUP_TIERS = {
+    "15m": (15, None),
+    "3h": (180, "15m"),
+    "1d": (1440, "3h"),
+}
+# Derived buckets are only finalized once this much time has passed after they end
+ROLLUP_LATE_MINUTES = int(os.getenv("ROLLUP_LATE_MINUTES", "15"))
+# How far back a derived tier is built on its first run (covers the 30d window)
+ROLLUP_BACKFILL_MINUTES = 43200
+# Writes per fold_into_rollups() batch (Firestore allows 500 per commit)
+ROLLUP_BATCH_WRITES = 450
+# rollup_seen docs carry expireAt this long after their bucket (enable a Firestore TTL
+# policy on it); a replay of samples older than this would be counted again
+ROLLUP_SEEN_RETENTION_DAYS = int(os.getenv("ROLLUP_SEEN_RETENTION_DAYS", "7"))
+
+def rollup_bucket_ref(tier, start_ts):
+    return db.collection(f"telemetry_rollup_{tier}").document(str(start_ts))
+
+def rollup_sample(record_dict):
+    """(ping, signal) contribution of one record, matching the original window aggregator."""
+    return rollup_values(record_dict.get("PingLatencyMsAvg", 0), record_dict.get("SignalQuality", 0))
+
+def rollup_watermark_ref(name):
+    return db.collection("rollup_watermarks").document(name)
+
+def rollup_seen_ref(device_id, start_ts):
+    return db.collection("rollup_seen").document(f"{device_id}_{start_ts}")
+
+def fold_into_rollups(device_samples):
+    """
+    Fold newly ingested samples into the 15m rollup buckets.
+    device_samples: {device_id: [(utc_timestamp_ns, ping, signal), ...]}
+    Samples already listed in their rollup_seen/{device}_{bucket} doc are skipped,
+    and the doc is extended in the same atomic batch as the Increment transforms,
+    so replaying a batch never double counts while late samples still count.
+    Batches stay under the commit limit and are committed in order; a failure
+    raises, leaving the rest to the replay. Samples landing in 15m buckets that a
+    derived tier has already finalized mark that tier dirty, so roll_up_tier()
+    recomputes them.
+    """
+    if not device_samples:
+        return
+    # Device watermarks from before the seen lists: samples at or below one were
+    # folded under that scheme. They are no longer advanced.
+    legacy_refs = [rollup_watermark_ref(f"device_{device_id}") for device_id in device_samples]
+    derived = [tier for tier, (_, source) in ROLLUP_TIERS.items() if source == "15m"]
+    tier_refs = {tier: rollup_watermark_ref(f"tier_{tier}") for tier in derived}
+    floors = {}
+    tier_ends = {}
+    for snap in db.get_all(legacy_refs + list(tier_refs.values())):
+        if not snap.exists:
+            continue
+        if snap.id.startswith("tier_"):
+            tier_ends[snap.id[len("tier_"):]] = snap.to_dict().get("bucketEndTs")
+        else:
+            floors[snap.id[len("device_"):]] = snap.to_dict().get("utcTimestampNs", 0)
+
+    seen_refs = list({
+        (device_id, sample_bucket(sample[0])): None
+        for device_id, samples in device_samples.items() for sample in samples
+    })
+    seen = {}
+    for i in range(0, len(seen_refs), BULK_READ_CHUNK):
+        for snap in db.get_all([rollup_seen_ref(*key) for key in seen_refs[i:i + BULK_READ_CHUNK]]):
+            if snap.exists:
+                data = snap.to_dict()
+                seen[(data.get("deviceId"), data.get("startTs"))] = set(data.get("timestamps") or ())
+
+    batches = plan_rollup_batches(device_samples, seen, ROLLUP_BATCH_WRITES - len(tier_refs), floors)
+    if not batches:
+        logger.info("Rollups already include this telemetry batch, nothing to fold.")
+        return
+
+    touched = set()
+    for plan in batches:
         batch = db.batch()
-        writes_in_batch = 0
-        
-        for doc_snapshot in old_records_query.stream():
-            batch.delete(doc_snapshot.reference)
-            writes_in_batch += 1
-            
-            if writes_in_batch >= max_batch_size:
-                batch.commit()
-                batch = db.batch()
-                writes_in_batch = 0
-        
-        # Commit any remaining deletes in the batch
-        if writes_in_batch > 0:
-            batch.commit()
-
-        logger.info(f"Pruned old records for router {router_id}, kept the latest {keep_count} docs.")
+        for start_ts, (sum_ping, sum_signal, count) in plan.buckets.items():
+            batch.set(rollup_bucket_ref("15m", start_ts), {
+                "startTs": start_ts,
+                "start": datetime.fromtimestamp(start_ts, tz=timezone.utc).isoformat(),
+                "sum_ping": firestore.Increment(sum_ping),
+                "sum_signal": firestore.Increment(sum_signal),
+                "count": firestore.Increment(count),
+            }, merge=True)
+        for (device_id, start_ts), timestamps in plan.seen.items():
+            batch.set(rollup_seen_ref(device_id, start_ts), {
+                "deviceId": device_id,
+                "startTs": start_ts,
+                "timestamps": firestore.ArrayUnion(timestamps),
+                "expireAt": datetime.fromtimestamp(start_ts, tz=timezone.utc)
+                            + timedelta(days=ROLLUP_SEEN_RETENTION_DAYS),
+            }, merge=True)
+        oldest = min(plan.buckets)
+        for tier, ref in tier_refs.items():
+            if tier_ends.get(tier) is not None and oldest < tier_ends[tier]:
+                batch.set(ref, {"dirtyFromTs": firestore.Minimum(oldest)}, merge=True)
+        commit_batch(batch)
+        touched.update(plan.buckets)
+    logger.info(f"Folded telemetry into {len(touched)} rollup buckets in {len(batches)} batches.")
+
+def sum_rollup_buckets(tier, start_ts, end_ts):
+    """Sum bucket docs of 'tier' with start in [start_ts, end_ts)."""
+    query = (
+        db.collection(f"telemetry_rollup_{tier}")
+        .where("startTs", ">=", start_ts)
+        .where("startTs", "<", end_ts)
+    )
+    total_ping = 0.0
+    total_signal = 0.0
+    total_count = 0
+    for doc in query.stream():
+        data = doc.to_dict()
+        total_ping += data.get("sum_ping", 0)
+        total_signal += data.get("sum_signal", 0)
+        total_count += data.get("count", 0)
+    return total_ping, total_signal, total_count
+
+def roll_up_tier(tier, now=None):
+    """
+    Build complete buckets of a derived tier from its source tier, resuming from the
+    tier watermark. Buckets are written with set(), so reruns are idempotent.
+    A 'dirtyFromTs' on the watermark (late or replayed source data) rewinds the run
+    to that bucket; it is cleared only if nothing re-marked it meanwhile, and the
+    recomputed range is passed on to the tiers derived from this one.
+    """
+    minutes, source = ROLLUP_TIERS[tier]
+    if source is None:
+        return
+    try:
+        now = now or datetime.now(timezone.utc)
+        ready_ts = int(now.timestamp()) - ROLLUP_LATE_MINUTES * 60
+        end_ts = rollup_bucket_start(ready_ts, minutes)
+
+        watermark_ref = rollup_watermark_ref(f"tier_{tier}")
+        watermark = watermark_ref.get()
+        state = watermark.to_dict() if watermark.exists else {}
+        built_end = state.get("bucketEndTs")
+        start_ts = built_end
+        if start_ts is None:
+            start_ts = rollup_bucket_start(end_ts - ROLLUP_BACKFILL_MINUTES * 60, minutes)
+        dirty_ts = state.get("dirtyFromTs")
+        if dirty_ts is not None:
+            start_ts = min(start_ts, rollup_bucket_start(dirty_ts, minutes))
+
+        built = 0
+        for bucket_ts in range(start_ts, end_ts, minutes * 60):
+            sum_ping, sum_signal, count = sum_rollup_buckets(source, bucket_ts, bucket_ts + minutes * 60)
+            rollup_bucket_ref(tier, bucket_ts).set({
+                "startTs": bucket_ts,
+                "start": datetime.fromtimestamp(bucket_ts, tz=timezone.utc).isoformat(),
+                "sum_ping": sum_ping,
+                "sum_signal": sum_signal,
+                "count": count,
+            })
+            built += 1
+
+        if built_end is not None and start_ts < built_end:
+            for child, (_, child_source) in ROLLUP_TIERS.items():
+                if child_source == tier:
+                    rollup_watermark_ref(f"tier_{child}").set(
+                        {"dirtyFromTs": firestore.Minimum(start_ts)}, merge=True
+                    )
+        new_end = max(end_ts, built_end or end_ts)
+        if dirty_ts is not None:
+            try:
+                watermark_ref.update(
+                    {"bucketEndTs": new_end, "dirtyFromTs": firestore.DELETE_FIELD},
+                    option=db.write_option(last_update_time=watermark.update_time),
+                )
+            except FailedPrecondition:
+                logger.info(f"Tier {tier} was marked dirty again during the run; it is recomputed next run.")
+        elif new_end != built_end:
+            watermark_ref.set({"bucketEndTs": new_end}, merge=True)
+        logger.info(f"Rolled up {built} {tier} buckets from {source}.")
     except Exception as e:
-        logger.error(f"Error pruning old records for router {router_id}: {e}")
+        logger.error(f"Error rolling up tier {tier}: {e}")
 
+def roll_up_all_tiers(up_to=None, now=None):
+    """Bring derived tiers up to date, finest first, stopping after 'up_to'."""
+    for tier in ROLLUP_TIERS:
+        roll_up_tier(tier, now)
+        if tier == up_to:
+            break
 
-def aggregate_time_window(collection_name, minutes):
-    try:
-        now = datetime.now(timezone.utc)
-        # Round to minute
-        end = now.replace(second=0, microsecond=0)
-        start = end - timedelta(minutes=minutes)
-
-        total_ping = 0.0
-        total_signal = 0.0
-        total_count = 0
-
-        # Iterate all router docs
-        router_docs = db.collection("telemetry_raw").stream()
-        for router_doc in router_docs:
-            subcol_ref = router_doc.reference.collection("records")
-            # Query for timestamp in [start, end)
+# ---------------------------------------------------------
+# Fleet-wide Aggregation (collection-group queries)
+# ---------------------------------------------------------
+# One query over every telemetry_raw/*/records subcollection instead of one query
+# per device. Needs a collection-group index on records.timestamp. Published windows
+# use it for the part of their range older than the first 15m rollup bucket (history
+# stored before rollups existed); FLEET_AGGREGATION_MODE picks how it runs.
+FLEET_AGGREGATION_MODE = os.getenv("FLEET_AGGREGATION_MODE", "aggregation")
+FLEET_PAGE_SIZE = int(os.getenv("FLEET_PAGE_SIZE", "1000"))
+
+def fleet_records_query(start, end):
+    return (
+        db.collection_group("records")
+        .where("timestamp", ">=", start.isoformat())
+        .where("timestamp", "<", end.isoformat())
+    )
+
+def aggregate_fleet_window(start, end, mode=None):
+    """
+    Sum ping/signal and count telemetry records across the whole fleet in [start, end).
+    Returns (total_ping, total_signal, total_count).
+
+    Modes:
+      - "aggregation": server-side count()/sum() aggregation query, one round trip
+      - "stream":      client-side fold over a paged collection-group scan that only
+                       pulls the two summed columns
+      - "per_device":  the original one-query-per-device scan, kept for benchmarking
+    """
+    mode = mode or FLEET_AGGREGATION_MODE
+    if mode == "aggregation":
+        aggregation = (
+            fleet_records_query(start, end)
+            .count(alias="count")
+            .sum("PingLatencyMsAvg", alias="sum_ping")
+            .sum("SignalQuality", alias="sum_signal")
+        )
+        values = {result.alias: result.value for row in aggregation.get() for result in row}
+        return float(values.get("sum_ping") or 0), float(values.get("sum_signal") or 0), int(values.get("count") or 0)
+
+    total_ping = 0.0
+    total_signal = 0.0
+    total_count = 0
+
+    if mode == "stream":
+        base = fleet_records_query(start, end).select(["PingLatencyMsAvg", "SignalQuality"]).order_by("timestamp")
+        last_doc = None
+        while True:
+            page = base.limit(FLEET_PAGE_SIZE)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+            docs = list(page.stream())
+            for rec_doc in docs:
+                ping, signal = rollup_sample(rec_doc.to_dict())
+                total_ping += ping
+                total_signal += signal
+                total_count += 1
+            if len(docs) < FLEET_PAGE_SIZE:
+                break
+            last_doc = docs[-1]
+        return total_ping, total_signal, total_count
+
+    if mode == "per_device":
+        for router_doc in db.collection("telemetry_raw").stream():
             query = (
-                subcol_ref
+                router_doc.reference.collection("records")
                 .filter("timestamp", ">=", start.isoformat())
                 .filter("timestamp", "<", end.isoformat())
             )
             for rec_doc in query.stream():
-                rec_data = rec_doc.to_dict()
-                try:
-                    ping = float(rec_data.get("PingLatencyMsAvg", 0))
-                    signal = float(rec_data.get("SignalQuality", 0))
-                except:
-                    ping = 0
-                    signal = 0
+                ping, signal = rollup_sample(rec_doc.to_dict())
                 total_ping += ping
                 total_signal += signal
                 total_count += 1
+        return total_ping, total_signal, total_count
+
+    raise ValueError(f"Unknown fleet aggregation mode: {mode}")
+
+# startTs of the oldest 15m rollup bucket; buckets are never pruned, so read once per process
+_rollup_start_ts = None
+
+def rollup_coverage_start():
+    """Start of the oldest 15m rollup bucket, or None while nothing has been folded."""
+    global _rollup_start_ts
+    if _rollup_start_ts is None:
+        oldest = db.collection("telemetry_rollup_15m").order_by("startTs").limit(1).get()
+        if oldest:
+            _rollup_start_ts = oldest[0].to_dict().get("startTs")
+    return _rollup_start_ts
+
+def benchmark_fleet_aggregation(minutes=1440, repeat=3):
+    """
+    Time every fleet aggregation mode over the last 'minutes'. Point it at the
+    Firestore emulator with FIRESTORE_EMULATOR_HOST to compare without billing.
+    """
+    end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start = end - timedelta(minutes=minutes)
+    timings = {}
+    for mode in ("per_device", "stream", "aggregation"):
+        best = None
+        result = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = aggregate_fleet_window(start, end, mode)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[mode] = best
+        logger.info(f"[BENCH] {mode:<12} best of {repeat}: {best * 1000:.1f} ms, result={result}")
+    return timings
+
+def aggregate_time_window(collection_name, minutes):
+    """
+    Publish the average ping/signal over the last 'minutes' into 'collection_name'.
+    The window ends on the last completed boundary of the coarsest stored tier that
+    tiles it, and is summed from that tier's bucket docs; any part of it older than
+    the rollups is summed from the raw records with aggregate_fleet_window().
+    """
+    try:
+        tier = max(
+            (name for name, (size, _) in ROLLUP_TIERS.items() if minutes % size == 0),
+            key=lambda name: ROLLUP_TIERS[name][0],
+        )
+        size = ROLLUP_TIERS[tier][0]
+        roll_up_all_tiers(up_to=tier)
+
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        ready_ts = now_ts if tier == "15m" else now_ts - ROLLUP_LATE_MINUTES * 60
+        end_ts = rollup_bucket_start(ready_ts, size)
+        start_ts = end_ts - minutes * 60
+        end = datetime.fromtimestamp(end_ts, tz=timezone.utc)
+
+        total_ping, total_signal, total_count = sum_rollup_buckets(tier, start_ts, end_ts)
+        covered_ts = rollup_coverage_start()
+        if covered_ts is None or covered_ts > start_ts:
+            backfill_end = end if covered_ts is None else datetime.fromtimestamp(min(covered_ts, end_ts), tz=timezone.utc)
+            ping, signal, count = aggregate_fleet_window(datetime.fromtimestamp(start_ts, tz=timezone.utc), backfill_end)
+            total_ping += ping
+            total_signal += signal
+            total_count += count
 
         if total_count > 0:
             agg_data = {
@@ -490,137 +1487,339 @@ def aggregate_30d():
 # -------------------------------
 # Endpoints Update Functions (1-9)
 # -------------------------------
-def update_endpoints():
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "6"))
+
+def sync_accounts(results):
+    logger.info("Endpoint 1: Fetching accounts...")
+    url_accounts = "https://web-api.starlink.com/enterprise/v1/accounts"
+    params_accounts = {"limit": 50, "page": 0}
+    results["accounts"] = fetch_and_store_pages(url_accounts, store_accounts, method='GET', params=params_accounts)
+    logger.info(f"Fetched {results['accounts']} accounts.")
+
+def sync_billing_cycles(results):
+    logger.info("Endpoint 2: Fetching billing cycles...")
+    url_billing = "https://web-api.starlink.com/enterprise/v1/accounts/ACC-4570165-26134-9/billing-cycles/query"
+    billing_payload = {
+        "previousBillingCycles": 8,
+        "pageIndex": 0,
+        "pageLimit": 50,
+    }
+    results["billing_cycles"] = fetch_and_store_pages(
+        url_billing, lambda records: store_billing_records("ACC-4570165-26134-9", records),
+        method='POST', json_data=billing_payload,
+    )
+    logger.info(f"Total billing records fetched: {results['billing_cycles']}")
+
+def sync_addresses(results):
+    logger.info("Endpoint 3: Fetching addresses...")
+    url_addresses = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/addresses"
+    params_addresses = {"limit": 50, "page": 0}
+    results["addresses"] = fetch_and_store_pages(url_addresses, store_addresses, method='GET', params=params_addresses)
+    logger.info(f"Fetched {results['addresses']} addresses.")
+
+def sync_single_address(results):
+    logger.info("Endpoint 4: Fetching single address...")
+    address_reference_id = "5dc3e828-eac9-4ffa-94e8-c85fd0394fbd"
+    url_single_address = f"https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/addresses/{address_reference_id}"
+    response_address = make_authorized_request(url_single_address, method='GET')
+    single_address = response_address.json()
+    results["single_address"] = single_address
+    store_single_address(single_address)
+
+def sync_router_configs(results):
+    logger.info("Endpoint 5: Fetching router configs...")
+    url_routers = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/routers/configs"
+    params_routers = {"page": 0, "limit": 50}
+    results["routers_configs"] = fetch_and_store_pages(url_routers, store_router_configs, method='GET', params=params_routers)
+
+def sync_single_router_config(results):
+    logger.info("Endpoint 6: Fetching single router config...")
+    config_id = "DVC_CFG-28159-32854-41"
+    url_single_router = f"https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/routers/configs/{config_id}"
+    response_router = make_authorized_request(url_single_router, method='GET')
+    single_router_config = response_router.json()
+    results["single_router_config"] = single_router_config
+    store_single_router_config(single_router_config)
+
+def sync_service_lines(results):
+    logger.info("Endpoint 7: Fetching service lines...")
+    url_service_lines = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/service-lines"
+    params_service_lines = {"limit": 50, "page": 0}
+    results["service_lines"] = fetch_and_store_pages(url_service_lines, store_service_lines, method='GET', params=params_service_lines)
+
+def sync_single_service_line(results):
+    logger.info("Endpoint 8: Fetching single service line...")
+    service_line = "SL-3734495-34282-79"
+    url_single_service_line = f"https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/service-lines/{service_line}"
+    response_service_line = make_authorized_request(url_single_service_line, method='GET')
+    single_service_line_data = response_service_line.json()
+    results["single_service_line"] = single_service_line_data
+    store_single_service_line(single_service_line_data)
+
+def sync_user_terminals(results):
+    logger.info("Endpoint 9: Fetching user terminals...")
+    url_user_terminals = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/user-terminals"
+    params_user_terminals = {"limit": 50, "page": 0}
+    results["user_terminals"] = fetch_and_store_pages(url_user_terminals, store_user_terminals, method='GET', params=params_user_terminals)
+
+# Each chain runs in order on one worker; chains run concurrently. Endpoints that
+# write the same documents share a chain so the later one still wins.
+SYNC_STAGE_CHAINS = [
+    [("Endpoint 1 (accounts)", sync_accounts)],
+    [("Endpoint 2 (billing cycles)", sync_billing_cycles)],
+    [("Endpoint 3 (addresses)", sync_addresses), ("Endpoint 4 (single address)", sync_single_address)],
+    [("Endpoint 5 (router configs)", sync_router_configs), ("Endpoint 6 (single router config)", sync_single_router_config)],
+    # User terminals follow the service lines: their device index reads the service line docs
+    [
+        ("Endpoint 7 (service lines)", sync_service_lines),
+        ("Endpoint 8 (single service line)", sync_single_service_line),
+        ("Endpoint 9 (user terminals)", sync_user_terminals),
+    ],
+]
+
+def run_stage_chain(chain, results, timings):
+    for name, stage in chain:
+        started = time.perf_counter()
+        try:
+            stage(results)
+        except Exception as e:
+            logger.error(f"Error in {name}: {e}")
+        finally:
+            timings[name] = time.perf_counter() - started
+
+def update_endpoints(max_workers=SYNC_WORKERS):
     """Fetch and update endpoints 1-9 in Firestore (accounts, billing, addresses, router configs, service lines, user terminals)."""
     results = {}
-    # Endpoint 1: Accounts
-    try:
-        logger.info("Endpoint 1: Fetching accounts...")
-        url_accounts = "https://web-api.starlink.com/enterprise/v1/accounts"
-        params_accounts = {"limit": 50, "page": 0}
-        accounts = fetch_all_pages(url_accounts, method='GET', params=params_accounts)
-        results["accounts"] = accounts
-        logger.info(f"Fetched {len(accounts)} accounts.")
-        for acc in accounts:
-            store_account(acc)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 1 (accounts): {e}")
+    timings = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync") as executor:
+        futures = [executor.submit(run_stage_chain, chain, results, timings) for chain in SYNC_STAGE_CHAINS]
+        for future in futures:
+            future.result()
+    total = time.perf_counter() - started
+
+    for chain in SYNC_STAGE_CHAINS:
+        for name, _ in chain:
+            logger.info(f"[TIMING] {name}: {timings.get(name, 0):.2f}s")
+    logger.info(f"[TIMING] update_endpoints total: {total:.2f}s (serial sum {sum(timings.values()):.2f}s)")
+    logger.info(f"[HTTP] {get_http_stats()}")
+    return results, timings
 
-    # Endpoint 2: Billing Cycles
-    try:
-        logger.info("Endpoint 2: Fetching billing cycles...")
-        url_billing = "https://web-api.starlink.com/enterprise/v1/accounts/ACC-4570165-26134-9/billing-cycles/query"
-        billing_payload = {
-            "previousBillingCycles": 8,
-            "pageIndex": 0,
-            "pageLimit": 50,
-        }
-        all_billing_records = fetch_all_pages(url_billing, method='POST', json_data=billing_payload)
-        logger.info(f"Billing cycles fetched: {all_billing_records}")
-        for record in all_billing_records:
-            store_billing_record("ACC-4570165-26134-9", record)
-        results["billing_cycles"] = all_billing_records
-        logger.info(f"Total billing records fetched: {len(all_billing_records)}")
-    except Exception as e:
-        logger.error(f"Error in Endpoint 2 (billing cycles): {e}")
+# -------------------------------
+# Telemetry Update Function (Endpoint 10)
+# -------------------------------
+TELEMETRY_STREAM_URL = "https://web-api.starlink.com/telemetry/stream/v1/telemetry"
+TELEMETRY_BATCH_SIZE = 4000
+TELEMETRY_LINGER_MS = 15000
+
+def fetch_telemetry_batch():
+    telemetry_payload = {
+        "accountNumber": "ACC-4570165-26134-9",
+        "batchSize": TELEMETRY_BATCH_SIZE,
+        "maxLingerMs": TELEMETRY_LINGER_MS
+    }
+    # The stream may hold the request open for maxLingerMs before answering
+    response_telemetry = make_authorized_request(
+        url=TELEMETRY_STREAM_URL, method='POST', json=telemetry_payload, timeout=TELEMETRY_LINGER_MS / 1000 + 10
+    )
+    return response_telemetry.json()
 
-    # Endpoint 3: Addresses
+def update_telemetry():
     try:
-        logger.info("Endpoint 3: Fetching addresses...")
-        url_addresses = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/addresses"
-        params_addresses = {"limit": 50, "page": 0}
-        addresses = fetch_all_pages(url_addresses, method='GET', params=params_addresses)
-        results["addresses"] = addresses
-        logger.info(f"Fetched {len(addresses)} addresses.")
-        for addr in addresses:
-            store_address(addr)
+        logger.info("Endpoint 10: Fetching telemetry...")
+        store_telemetry(fetch_telemetry_batch())
     except Exception as e:
-        logger.error(f"Error in Endpoint 3 (addresses): {e}")
+        logger.error(f"Error in Endpoint 10 (telemetry): {e}")
 
-    # Endpoint 4: Single Address
-    try:
-        logger.info("Endpoint 4: Fetching single address...")
-        address_reference_id = "5dc3e828-eac9-4ffa-94e8-c85fd0394fbd"
-        url_single_address = f"https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/addresses/{address_reference_id}"
-        response_address = make_authorized_request(url_single_address, method='GET')
-        single_address = response_address.json()
-        results["single_address"] = single_address
-        store_single_address(single_address)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 4 (single address): {e}")
+# -------------------------------
+# Streaming Telemetry Consumer
+# -------------------------------
+TELEMETRY_WRITERS = int(os.getenv("TELEMETRY_WRITERS", "4"))
+# Undrained spool bytes per writer before the stream puller blocks (backpressure)
+TELEMETRY_SPOOL_MAX_BYTES = int(os.getenv("TELEMETRY_SPOOL_MAX_BYTES", str(1024 * 1024 * 1024)))
+TELEMETRY_METRICS_INTERVAL = int(os.getenv("TELEMETRY_METRICS_INTERVAL", "30"))
+TELEMETRY_RETRY_MAX_SECONDS = 60
 
-    # Endpoint 5: Router Configs
-    try:
-        logger.info("Endpoint 5: Fetching router configs...")
-        url_routers = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/routers/configs"
-        params_routers = {"page": 0, "limit": 50}
-        routers_configs = fetch_all_pages(url_routers, method='GET', params=params_routers)
-        results["routers_configs"] = routers_configs
-        store_router_configs(routers_configs)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 5 (router configs): {e}")
+class TelemetryConsumer:
+    """
+    Long-running consumer for the telemetry stream.
+    One puller keeps POSTing to the stream, splits each batch by DeviceId and
+    appends the parts to per-writer on-disk spools (telemetry_spool.py) before
+    anything touches Firestore. Writer threads drain their spool in order through
+    write_telemetry and only advance its checkpoint once a batch is stored, retrying
+    with backoff while Firestore is failing (SpoolDrainer). Batches Firestore rejects
+    as invalid, or that still fail after TELEMETRY_MAX_ATTEMPTS, go to the partition's
+    dead-letter spool instead of blocking it; see replay_dead_letters(). A device always lands on the same
+    writer, so its records are stored in order (the summary docs rely on that). Undrained batches survive restarts and are replayed.
+    """
 
-    # Endpoint 6: Single Router Config
-    try:
-        logger.info("Endpoint 6: Fetching single router config...")
-        config_id = "DVC_CFG-28159-32854-41"
-        url_single_router = f"https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/routers/configs/{config_id}"
-        response_router = make_authorized_request(url_single_router, method='GET')
-        single_router_config = response_router.json()
-        results["single_router_config"] = single_router_config
-        store_single_router_config(single_router_config)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 6 (single router config): {e}")    # Endpoint 7: Service Lines
-    try:
-        logger.info("Endpoint 7: Fetching service lines...")
-        url_service_lines = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/service-lines"
-        params_service_lines = {"limit": 50, "page": 0}
-        service_lines = fetch_all_pages(url_service_lines, method='GET', params=params_service_lines)
-        results["service_lines"] = service_lines
-        store_service_lines(service_lines)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 7 (service lines): {e}")
+    def __init__(self, writers=TELEMETRY_WRITERS, spool_dir=TELEMETRY_SPOOL_DIR):
+        # Keep draining partitions left by a previous run with more writers
+        os.makedirs(spool_dir, exist_ok=True)
+        existing = [name for name in os.listdir(spool_dir) if name.startswith("partition-")]
+        writers = max(writers, len(existing))
+        self.stop_event = threading.Event()
+        self.spools = [TelemetrySpool(os.path.join(spool_dir, f"partition-{i}")) for i in range(writers)]
+        self._stats_lock = threading.Lock()
+        self.records_in = 0
+        self.records_out = 0
+        self.drainers = [
+            SpoolDrainer(spool, self._store, is_permanent=is_permanent_write_error,
+                         backoff_max=TELEMETRY_RETRY_MAX_SECONDS, stop_event=self.stop_event)
+            for spool in self.spools
+        ]
+        self.last_delay_s = None
+        self.started_at = None
+
+    def partition(self, telemetry_data):
+        """Split one stream batch into per-writer payloads keyed by DeviceId."""
+        data = telemetry_data.get("data", {})
+        column_names = data.get("columnNamesByDeviceType", {})
+        device_id_index = {
+            device_type: cols.index("DeviceId") for device_type, cols in column_names.items() if "DeviceId" in cols
+        }
+        parts = [[] for _ in self.spools]
+        for record in data.get("values", []):
+            if not record:
+                continue
+            index = device_id_index.get(record[0])
+            device_id = record[index] if index is not None and index < len(record) else ""
+            parts[zlib.crc32(str(device_id).encode()) % len(parts)].append(record)
+        return [
+            {"data": {"columnNamesByDeviceType": column_names, "values": values}} if values else None
+            for values in parts
+        ]
+
+    def run(self):
+        self.started_at = time.monotonic()
+        writers = [
+            threading.Thread(target=self._writer, args=(drainer,), name=f"telemetry-writer-{i}", daemon=True)
+            for i, drainer in enumerate(self.drainers)
+        ]
+        for thread in writers:
+            thread.start()
+        metrics = threading.Thread(target=self._report_metrics, name="telemetry-metrics", daemon=True)
+        metrics.start()
+        logger.info(f"Telemetry consumer started with {len(writers)} writers.")
+
+        while not self.stop_event.is_set():
+            try:
+                telemetry_data = fetch_telemetry_batch()
+            except Exception as e:
+                logger.error(f"Error pulling telemetry stream: {e}")
+                self.stop_event.wait(5)
+                continue
+            for spool, payload in zip(self.spools, self.partition(telemetry_data)):
+                if payload is None:
+                    continue
+                self._append(spool, payload)
+                with self._stats_lock:
+                    self.records_in += len(payload["data"]["values"])
+
+        logger.info("Telemetry consumer stopping; undrained batches stay spooled for the next run...")
+        for thread in writers:
+            thread.join()
+        for spool in self.spools:
+            spool.close()
+        self._log_metrics()
+        logger.info("Telemetry consumer stopped.")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _append(self, spool, payload):
+        # The spool absorbs Firestore slowness; only block when it grows past the cap
+        while spool.pending_bytes() > TELEMETRY_SPOOL_MAX_BYTES and not self.stop_event.is_set():
+            self.stop_event.wait(1)
+        spool.append(payload)
+
+    @staticmethod
+    def _store(payload, replay):
+        write_telemetry(payload, replay=replay)
+
+    def _writer(self, drainer):
+        while not self.stop_event.is_set():
+            result = drainer.drain_next(timeout=1)
+            if result is None:
+                continue
+            outcome, payload = result
+            if outcome != "stored":
+                continue
+            values = payload["data"]["values"]
+            newest_ns = self._newest_timestamp_ns(payload)
+            with self._stats_lock:
+                self.records_out += len(values)
+                if newest_ns:
+                    self.last_delay_s = time.time() - newest_ns / 1_000_000_000
+
+    @staticmethod
+    def _newest_timestamp_ns(payload):
+        data = payload["data"]
+        newest = 0
+        for device_type, cols in data["columnNamesByDeviceType"].items():
+            if "UtcTimestampNs" not in cols:
+                continue
+            index = cols.index("UtcTimestampNs")
+            for record in data["values"]:
+                if record[0] == device_type and index < len(record) and record[index]:
+                    newest = max(newest, int(record[index]))
+        return newest
+
+    def metrics(self):
+        elapsed = max(time.monotonic() - (self.started_at or time.monotonic()), 1e-9)
+        with self._stats_lock:
+            return {
+                "records_in": self.records_in,
+                "records_out": self.records_out,
+                "records_per_sec": self.records_out / elapsed,
+                "retries": sum(drainer.retries for drainer in self.drainers),
+                "dead_lettered": sum(drainer.dead_lettered for drainer in self.drainers),
+                "spool_pending_bytes": sum(spool.pending_bytes() for spool in self.spools),
+                "end_to_end_delay_s": self.last_delay_s,
+            }
 
-    # Endpoint 8: Single Service Line
-    try:
-        logger.info("Endpoint 8: Fetching single service line...")
-        service_line = "SL-3734495-34282-79"
-        url_single_service_line = f"https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/service-lines/{service_line}"
-        response_service_line = make_authorized_request(url_single_service_line, method='GET')
-        single_service_line_data = response_service_line.json()
-        results["single_service_line"] = single_service_line_data
-        store_single_service_line(single_service_line_data)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 8 (single service line): {e}")
+    def _log_metrics(self):
+        logger.info(f"[TELEMETRY] {self.metrics()}")
 
-    # Endpoint 9: User Terminals
-    try:
-        logger.info("Endpoint 9: Fetching user terminals...")
-        url_user_terminals = "https://web-api.starlink.com/enterprise/v1/account/ACC-4570165-26134-9/user-terminals"
-        params_user_terminals = {"limit": 50, "page": 0}
-        user_terminals = fetch_all_pages(url_user_terminals, method='GET', params=params_user_terminals)
-        results["user_terminals"] = user_terminals
-        store_user_terminals(user_terminals)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 9 (user terminals): {e}")
+    def _report_metrics(self):
+        while not self.stop_event.wait(TELEMETRY_METRICS_INTERVAL):
+            self._log_metrics()
 
-# -------------------------------
-# Telemetry Update Function (Endpoint 10)
-# -------------------------------
-def update_telemetry():
-    try:
-        logger.info("Endpoint 10: Fetching telemetry...")
-        url_telemetry = "https://web-api.starlink.com/telemetry/stream/v1/telemetry"
-        telemetry_payload = {
-            "accountNumber": "ACC-4570165-26134-9",
-            "batchSize": 4000,
-            "maxLingerMs": 15000
-        }
-        response_telemetry = make_authorized_request(url=url_telemetry, method='POST', json=telemetry_payload)
-        telemetry_data = response_telemetry.json()
-        store_telemetry(telemetry_data)
-    except Exception as e:
-        logger.error(f"Error in Endpoint 10 (telemetry): {e}")
+def replay_dead_letters(spool_dir=TELEMETRY_SPOOL_DIR):
+    """
+    Store every dead-lettered batch again (after fixing whatever rejected it).
+    Stops at the first batch that still fails; it stays dead-lettered.
+    """
+    replayed = 0
+    for name in sorted(os.listdir(spool_dir)) if os.path.isdir(spool_dir) else []:
+        dead_letter_dir = os.path.join(spool_dir, name, DEAD_LETTER_DIR)
+        if not name.startswith("partition-") or not os.path.isdir(dead_letter_dir):
+            continue
+        spool = TelemetrySpool(dead_letter_dir)
+        try:
+            while True:
+                entry = spool.read_next(timeout=0)
+                if entry is None:
+                    break
+                position, dead_letter = entry
+                try:
+                    write_telemetry(dead_letter["payload"], replay=True)
+                except Exception as e:
+                    logger.error(f"Dead-lettered batch in {dead_letter_dir} still fails ({e}); stopping.")
+                    return replayed
+                spool.commit(position)
+                replayed += 1
+        finally:
+            spool.close()
+    logger.info(f"Replayed {replayed} dead-lettered telemetry batches.")
+    return replayed
+
+def run_telemetry_consumer():
+    """Run the consumer until SIGINT/SIGTERM; unstored batches stay in the spool."""
+    consumer = TelemetryConsumer()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: consumer.stop())
+    consumer.run()
 
 # -------------------------------
 # Scheduler & Main Loop
@@ -631,6 +1830,8 @@ def main():
     update_telemetry()
     # aggregate_15m()
     # aggregate_1h()
+    # For continuous ingestion run the streaming consumer instead of update_telemetry:
+    #   python Data_Storage.py consume-telemetry
     # If you want to do repeated scheduling, un-comment and install "schedule" package:
     # schedule.every(1).hours.do(update_endpoints)
     # schedule.every(15).seconds.do(update_telemetry)
@@ -648,7 +1849,16 @@ def main():
 
 if __name__ == '__main__':
     try:
-        main()
+        if len(sys.argv) > 1 and sys.argv[1] == "benchmark-fleet":
+            benchmark_fleet_aggregation(int(sys.argv[2]) if len(sys.argv) > 2 else 1440)
+        elif len(sys.argv) > 1 and sys.argv[1] == "consume-telemetry":
+            run_telemetry_consumer()
+        elif len(sys.argv) > 1 and sys.argv[1] == "replay-dead-letters":
+            replay_dead_letters()
+        elif len(sys.argv) > 1 and sys.argv[1] == "migrate-telemetry-buckets":
+            migrate_telemetry_to_buckets(sys.argv[2:] or None)
+        else:
+            main()
     except KeyboardInterrupt:
         logger.info("Service stopped by user.")
     except Exception as e:
@@ -0,0 +1,490 @@
+"""
+ASGI entry point for StarLink Dashboard.
+
+The hot API routes (GET /api/dashboard-data/<service line> and POST /api/login)
+are served natively on the event loop with the async Firestore client and an
+async HTTP client for identitytoolkit, so a request waiting on Firestore holds
+no worker thread. Every other route (templates, static files, registration) is
+the unchanged Flask app behind asgiref's WsgiToAsgi.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers N
+
+Responses, status codes, caching and authorization are the same as in the sync
+mode (wsgi.py); both share server.py's helpers and caches. CORS headers on the
+native routes come from the Flask app's Flask-CORS policy, and preflight
+(OPTIONS) requests for them are answered by Flask-CORS itself.
+"""
+import os
+import re
+import asyncio
+import logging
+from urllib.parse import parse_qsl
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from flask_cors.core import get_cors_options, get_cors_headers
+from firebase_admin import firestore_async
+from google.api_core.exceptions import GoogleAPICallError, DeadlineExceeded, ResourceExhausted
+
+import server
+from dashboard_cache import MemoryCacheBackend, read_dashboard_cache, write_dashboard_cache
+from dashboard_stream import DashboardStreamEncoder, DASHBOARD_STREAM_BATCH_RECORDS
+from dashboard_query import parse_dashboard_query
+from fetch_graph import run_fetch_graph_async
+from response_compression import COMPRESSION_MIN_BYTES, StreamCompressor, negotiate_encoding, compress
+from firebase_tokens import InvalidIdToken, CertificateFetchError
+from telemetry_fields import TelemetryAggregator, fields_for_device, projection_for_device, summary_to_aggregates
+
+logger = logging.getLogger(__name__)
+
+adb = firestore_async.client()
+flask_app = WsgiToAsgi(server.app)
+
+DASHBOARD_ROUTE = re.compile(r"^/api/dashboard-data/([^/]+)$")
+MAX_REQUEST_BODY = 64 * 1024
+# Same options CORS(app) resolved for the Flask routes
+CORS_OPTIONS = get_cors_options(server.app)
+
+_identity_client = None
+
+def identity_client() -> httpx.AsyncClient:
+    """Pooled keep-alive client for identitytoolkit, created on the running loop."""
+    global _identity_client
+    if _identity_client is None:
+        _identity_client = httpx.AsyncClient(
+            timeout=10, limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+    return _identity_client
+
+# ---------------------------------------------------
+# Request / response helpers
+# ---------------------------------------------------
+class JSONResponse:
+    def __init__(self, data, status=200, headers=None):
+        self.body = data if isinstance(data, bytes) else server.app.json.dumps_bytes(data)
+        self.status = status
+        self.headers = headers or {}
+
+class StreamingResponse:
+    """200 response whose body comes from an async iterator of str chunks."""
+    def __init__(self, chunks, mimetype):
+        self.chunks = chunks
+        self.mimetype = mimetype
+
+def response_headers(scope, content_type: str, extra: dict = None) -> list:
+    headers = [(b"content-type", content_type.encode())]
+    headers += [(name.lower().encode(), str(value).encode()) for name, value in (extra or {}).items()]
+    origin = request_header(scope, b"origin")
+    if origin:
+        cors = get_cors_headers(CORS_OPTIONS, {"Origin": origin}, scope["method"])
+        headers += [(name.lower().encode(), str(value).encode()) for name, value in cors.items()]
+    return headers
+
+async def send_response(send, scope, response):
+    """Send a JSONResponse or StreamingResponse, compressed as negotiated (see server.compress_response)."""
+    encoding = negotiate_encoding(request_header(scope, b"accept-encoding"))
+    if isinstance(response, StreamingResponse):
+        extra = {"Vary": "Accept-Encoding"}
+        if encoding:
+            extra["Content-Encoding"] = encoding
+            compressor = StreamCompressor(encoding)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": response_headers(scope, response.mimetype, extra)})
+        async for chunk in response.chunks:
+            if chunk:
+                body = compressor.compress(chunk) if encoding else chunk.encode("utf-8")
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        await send({"type": "http.response.body", "body": compressor.finish() if encoding else b""})
+        return
+
+    body, extra = response.body, {"Vary": "Accept-Encoding", **response.headers}
+    if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+        body = compress(body, encoding)
+        extra["Content-Encoding"] = encoding
+    extra["Content-Length"] = len(body)
+    await send({"type": "http.response.start", "status": response.status,
+                "headers": response_headers(scope, "application/json", extra)})
+    await send({"type": "http.response.body", "body": body})
+
+def request_header(scope, name: bytes) -> str:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+async def read_body(receive) -> bytes:
+    """Full request body; raises ValueError past MAX_REQUEST_BODY."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if len(body) > MAX_REQUEST_BODY:
+            raise ValueError("Request body too large")
+        if not message.get("more_body"):
+            break
+    return bytes(body)
+
+def firestore_busy_response(message) -> JSONResponse:
+    return JSONResponse({"error": message}, 503, {"Retry-After": server.FIRESTORE_RETRY_AFTER})
+
+async def cache_call(fn, *args, **kwargs):
+    """
+    Run a never-raising dashboard_cache helper. The in-process cache is a dict
+    lookup; a Redis round trip goes to a thread.
+    """
+    if isinstance(server.dashboard_cache, MemoryCacheBackend):
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+# ---------------------------------------------------
+# Async Firestore access (mirrors the helpers in server.py)
+# ---------------------------------------------------
+async def retry_firestore_get(doc_ref, max_retries=2):
+    """See server.retry_firestore_get: quota errors and timeouts are raised at once."""
+    for attempt in range(max_retries):
+        try:
+            return await doc_ref.get(timeout=5)
+        except (ResourceExhausted, DeadlineExceeded):
+            raise
+        except GoogleAPICallError:
+            if attempt >= max_retries - 1:
+                raise
+
+async def get_service_line(service_line_number: str) -> dict:
+    doc = await adb.collection("service_lines").document(service_line_number).get()
+    return doc.to_dict() if doc.exists else None
+
+async def get_formatted_address(address_ref_id: str) -> str:
+    doc = await adb.collection("addresses").document(address_ref_id).get()
+    return doc.to_dict().get("formattedAddress") if doc.exists else None
+
+async def get_billing_records_for_service_line(service_line_number: str) -> list:
+    results = []
+    async for doc in adb.collection("billing_records").where("serviceLineNumber", "==", service_line_number).stream():
+        data = doc.to_dict()
+        data["record_id"] = doc.id
+        results.append(data)
+    return results
+
+async def get_user_terminal_by_service_line(service_line_number: str) -> dict:
+    index = server.cached_service_line_devices(service_line_number)
+    if index is None:
+        doc = await adb.collection("service_line_devices").document(service_line_number).get()
+        if doc.exists:
+            index = doc.to_dict()
+            server.remember_service_line_devices(service_line_number, index)
+    if index:
+        return server.user_terminal_from_index(index)
+
+    query = adb.collection("user_terminals").where("serviceLineNumber", "==", service_line_number).limit(1)
+    async for doc in query.stream():
+        return server.user_terminal_from_doc(doc.id, doc.to_dict())
+    return None
+
+async def get_telemetry_summary(device_type: str, device_id: str) -> dict:
+    doc_id = server.get_device_doc_id(device_type, device_id)
+    if not doc_id:
+        return None
+    doc = await adb.collection("telemetry_summary").document(doc_id).get()
+    return doc.to_dict() if doc.exists else None
+
+async def get_telemetry_software_version(device_type: str, device_id: str) -> str:
+    async for doc_snap in server.software_version_query(adb, device_type, device_id).stream():
+        return server.software_version_from(device_type, doc_snap.to_dict())
+    return None
+
+async def get_all_telemetry_records(device_type: str, device_id: str, start_ns: int = None, end_ns: int = None,
+                                    max_points: int = None, fields: list = None) -> dict:
+    """See server.get_all_telemetry_records. Aggregation and LTTB run off the event loop."""
+    doc_id = server.get_device_doc_id(device_type, device_id)
+    if not doc_id:
+        return {"allRecords": [], "aggregates": {}}
+
+    projection = projection_for_device(device_type, fields)
+    records = []
+    async for snap in server.telemetry_records_query(adb, doc_id, projection, start_ns, end_ns).stream():
+        records.extend(server.records_from_snapshot(snap, projection, start_ns, end_ns))
+    return await asyncio.to_thread(server.build_telemetry_data, device_type, records, max_points, fields)
+
+async def iter_telemetry_batches(doc_id: str, projection: list, start_ns: int = None, end_ns: int = None,
+                                 size: int = DASHBOARD_STREAM_BATCH_RECORDS):
+    """Projected telemetry records in timestamp order, in lists of up to 'size'."""
+    batch = []
+    async for snap in server.telemetry_records_query(adb, doc_id, projection, start_ns, end_ns).stream():
+        batch.extend(server.records_from_snapshot(snap, projection, start_ns, end_ns))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_device_records(encoder, label: str, device_type: str, device_id: str, query):
+    """See server.stream_device_records."""
+    aggregator = TelemetryAggregator(fields_for_device(device_type, query.fields))
+    projection = projection_for_device(device_type, query.fields)
+    doc_id = server.get_device_doc_id(device_type, device_id)
+    error = None
+    yield encoder.begin_device(label)
+    try:
+        async for batch in iter_telemetry_batches(doc_id, projection, query.start_ns, query.end_ns):
+            for record in batch:
+                aggregator.add(record)
+            yield encoder.records(label, batch)
+    except Exception as e:
+        logger.error(f"Telemetry stream for {device_type}:{device_id} failed: {e}")
+        error = "Telemetry stream interrupted"
+    yield encoder.end_device(label, aggregator.result(), error)
+
+async def stream_dashboard_body(encoder, metadata: dict, results: dict, query):
+    """See server.stream_dashboard_body."""
+    yield encoder.begin(metadata)
+    for _, label, device_type in server.DASHBOARD_DEVICES:
+        device_id = server.dashboard_device_id(results, device_type)
+        if not device_id:
+            yield encoder.device(label, {})
+        elif not query.include_records:
+            yield encoder.device(label, {
+                "allRecords": [], "aggregates": summary_to_aggregates(results[f"{device_type}_summary"])
+            })
+        elif query.max_points:
+            try:
+                data = await get_all_telemetry_records(
+                    device_type, device_id, query.start_ns, query.end_ns, query.max_points, query.fields
+                )
+            except Exception as e:
+                logger.error(f"Telemetry fetch for {device_type}:{device_id} failed: {e}")
+                yield encoder.begin_device(label) + encoder.end_device(label, {}, "Telemetry fetch failed")
+            else:
+                yield encoder.device(label, data)
+        else:
+            async for chunk in stream_device_records(encoder, label, device_type, device_id, query):
+                yield chunk
+    yield encoder.end()
+
+# ---------------------------------------------------
+# Authorization (mirrors server.require_service_line_access)
+# ---------------------------------------------------
+async def get_user_profile(uid: str, email: str = None) -> dict:
+    cached = server.user_profiles.get_by_uid(uid)
+    if cached:
+        return cached[1]
+    try:
+        user_doc = await retry_firestore_get(adb.collection("users").document(uid))
+    except (DeadlineExceeded, ResourceExhausted):
+        stale = server.user_profiles.get_by_uid(uid, allow_stale=True)
+        if stale:
+            return stale[1]
+        raise
+    if not user_doc.exists:
+        return None
+    profile = user_doc.to_dict()
+    if profile.get("email") or email:
+        server.user_profiles.set(profile.get("email") or email, uid, profile)
+    return profile
+
+async def authorize_service_line(scope, service_line_number: str) -> JSONResponse:
+    """None when the caller may read 'service_line_number', else the error response."""
+    if not server.DASHBOARD_AUTH_REQUIRED:
+        return None
+    header = request_header(scope, b"authorization")
+    if not header.startswith("Bearer "):
+        return JSONResponse({"error": "Missing bearer token"}, 401)
+    try:
+        # Off the event loop: an expired cert cache makes verify() fetch the certs
+        # synchronously (and other callers wait on its lock meanwhile)
+        claims = await asyncio.to_thread(server.id_token_verifier.verify, header[len("Bearer "):].strip())
+        profile = await get_user_profile(claims["sub"], claims.get("email"))
+    except InvalidIdToken as e:
+        logger.info(f"Rejected ID token: {e}")
+        return JSONResponse({"error": "Invalid or expired token"}, 401)
+    except (CertificateFetchError, GoogleAPICallError) as e:
+        logger.warning(f"Authorization unavailable: {e}")
+        return firestore_busy_response("Authorization temporarily unavailable, please try again shortly.")
+    allowed = (profile or {}).get("serviceLineNumber") or []
+    if service_line_number not in allowed:
+        return JSONResponse({"error": "Not authorized for this service line"}, 403)
+    return None
+
+# ---------------------------------------------------
+# Routes
+# ---------------------------------------------------
+async def api_get_dashboard_data(scope, service_line_number: str):
+    logger.info(f"Received API call for service_line_number: {service_line_number}")
+    try:
+        denied = await authorize_service_line(scope, service_line_number)
+        if denied:
+            return denied
+        try:
+            query = parse_dashboard_query(dict(parse_qsl(scope["query_string"].decode("latin-1"))))
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid query parameter: {e}"}, 400)
+
+        cache_key = server.dashboard_query_cache_key(service_line_number, query)
+        cached_body = await cache_call(read_dashboard_cache, cache_key) if query.stream != "ndjson" else None
+        if cached_body is not None:
+            logger.info(f"Serving cached dashboard data for {service_line_number}")
+            return JSONResponse(cached_body)
+
+        async def fetch_summary(results, device_type):
+            device_id = server.dashboard_device_id(results, device_type)
+            return await get_telemetry_summary(device_type, device_id) if device_id else None
+
+        async def fetch_software_version(results, device_type):
+            summary = results[f"{device_type}_summary"]
+            if summary and summary.get("softwareVersion"):
+                return summary["softwareVersion"]
+            device_id = server.dashboard_device_id(results, device_type)
+            return await get_telemetry_software_version(device_type, device_id) if device_id else None
+
+        async def fetch_telemetry(results, device_type):
+            device_id = server.dashboard_device_id(results, device_type)
+            if not device_id:
+                return {}
+            if not query.include_records:
+                data = {"allRecords": [], "aggregates": summary_to_aggregates(results[f"{device_type}_summary"])}
+            else:
+                data = await get_all_telemetry_records(
+                    device_type, device_id, query.start_ns, query.end_ns, query.max_points, query.fields
+                )
+            return server.telemetry_section(device_type, data, query)
+
+        async def fetch_address(results):
+            indexed_address = (results["user_terminal"] or {}).get("formattedAddress")
+            if indexed_address:
+                return indexed_address
+            address_ref_id = (results["service_line"] or {}).get("addressReferenceId")
+            return await get_formatted_address(address_ref_id) if address_ref_id else None
+
+        fetchers = {
+            "service_line": lambda r: get_service_line(service_line_number),
+            "billing": lambda r: get_billing_records_for_service_line(service_line_number),
+            "user_terminal": lambda r: get_user_terminal_by_service_line(service_line_number),
+            "address": fetch_address,
+            "u_summary": lambda r: fetch_summary(r, "u"),
+            "r_summary": lambda r: fetch_summary(r, "r"),
+            "user_terminal_sw": lambda r: fetch_software_version(r, "u"),
+            "router_sw": lambda r: fetch_software_version(r, "r"),
+            "user_terminal_telemetry": lambda r: fetch_telemetry(r, "u"),
+            "router_telemetry": lambda r: fetch_telemetry(r, "r"),
+        }
+        graph = server.dashboard_graph_deps(query.include_records, streamed=bool(query.stream))
+        results, timed_out, failed = await run_fetch_graph_async(
+            {name: (deps, fetchers[name]) for name, deps in graph.items()}, server.DASHBOARD_FETCH_TIMEOUT
+        )
+
+        status, response_data, cache_tags = server.assemble_dashboard_response(
+            service_line_number, results, timed_out, failed
+        )
+        if status != 200:
+            return JSONResponse(response_data, status)
+
+        if query.stream:
+            encoder = DashboardStreamEncoder(query.stream, server.app.json.dumps, server.dashboard_stream_columns(query))
+            metadata = server.dashboard_stream_metadata(response_data)
+            return StreamingResponse(stream_dashboard_body(encoder, metadata, results, query), encoder.mimetype)
+
+        response = JSONResponse(response_data)
+        if cache_tags:
+            await cache_call(write_dashboard_cache, cache_key, response.body, tags=cache_tags)
+        return response
+
+    except Exception as e:
+        logger.error("Internal server error: %s", e)
+        return JSONResponse({"error": f"Internal server error: {str(e)}"}, 500)
+
+async def api_login(body: bytes) -> JSONResponse:
+    """See server.api_login."""
+    try:
+        try:
+            data = server.app.json.loads(body)
+        except ValueError:
+            return JSONResponse({"error": "Invalid request body."}, 400)
+        email = (data or {}).get("email")
+        password = (data or {}).get("password")
+        if not email or not password:
+            return JSONResponse({"error": "Missing email or password."}, 400)
+
+        FIREBASE_API_KEY = os.getenv("FIREBASE_API_KEY")
+        if not FIREBASE_API_KEY:
+            raise ValueError("FIREBASE_API_KEY environment variable is not set")
+        payload = {
+            "email": email,
+            "password": password,
+            "returnSecureToken": True
+        }
+        resp = await identity_client().post(server.IDENTITY_TOOLKIT_URL, params={"key": FIREBASE_API_KEY}, json=payload)
+        if resp.status_code != 200:
+            return JSONResponse({"error": "Invalid email or password."}, 401)
+        sign_in = resp.json()
+        id_token = sign_in.get("idToken")
+        uid = server.uid_from_id_token(id_token) or sign_in.get("localId")
+
+        cached = server.user_profiles.get(email)
+        if cached and cached[0] == uid:
+            profile = cached[1]
+        else:
+            try:
+                user_doc = await retry_firestore_get(adb.collection("users").document(uid))
+            except (DeadlineExceeded, ResourceExhausted) as e:
+                stale = server.user_profiles.get(email, allow_stale=True)
+                if not stale or stale[0] != uid:
+                    logger.warning(f"Firestore unavailable during login: {e}")
+                    return firestore_busy_response("Database busy, please try again shortly.")
+                logger.warning(f"Serving cached profile for {uid}; Firestore unavailable: {e}")
+                profile = stale[1]
+            except GoogleAPICallError as e:
+                logger.error(f"Firestore error: {e}")
+                return JSONResponse({"error": "Firestore error"}, 500)
+            else:
+                if not user_doc.exists:
+                    return JSONResponse({"error": "User not found"}, 401)
+                profile = user_doc.to_dict()
+                server.user_profiles.set(email, uid, profile)
+
+        service_lines = profile.get("serviceLineNumber", [])
+        return JSONResponse(server.login_response(sign_in, service_lines))
+
+    except Exception as e:
+        logger.error(f"Login error: {e}")
+        return JSONResponse({"error": "Internal server error"}, 500)
+
+# ---------------------------------------------------
+# ASGI application
+# ---------------------------------------------------
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            server.start_admin_credential_refresh()
+            if server.DASHBOARD_AUTH_REQUIRED:
+                try:
+                    await asyncio.to_thread(server.id_token_verifier.certs.get)
+                except CertificateFetchError as e:
+                    logger.warning(f"Could not prefetch Firebase signing certificates: {e}")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _identity_client is not None:
+                await _identity_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http":
+        method, path = scope["method"], scope["path"]
+        match = DASHBOARD_ROUTE.match(path)
+        if match and method == "GET":
+            return await send_response(send, scope, await api_get_dashboard_data(scope, match.group(1)))
+        if path == "/api/login" and method == "POST":
+            try:
+                response = await api_login(await read_body(receive))
+            except ValueError:
+                response = JSONResponse({"error": "Request body too large"}, 413)
+            return await send_response(send, scope, response)
+
+    await flask_app(scope, receive, send)
@@ -0,0 +1,198 @@
+"""
+Response cache for /api/dashboard-data.
+
+Entries are the serialized JSON bodies, keyed per service line, and carry a set of
+tags (Firestore document paths such as "service_lines/SL-..." or
+"telemetry_raw/ut...") so the ingest side can drop exactly the entries it affects.
+
+Backend is chosen with DASHBOARD_CACHE_URL:
+  - unset / "memory://"  -> bounded in-process LRU with TTL (per gunicorn worker).
+                             Invalidation only reaches the process that calls it,
+                             so with Data_Storage running as its own process
+                             entries only expire by TTL; Data_Storage logs a
+                             warning the first time it invalidates.
+  - "redis://host:port/0" -> shared Redis (or any Redis-compatible server), which
+                             also lets Data_Storage invalidate across processes
+
+The cache is an optimization: read_dashboard_cache / write_dashboard_cache log
+backend errors instead of raising, so requests fall through to Firestore.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_URL = os.getenv("DASHBOARD_CACHE_URL", "memory://")
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "256"))
+DASHBOARD_CACHE_MAX_BYTES = int(os.getenv("DASHBOARD_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class MemoryCacheBackend:
+    """Thread-safe LRU + TTL cache bounded by entry count and total body size."""
+
+    shared = False  # other processes never see these entries
+
+    def __init__(self, max_entries=DASHBOARD_CACHE_MAX_ENTRIES, max_bytes=DASHBOARD_CACHE_MAX_BYTES,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, body, tags)
+        self._tags = {}                # tag -> set(keys)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body, _ = entry
+            if expires_at < self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body, tags=(), ttl=DASHBOARD_CACHE_TTL):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + ttl, body, set(tags))
+            self._bytes += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def invalidate(self, *tags):
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, set()):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, body, tags = self._entries.pop(key)
+        self._bytes -= len(body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCacheBackend:
+    """
+    Redis-compatible backend. Eviction under memory pressure is left to the
+    server's maxmemory-policy (allkeys-lru recommended); TTL is set per key.
+    """
+
+    shared = True
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("DASHBOARD_CACHE_URL points at Redis but the 'redis' package is not installed.") from e
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, body, tags=(), ttl=DASHBOARD_CACHE_TTL):
+        pipe = self._client.pipeline()
+        pipe.set(key, body, ex=ttl)
+        for tag in tags:
+            pipe.sadd(f"tag:{tag}", key)
+            pipe.expire(f"tag:{tag}", ttl)
+        pipe.execute()
+
+    def invalidate(self, *tags):
+        removed = 0
+        for tag in tags:
+            keys = self._client.smembers(f"tag:{tag}")
+            if keys:
+                removed += self._client.delete(*keys)
+            self._client.delete(f"tag:{tag}")
+        return removed
+
+    def clear(self):
+        for key in self._client.scan_iter("dashboard:*"):
+            self._client.delete(key)
+
+
+def create_backend(url=DASHBOARD_CACHE_URL):
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        logger.info("Dashboard cache using Redis backend.")
+        return RedisCacheBackend(url)
+    return MemoryCacheBackend()
+
+
+cache = create_backend()
+_warned_local_invalidation = False
+
+
+def dashboard_cache_key(service_line_number, variant=""):
+    return f"dashboard:{service_line_number}:{variant}"
+
+
+def read_dashboard_cache(key):
+    """Cached body for 'key', or None on a miss or a backend error. Never raises."""
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.error(f"Error reading dashboard cache entry {key}: {e}")
+        return None
+
+
+def write_dashboard_cache(key, body, tags=()):
+    """Store a response body; a backend error is logged and the entry skipped. Never raises."""
+    try:
+        cache.set(key, body, tags=tags)
+    except Exception as e:
+        logger.error(f"Error writing dashboard cache entry {key}: {e}")
+
+
+def invalidate_dashboard_cache(*tags):
+    """
+    Drop every cached response tagged with any of 'tags'. Never raises. With the
+    in-process backend this only reaches the calling process, which is warned
+    about once.
+    """
+    global _warned_local_invalidation
+    tags = [t for t in tags if t]
+    if not tags:
+        return 0
+    if not cache.shared and not _warned_local_invalidation:
+        _warned_local_invalidation = True
+        logger.warning(
+            "Dashboard cache is in-process (DASHBOARD_CACHE_URL=memory://): invalidation only reaches "
+            f"this process, so dashboards cached by the web workers stay stale for up to {DASHBOARD_CACHE_TTL}s. "
+            "Point DASHBOARD_CACHE_URL at a Redis server shared with them."
+        )
+    try:
+        removed = cache.invalidate(*tags)
+        if removed:
+            logger.info(f"Invalidated {removed} cached dashboard responses for {tags}")
+        return removed
+    except Exception as e:
+        logger.error(f"Error invalidating dashboard cache for {tags}: {e}")
+        return 0
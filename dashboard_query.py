@@ -0,0 +1,60 @@
+"""
+Query parameters of /api/dashboard-data.
+
+  from, to    time window, epoch milliseconds or ISO 8601 (naive values are UTC)
+  maxPoints   LTTB-downsample each device's records to about this many points
+  fields      comma-separated telemetry fields to return (default: all)
+  records     "false" to return only the aggregates
+  stream      json or ndjson, see dashboard_stream
+  format      records (default) or columnar
+
+Shared by the Flask view in server.py and the native ASGI route in asgi.py.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from dashboard_stream import STREAM_MODES
+
+DashboardQuery = namedtuple(
+    "DashboardQuery", ["start_ns", "end_ns", "max_points", "fields", "include_records", "stream", "columnar"]
+)
+WIRE_FORMATS = ("records", "columnar")
+
+
+def parse_time_param(value):
+    """
+    Parse a 'from'/'to' query parameter into UTC nanoseconds.
+    Accepts epoch milliseconds or an ISO 8601 timestamp (naive values are treated as UTC).
+    """
+    if value is None or value == "":
+        return None
+    if value.lstrip("-").isdigit():
+        return int(value) * 1_000_000
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()) * 1_000_000_000 + dt.microsecond * 1_000
+
+
+def parse_dashboard_query(args) -> DashboardQuery:
+    """Query parameters of /api/dashboard-data; raises ValueError for bad from/to/maxPoints/stream/format."""
+    start_ns = parse_time_param(args.get("from"))
+    end_ns = parse_time_param(args.get("to"))
+    try:
+        max_points = int(args.get("maxPoints")) if args.get("maxPoints") else None
+    except ValueError:
+        raise ValueError("maxPoints must be an integer")
+    if max_points is not None and max_points < 2:
+        raise ValueError("maxPoints must be at least 2")
+    fields = [f for f in args.get("fields", "").split(",") if f] or None
+    include_records = args.get("records", "true").lower() not in ("false", "0", "no")
+    stream = args.get("stream") or None
+    if stream is not None and stream not in STREAM_MODES:
+        raise ValueError(f"stream must be one of {', '.join(STREAM_MODES)}")
+    wire_format = args.get("format") or "records"
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(WIRE_FORMATS)}")
+    columnar = wire_format == "columnar"
+    if columnar and stream == "json":
+        raise ValueError("format=columnar can only be streamed as ndjson")
+    return DashboardQuery(start_ns, end_ns, max_points, fields, include_records, stream, columnar)
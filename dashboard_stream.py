@@ -0,0 +1,124 @@
+"""
+Incremental encoding of /api/dashboard-data responses.
+
+With ?stream=json the response is the same JSON document as the buffered
+endpoint, written as it is produced: the service line metadata goes out as soon
+as the small lookups finish, then each device's records are encoded in batches
+straight from the Firestore stream, with the aggregates after them. Neither the
+full record list nor the full body is ever held in memory.
+
+With ?stream=ndjson the body is one JSON object per line:
+
+  {"section": "metadata", "data": {...every top-level field except telemetry_data}}
+  {"section": "records", "device": "userTerminal", "records": [...]}     (repeated)
+  {"section": "aggregates", "device": "userTerminal", "data": {...}}
+  {"section": "error", "device": "router", "error": "..."}               (only on failure)
+  {"section": "end"}
+
+With format=columnar each records line carries "columns" ({field: [values]})
+instead of "records"; format=columnar cannot be combined with stream=json.
+
+A missing "end" line means the stream was cut short. Once the status line has been
+sent an error cannot change it, so a device whose records fail mid-stream is closed
+off with its partial aggregates plus "streamError" (JSON) or an "error" line (NDJSON).
+"""
+import os
+
+from telemetry_fields import records_to_columns
+
+STREAM_MODES = ("json", "ndjson")
+DASHBOARD_STREAM_BATCH_RECORDS = int(os.getenv("DASHBOARD_STREAM_BATCH_RECORDS", "500"))
+
+MIMETYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+
+class DashboardStreamEncoder:
+    """
+    Produces the body of a streamed dashboard response piece by piece. Call begin(),
+    then for each device either device() with finished telemetry data or
+    begin_device() / records() ... / end_device(), then end(). Every method returns
+    a str to write.
+    """
+
+    def __init__(self, mode, dumps, columns=None):
+        """'columns' maps each device label to its column names for a columnar NDJSON stream."""
+        if mode not in STREAM_MODES:
+            raise ValueError(f"Unknown stream mode {mode!r}")
+        if columns and mode != "ndjson":
+            raise ValueError("Columnar streams must be NDJSON")
+        self.mode = mode
+        self.columns = columns
+        self.mimetype = MIMETYPES[mode]
+        self.dumps = dumps
+        self._devices_written = 0
+        self._records_written = 0
+
+    def begin(self, metadata):
+        if self.mode == "ndjson":
+            return self._line({"section": "metadata", "data": metadata})
+        fields = "".join(f"{self.dumps(key)}:{self.dumps(value)}," for key, value in metadata.items())
+        return "{" + fields + '"telemetry_data":{'
+
+    def device(self, label, data):
+        """A device whose telemetry data ({"allRecords", "aggregates"} or {}) is already built."""
+        if self.mode == "json":
+            return self._device_key(label) + self.dumps(data)
+        if not data:
+            return ""
+        return self.begin_device(label) + self.records(label, data.get("allRecords", [])) + \
+            self.end_device(label, data.get("aggregates", {}))
+
+    def begin_device(self, label):
+        self._records_written = 0
+        if self.mode == "ndjson":
+            return ""
+        return self._device_key(label) + '{"allRecords":['
+
+    def records(self, label, records):
+        if not records:
+            return ""
+        if self.columns:
+            return self._line({"section": "records", "device": label,
+                               "columns": records_to_columns(records, self.columns[label])})
+        if self.mode == "ndjson":
+            return self._line({"section": "records", "device": label, "records": records})
+        encoded = ",".join(self.dumps(record) for record in records)
+        prefix = "," if self._records_written else ""
+        self._records_written += len(records)
+        return prefix + encoded
+
+    def end_device(self, label, aggregates, error=None):
+        if self.mode == "ndjson":
+            out = self._line({"section": "aggregates", "device": label, "data": aggregates})
+            if error:
+                out += self._line({"section": "error", "device": label, "error": error})
+            return out
+        out = '],"aggregates":' + self.dumps(aggregates)
+        if error:
+            out += ',"streamError":' + self.dumps(error)
+        return out + "}"
+
+    def end(self):
+        if self.mode == "ndjson":
+            return self._line({"section": "end"})
+        return "}}"
+
+    def _device_key(self, label):
+        prefix = "," if self._devices_written else ""
+        self._devices_written += 1
+        return prefix + self.dumps(label) + ":"
+
+    def _line(self, obj):
+        return self.dumps(obj) + "\n"
+
+
+def batched(records, size=DASHBOARD_STREAM_BATCH_RECORDS):
+    """Lists of up to 'size' items from an iterable."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
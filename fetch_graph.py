@@ -0,0 +1,171 @@
+"""
+Concurrent dependency graphs of fetches, used by /api/dashboard-data.
+
+A graph maps name -> (deps, fn). Each fn receives the dict of results gathered
+so far and starts as soon as all of its deps have finished, so a request costs
+roughly its slowest branch instead of the sum of all of them. Both runners
+return (results, timed_out, failed):
+
+  - branches that miss the deadline, and anything that depends on them, are in
+    'timed_out' with a None result;
+  - a branch that raises is logged and in 'failed' with a None result; its
+    dependents still run and see the None.
+
+run_fetch_graph runs on a FetchPool of threads (Flask); run_fetch_graph_async
+runs coroutine functions on the event loop (asgi.py).
+"""
+import asyncio
+import logging
+import threading
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+class FetchPoolSaturated(RuntimeError):
+    """Too many timed-out fetches still hold the pool's threads."""
+
+
+class FetchPool:
+    """
+    Thread pool shared by every request's graph. A fetch that misses its deadline
+    cannot be interrupted and keeps its worker until it returns; once 'max_abandoned'
+    such threads are busy new graphs are turned away instead of queueing behind them.
+    """
+
+    def __init__(self, workers, max_abandoned, thread_name_prefix="dashboard-fetch"):
+        self.max_abandoned = max_abandoned
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+        self._abandoned = set()
+        self._lock = threading.Lock()
+
+    @property
+    def abandoned(self):
+        with self._lock:
+            return len(self._abandoned)
+
+    def check_capacity(self):
+        """Raise FetchPoolSaturated when abandoned fetches hold too many workers."""
+        with self._lock:
+            abandoned = len(self._abandoned)
+        if abandoned >= self.max_abandoned:
+            raise FetchPoolSaturated(f"{abandoned} timed-out dashboard fetches are still running")
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def abandon(self, future):
+        """Track a timed-out fetch until its thread is free again."""
+        with self._lock:
+            self._abandoned.add(future)
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+        with self._lock:
+            self._abandoned.discard(future)
+
+
+def run_fetch_graph(pool, tasks: dict, timeout: float):
+    """
+    Run a graph of blocking functions on 'pool'. Raises FetchPoolSaturated when
+    abandoned fetches hold too many of its workers.
+    """
+    pool.check_capacity()
+    deadline = monotonic() + timeout
+    results = {}
+    timed_out = []
+    failed = []
+    running = {}
+    waiting = dict(tasks)
+
+    while waiting or running:
+        for name, (deps, fn) in list(waiting.items()):
+            if all(dep in results for dep in deps):
+                running[pool.submit(fn, dict(results))] = name
+                del waiting[name]
+
+        if not running:
+            # Remaining tasks depend on a branch that timed out
+            for name in waiting:
+                results[name] = None
+                timed_out.append(name)
+            break
+
+        remaining = deadline - monotonic()
+        done, _ = wait(running, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+        if not done:
+            for future, name in running.items():
+                if not future.cancel():
+                    pool.abandon(future)
+                timed_out.append(name)
+            for name in waiting:
+                timed_out.append(name)
+            logger.warning(f"Dashboard fetch timed out for: {timed_out}")
+            for name in timed_out:
+                results[name] = None
+            break
+
+        for future in done:
+            name = running.pop(future)
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"Dashboard fetch {name} failed: {e}")
+                results[name] = None
+                failed.append(name)
+
+    return results, timed_out, failed
+
+
+async def run_fetch_graph_async(tasks: dict, timeout: float):
+    """
+    Coroutine version of run_fetch_graph: 'tasks' maps name -> (deps, coroutine
+    function). Branches still running at the deadline are cancelled, so they hold
+    no worker.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    results = {}
+    timed_out = []
+    failed = []
+    running = {}
+    waiting = dict(tasks)
+
+    try:
+        while waiting or running:
+            for name, (deps, fn) in list(waiting.items()):
+                if all(dep in results for dep in deps):
+                    running[asyncio.ensure_future(fn(dict(results)))] = name
+                    del waiting[name]
+
+            if not running:
+                # Remaining tasks depend on a branch that timed out
+                for name in waiting:
+                    results[name] = None
+                    timed_out.append(name)
+                break
+
+            remaining = deadline - loop.time()
+            done, _ = await asyncio.wait(running, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                timed_out.extend(running.values())
+                timed_out.extend(waiting)
+                logger.warning(f"Dashboard fetch timed out for: {timed_out}")
+                for name in timed_out:
+                    results[name] = None
+                break
+
+            for task in done:
+                name = running.pop(task)
+                try:
+                    results[name] = task.result()
+                except Exception as e:
+                    logger.error(f"Dashboard fetch {name} failed: {e}")
+                    results[name] = None
+                    failed.append(name)
+    finally:
+        for task in running:
+            task.cancel()
+
+    return results, timed_out, failed
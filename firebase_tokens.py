@@ -0,0 +1,211 @@
+"""
+Local verification of Firebase ID tokens.
+
+Google's token signing certificates are fetched once and reused until their
+Cache-Control max-age runs out (or a token names a key we have not seen, i.e. a
+rotation). Decoded claims are memoized per token until the token expires, so a
+request carrying a known token costs a dict lookup and verifying a new one costs
+one RSA signature check, never a network call.
+
+Revocation is not checked, the same as firebase_admin.auth.verify_id_token() with
+check_revoked=False.
+
+Run 'python firebase_tokens.py' for a microbenchmark of the verification cost.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+from google.auth import jwt as google_jwt
+
+logger = logging.getLogger(__name__)
+
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+ID_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("ID_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# Used when the cert response carries no max-age
+DEFAULT_CERT_MAX_AGE = 3600
+# An unknown key ID forces a refetch at most this often
+MIN_CERT_REFRESH_INTERVAL = 60
+CLOCK_SKEW_SECONDS = 10
+
+
+class InvalidIdToken(Exception):
+    """The token is malformed, expired, or not signed for this project."""
+
+
+class CertificateFetchError(Exception):
+    """Google's signing certificates could not be fetched and none are cached."""
+
+
+def fetch_firebase_certs(url=FIREBASE_CERTS_URL, session=None):
+    """({key_id: PEM certificate}, max_age_seconds) from Google's cert endpoint."""
+    response = (session or requests).get(url, timeout=10)
+    response.raise_for_status()
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    return response.json(), int(match.group(1)) if match else DEFAULT_CERT_MAX_AGE
+
+
+class PublicCertCache:
+    """Signing certificates kept until their Cache-Control max-age expires."""
+
+    def __init__(self, fetch=fetch_firebase_certs):
+        self._fetch = fetch
+        self._certs = {}
+        self._expires_at = 0.0
+        self._fetched_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() < self._expires_at:
+            return self._certs
+        return self.refresh(force=False)
+
+    def refresh(self, force=True):
+        """Refetch the certs. A forced refresh is rate-limited to MIN_CERT_REFRESH_INTERVAL."""
+        with self._lock:
+            now = time.monotonic()
+            if force and now - self._fetched_at < MIN_CERT_REFRESH_INTERVAL:
+                return self._certs
+            if not force and now < self._expires_at:
+                return self._certs  # another thread refreshed while we waited
+            try:
+                certs, max_age = self._fetch()
+            except Exception as e:
+                if not self._certs:
+                    raise CertificateFetchError(f"Could not fetch Firebase signing certificates: {e}") from e
+                logger.error(f"Refreshing Firebase signing certificates failed, keeping cached ones: {e}")
+                self._expires_at = now + MIN_CERT_REFRESH_INTERVAL
+                return self._certs
+            self._certs = certs
+            self._fetched_at = now
+            self._expires_at = now + max_age
+            return certs
+
+
+class IdTokenVerifier:
+    """Verifies Firebase ID tokens for one project and memoizes their claims."""
+
+    def __init__(self, project_id, certs=None, max_entries=ID_TOKEN_CACHE_MAX_ENTRIES):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.certs = certs or PublicCertCache()
+        self.max_entries = max_entries
+        self._claims = OrderedDict()  # token -> claims
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        """Decoded claims of a valid token; raises InvalidIdToken otherwise."""
+        if not token or not isinstance(token, str):
+            raise InvalidIdToken("No ID token supplied.")
+        now = time.time()
+        with self._lock:
+            claims = self._claims.get(token)
+            if claims is not None:
+                if claims["exp"] > now:
+                    self._claims.move_to_end(token)
+                    return claims
+                del self._claims[token]
+
+        claims = self._decode(token)
+
+        with self._lock:
+            self._claims[token] = claims
+            while len(self._claims) > self.max_entries:
+                self._claims.popitem(last=False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._claims.clear()
+
+    def _decode(self, token):
+        try:
+            header = google_jwt.decode_header(token)
+        except ValueError as e:
+            raise InvalidIdToken(f"Malformed ID token: {e}") from e
+        if header.get("alg") != "RS256":
+            raise InvalidIdToken(f"Unexpected ID token algorithm {header.get('alg')!r}.")
+
+        key_id = header.get("kid")
+        certs = self.certs.get()
+        if key_id not in certs:
+            certs = self.certs.refresh()
+        if key_id not in certs:
+            raise InvalidIdToken("ID token signed with an unknown key.")
+
+        try:
+            claims = google_jwt.decode(
+                token, certs=certs[key_id], audience=self.project_id, clock_skew_in_seconds=CLOCK_SKEW_SECONDS
+            )
+        except ValueError as e:
+            raise InvalidIdToken(str(e)) from e
+        if claims.get("iss") != self.issuer:
+            raise InvalidIdToken("ID token has the wrong issuer.")
+        if not claims.get("sub"):
+            raise InvalidIdToken("ID token has no subject.")
+        if claims.get("auth_time", 0) > time.time() + CLOCK_SKEW_SECONDS:
+            raise InvalidIdToken("ID token auth_time is in the future.")
+        return claims
+
+
+def benchmark_verification(iterations=2000, project_id="benchmark-project"):
+    """
+    Time verification of a locally signed token: a full signature check on a
+    cold memo versus a memoized lookup. No network access is needed.
+    """
+    import datetime
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from google.auth import crypt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "benchmark")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM).decode()
+
+    issued = int(time.time())
+    token = google_jwt.encode(crypt.RSASigner.from_string(key_pem, key_id="bench"), {
+        "iss": f"https://securetoken.google.com/{project_id}",
+        "aud": project_id,
+        "sub": "benchmark-user",
+        "user_id": "benchmark-user",
+        "auth_time": issued,
+        "iat": issued,
+        "exp": issued + 3600,
+    }).decode()
+
+    verifier = IdTokenVerifier(project_id, certs=PublicCertCache(fetch=lambda: ({"bench": cert_pem}, 3600)))
+    results = {}
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        verifier.clear()
+        verifier.verify(token)
+    results["signature_check"] = (time.perf_counter() - started) / iterations
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        verifier.verify(token)
+    results["memoized"] = (time.perf_counter() - started) / iterations
+    return results
+
+
+if __name__ == "__main__":
+    for label, seconds in benchmark_verification().items():
+        print(f"{label:>15}: {seconds * 1e6:.1f} us per verification")
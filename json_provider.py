@@ -0,0 +1,76 @@
+"""
+Flask JSON provider for the API.
+
+JSON_ENCODER selects the encoder:
+  "auto" (default)  orjson when the package is installed, else the standard library
+  "orjson"          orjson; fails at startup if it is not installed
+  "stdlib"          Flask's default provider
+
+Both providers add dumps_bytes(), which the hot paths use so an orjson body is
+never decoded to str and encoded back. Output matches Flask's default provider:
+keys are sorted when sort_keys is set, and dates, Decimals and UUIDs still go
+through Flask's default() (datetimes as HTTP dates).
+"""
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's default provider plus dumps_bytes()."""
+
+    def dumps_bytes(self, obj, **kwargs):
+        return self.dumps(obj, **kwargs).encode("utf-8")
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    """
+    orjson-backed provider. Calls with stdlib-only keyword arguments (indent,
+    separators, ...) fall back to the standard library encoder.
+    """
+
+    def _options(self):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps_bytes(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps_bytes(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self._options()
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=self.default, option=option) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def json_provider_class(encoder=JSON_ENCODER):
+    if encoder == "stdlib":
+        return StdlibJSONProvider
+    if orjson is None:
+        if encoder == "orjson":
+            raise RuntimeError("JSON_ENCODER=orjson but the 'orjson' package is not installed.")
+        return StdlibJSONProvider
+    return OrjsonProvider
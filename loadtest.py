@@ -0,0 +1,84 @@
+"""
+Load test for /api/dashboard-data, to compare the sync and async serving modes.
+
+Start the server with a fixed number of worker processes (one per core under test):
+
+    gunicorn wsgi:application --workers 2 --threads 8 --bind 0.0.0.0:5000
+    uvicorn asgi:app --workers 2 --port 5000
+
+then run, with a valid ID token for a user who can read the service line:
+
+    python loadtest.py http://localhost:5000/api/dashboard-data/SL-123 \\
+        --token "$ID_TOKEN" --workers 2 --concurrency 50,100,200,400 --duration 30
+
+Each step holds N connections open, each issuing requests back to back, and
+reports throughput, latency percentiles, errors and requests/s per server worker.
+Add '?records=false' or a 'from'/'to' range to the URL to exercise other paths;
+with DASHBOARD_CACHE_TTL=0 on the server every request reaches Firestore.
+"""
+import time
+import asyncio
+import argparse
+
+import httpx
+
+from telemetry_fields import percentile
+
+
+async def run_step(url, headers, concurrency, duration):
+    latencies = []
+    errors = {}
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=60) as client:
+        async def connection():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    outcome = response.status_code
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                if outcome == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors[outcome] = errors.get(outcome, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": (percentile(latencies, 50) or 0) * 1000,
+        "p95_ms": (percentile(latencies, 95) or 0) * 1000,
+        "p99_ms": (percentile(latencies, 99) or 0) * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the dashboard API")
+    parser.add_argument("url")
+    parser.add_argument("--token", help="Firebase ID token sent as a Bearer token")
+    parser.add_argument("--concurrency", default="50,100,200,400", help="Comma-separated connection counts")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per concurrency step")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes (cores) under test")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    print(f"{'conns':>6} {'requests':>9} {'rps':>8} {'rps/core':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  errors")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        step = asyncio.run(run_step(args.url, headers, concurrency, args.duration))
+        print(
+            f"{step['concurrency']:>6} {step['requests']:>9} {step['rps']:>8.1f} {step['rps'] / args.workers:>9.1f} "
+            f"{step['p50_ms']:>8.1f} {step['p95_ms']:>8.1f} {step['p99_ms']:>8.1f}  {step['errors'] or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, make_response
+from flask import Flask, request, jsonify, render_template, redirect, url_for, make_response, Response, g
+from functools import wraps
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import logging
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
+import base64
 import json  # Add missing import for json
 from google.api_core.exceptions import GoogleAPICallError, DeadlineExceeded, ResourceExhausted
-from time import sleep
+from time import sleep, monotonic
+import threading
+from collections import OrderedDict
+from dashboard_cache import (
+    cache as dashboard_cache, dashboard_cache_key, read_dashboard_cache, write_dashboard_cache,
+)
+from dashboard_stream import DashboardStreamEncoder, batched
+from dashboard_query import DashboardQuery, parse_dashboard_query
+import fetch_graph
+from fetch_graph import FetchPool, FetchPoolSaturated
+from json_provider import json_provider_class
+from response_compression import COMPRESSIBLE_MIMETYPES, COMPRESSION_MIN_BYTES, negotiate_encoding, compress, compress_stream
+from firebase_tokens import IdTokenVerifier, InvalidIdToken, CertificateFetchError
+from telemetry_fields import (
+    TelemetryAggregator, fields_for_device, projection_for_device, serialize_projected,
+    downsample_lttb_fields, summary_to_aggregates, device_doc_id, records_to_columns, DEFAULT_PLOT_FIELD,
+)
+from telemetry_buckets import (
+    BUCKET_COLLECTION, BUCKET_SUBCOLLECTION, reads_buckets, bucket_start, iter_bucket_records,
+)
+from datetime import datetime, timezone
 
 # ---------------------------------------------------
 # 1. Firebase Initialization
@@ -94,10 +117,53 @@ firebase_credentials_json = os.getenv('FIREBASE_CREDENTIALS')
 if firebase_credentials_json:
     logger.debug(f"[DEBUG] FIREBASE_CREDENTIALS content (first 100 chars): {firebase_credentials_json[:100]}...")
 
+# Refresh the Admin SDK service-account token ahead of expiry in the background, so
+# Firestore and Auth calls on request threads never block on an inline refresh.
+# The thread is started lazily by the first request of each process (and by the
+# ASGI lifespan), not on import, so forked workers each get one and tools that only
+# import this module get none.
+ADMIN_TOKEN_REFRESH_MARGIN = int(os.getenv("ADMIN_TOKEN_REFRESH_MARGIN", "600"))
+admin_refresh_thread = None
+admin_refresh_lock = threading.Lock()
+
+def keep_admin_credential_fresh():
+    from google.auth.transport.requests import Request as GoogleAuthRequest
+    credential = None
+    auth_request = GoogleAuthRequest()
+    while True:
+        try:
+            if credential is None:
+                # Raises until Firebase has been initialized
+                credential = firebase_admin.get_app().credential.get_credential()
+            credential.refresh(auth_request)
+            # google-auth keeps expiry as a naive UTC datetime
+            remaining = (credential.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+            delay = max(60, remaining - ADMIN_TOKEN_REFRESH_MARGIN)
+            logger.info(f"[DEBUG] Admin credential refreshed; next refresh in {delay:.0f}s")
+        except Exception as e:
+            logger.error(f"[ERROR] Admin credential refresh failed: {e}")
+            delay = 30
+        sleep(delay)
+
+def start_admin_credential_refresh():
+    """Start the refresher thread once per process."""
+    global admin_refresh_thread
+    if admin_refresh_thread is not None:
+        return
+    with admin_refresh_lock:
+        if admin_refresh_thread is None:
+            admin_refresh_thread = threading.Thread(
+                target=keep_admin_credential_fresh, name="admin-token-refresh", daemon=True
+            )
+            admin_refresh_thread.start()
+
 # ---------------------------------------------------
 # 2. Flask App Setup
 # ---------------------------------------------------
 app = Flask(__name__, template_folder='templates', static_folder='static')
+# orjson-backed when installed (JSON_ENCODER), see json_provider.py
+app.json = json_provider_class()(app)
+app.before_request(start_admin_credential_refresh)
 # NEW: Enable CORS for the entire Flask app
 CORS(app)
 
@@ -153,7 +219,68 @@ def get_formatted_address(address_ref_id: str) -> str:
         return doc.to_dict().get("formattedAddress")
     return None
 
+# Resolved device index entries (service_line_devices/{sl}), cached in-process.
+# Data_Storage rewrites an entry only when a terminal or its address changes.
+DEVICE_INDEX_TTL = float(os.getenv("DEVICE_INDEX_TTL", "300"))
+DEVICE_INDEX_MAX_ENTRIES = int(os.getenv("DEVICE_INDEX_MAX_ENTRIES", "10000"))
+device_index_cache = OrderedDict()  # service line -> (expires_at, entry)
+device_index_lock = threading.Lock()
+
+def cached_service_line_devices(service_line_number: str) -> dict:
+    with device_index_lock:
+        cached = device_index_cache.get(service_line_number)
+        if cached and cached[0] > monotonic():
+            device_index_cache.move_to_end(service_line_number)
+            return cached[1]
+    return None
+
+def remember_service_line_devices(service_line_number: str, entry: dict):
+    with device_index_lock:
+        device_index_cache[service_line_number] = (monotonic() + DEVICE_INDEX_TTL, entry)
+        device_index_cache.move_to_end(service_line_number)
+        while len(device_index_cache) > DEVICE_INDEX_MAX_ENTRIES:
+            device_index_cache.popitem(last=False)
+
+def get_service_line_devices(service_line_number: str) -> dict:
+    """Point read of service_line_devices/{sl}, cached for DEVICE_INDEX_TTL seconds."""
+    entry = cached_service_line_devices(service_line_number)
+    if entry is not None:
+        return entry
+    doc = db.collection("service_line_devices").document(service_line_number).get()
+    if not doc.exists:
+        return None
+    entry = doc.to_dict()
+    remember_service_line_devices(service_line_number, entry)
+    return entry
+
+def user_terminal_from_index(index: dict) -> dict:
+    router_ids = index.get("routerIds") or []
+    return {
+        "kitSerialNumber": index.get("kitSerialNumber"),
+        "userTerminalId": index.get("userTerminalId"),
+        "dishSerialNumber": index.get("dishSerialNumber"),
+        "routerId": router_ids[0] if router_ids else None,
+        "formattedAddress": index.get("formattedAddress"),
+    }
+
+def user_terminal_from_doc(doc_id: str, user_terminal: dict) -> dict:
+    router_id = None
+    if "routers" in user_terminal and isinstance(user_terminal["routers"], list):
+        if len(user_terminal["routers"]) > 0:
+            router_id = user_terminal["routers"][0].get("routerId")
+    return {
+        "kitSerialNumber": user_terminal.get("kitSerialNumber"),
+        "userTerminalId": doc_id,
+        "dishSerialNumber": user_terminal.get("dishSerialNumber"),
+        "routerId": router_id
+    }
+
 def get_user_terminal_by_service_line(service_line_number: str) -> dict:
+    index = get_service_line_devices(service_line_number)
+    if index:
+        return user_terminal_from_index(index)
+
+    # Service lines not indexed yet (before the next Data_Storage sync)
     query = (
         db.collection("user_terminals")
           .where("serviceLineNumber", "==", service_line_number)
@@ -161,174 +288,132 @@ def get_user_terminal_by_service_line(service_line_number: str) -> dict:
           .stream()
     )
     for doc in query:
-        user_terminal = doc.to_dict()
-        router_id = None
-        if "routers" in user_terminal and isinstance(user_terminal["routers"], list):
-            if len(user_terminal["routers"]) > 0:
-                router_id = user_terminal["routers"][0].get("routerId")
-        return {
-            "kitSerialNumber": user_terminal.get("kitSerialNumber"),
-            "userTerminalId": doc.id,
-            "dishSerialNumber": user_terminal.get("dishSerialNumber"),
-            "routerId": router_id
-        }
+        return user_terminal_from_doc(doc.id, doc.to_dict())
     return None
 
 # --- Helper Functions for Real Telemetry Data ---
-def min_max_last(values):
-    """
-    Compute min, max, and last from a list of numeric (or semi-numeric) values.
-    If no numeric data, returns None, else do standard min/max/last.
-    """
-    numeric_vals = [v for v in values if isinstance(v, (int, float))]
-    if not numeric_vals:
-        return {
-            "min": None,
-            "max": None,
-            "last": values[-1] if values else None
-        }
-    return {
-        "min": min(numeric_vals),
-        "max": max(numeric_vals),
-        "last": numeric_vals[-1]
-    }
-
 def get_device_doc_id(device_type: str, device_id: str) -> str:
-    if not device_id:
-        return ""
+    return device_doc_id(device_type, device_id)
 
-    if device_type == "u":
-        if not device_id.startswith("ut"):
-            return f"ut{device_id}"
-        return device_id
-    elif device_type == "r":
-        if not device_id.startswith("Router-"):
-            return f"Router-{device_id}"
-        return device_id
-    else:
-        return device_id
-
-def get_all_telemetry_records(device_type: str, device_id: str) -> dict:
+def telemetry_records_query(client, doc_id: str, projection: list, start_ns: int = None, end_ns: int = None):
     """
-    Fetch all telemetry records for a device from Firebase and return structured data
+    Time-ordered query over a device's telemetry: the per-sample documents or, with
+    TELEMETRY_LAYOUT=buckets, the bucket docs. 'client' may be the sync or async client.
+    """
+    if reads_buckets():
+        query = client.collection(BUCKET_COLLECTION).document(doc_id).collection(BUCKET_SUBCOLLECTION)
+        if start_ns is not None:
+            query = query.where("startTs", ">=", bucket_start(start_ns))
+        if end_ns is not None:
+            query = query.where("startTs", "<=", end_ns // 1_000_000_000)
+        return query.order_by("startTs")
+
+    query = client.collection("telemetry_raw").document(doc_id).collection("records").select(projection)
+    if start_ns is not None:
+        query = query.where("UtcTimestampNs", ">=", start_ns)
+    if end_ns is not None:
+        query = query.where("UtcTimestampNs", "<=", end_ns)
+    return query.order_by("UtcTimestampNs")
+
+def records_from_snapshot(snap, projection: list, start_ns: int = None, end_ns: int = None):
+    """Projected records held by one snapshot of telemetry_records_query()."""
+    if reads_buckets():
+        return iter_bucket_records(snap.to_dict() or {}, projection, start_ns, end_ns)
+    return (serialize_projected(snap, projection),)
+
+def iter_telemetry_records(doc_id: str, projection: list, start_ns: int = None, end_ns: int = None):
+    """Projected telemetry records for a device in timestamp order."""
+    for snap in telemetry_records_query(db, doc_id, projection, start_ns, end_ns).stream():
+        yield from records_from_snapshot(snap, projection, start_ns, end_ns)
+
+def get_all_telemetry_records(device_type: str, device_id: str, start_ns: int = None, end_ns: int = None,
+                              max_points: int = None, fields: list = None) -> dict:
+    """
+    Fetch all telemetry records for a device from Firebase and return structured data.
+    Only the registered fields for the device (or the requested subset of them) are
+    pulled, via a Firestore projection.
+    Optional [start_ns, end_ns] range is applied in the Firestore query on UtcTimestampNs.
+    Aggregates cover the full range; 'allRecords' is then downsampled to about
+    'max_points' records (LTTB over each numeric field, union of the picks).
     """
     doc_id = get_device_doc_id(device_type, device_id)
     if not doc_id:
         return {"allRecords": [], "aggregates": {}}
 
-    records_ref = db.collection("telemetry_raw").document(doc_id).collection("records")
-    all_docs = list(records_ref.order_by("UtcTimestampNs").stream())
+    projection = projection_for_device(device_type, fields)
+    return build_telemetry_data(
+        device_type, iter_telemetry_records(doc_id, projection, start_ns, end_ns), max_points, fields
+    )
 
-    # Raw records
+def build_telemetry_data(device_type: str, records, max_points: int = None, fields: list = None) -> dict:
+    """{"allRecords", "aggregates"} for a time-ordered iterable of projected records."""
+    # Single pass: keep the raw record and fold it into the aggregates at the same time
     all_records = []
-    dish_ping_drop = []
-    dish_ping_latency = []
-    downlink = []
-    uplink = []
-    obstruction = []
-    ping_drop_avg = []
-    ping_latency_avg = []
-    run_sw_ver = []
-    signal_quality = []
-
-    # router fields:
-    internet_drop = []
-    internet_lat = []
-    wifi_hw_ver = []
-    wifi_is_bypassed = []
-    wifi_is_repeater = []
-    wifi_pop_drop = []
-    wifi_pop_lat = []
-    wifi_sw_ver = []
-
-    for snap in all_docs:
-        data = snap.to_dict()
+    aggregator = TelemetryAggregator(fields_for_device(device_type, fields))
+    for data in records:
         all_records.append(data)
+        aggregator.add(data)
 
-        # Fill user-terminal arrays if these fields exist:
-        if "DishPingDropRate" in data: 
-            dish_ping_drop.append(data["DishPingDropRate"])
-        if "DishPingLatencyMs" in data:
-            dish_ping_latency.append(data["DishPingLatencyMs"])
-        if "DownlinkThroughput" in data:
-            downlink.append(data["DownlinkThroughput"])
-        if "UplinkThroughput" in data:
-            uplink.append(data["UplinkThroughput"])
-        if "ObstructionPercentTime" in data:
-            obstruction.append(data["ObstructionPercentTime"])
-        if "PingDropRateAvg" in data:
-            ping_drop_avg.append(data["PingDropRateAvg"])
-        if "PingLatencyMsAvg" in data:
-            ping_latency_avg.append(data["PingLatencyMsAvg"])
-        if "RunningSoftwareVersion" in data:
-            run_sw_ver.append(data["RunningSoftwareVersion"])
-        if "SignalQuality" in data:
-            signal_quality.append(data["SignalQuality"])
-
-        # Fill router arrays if these fields exist:
-        if "InternetPingDropRate" in data:
-            internet_drop.append(data["InternetPingDropRate"])
-        if "InternetPingLatencyMs" in data:
-            internet_lat.append(data["InternetPingLatencyMs"])
-        if "WifiHardwareVersion" in data:
-            wifi_hw_ver.append(data["WifiHardwareVersion"])
-        if "WifiIsBypassed" in data:
-            wifi_is_bypassed.append(data["WifiIsBypassed"])
-        if "WifiIsRepeater" in data:
-            wifi_is_repeater.append(data["WifiIsRepeater"])
-        if "WifiPopPingDropRate" in data:
-            wifi_pop_drop.append(data["WifiPopPingDropRate"])
-        if "WifiPopPingLatencyMs" in data:
-            wifi_pop_lat.append(data["WifiPopPingLatencyMs"])
-        if "WifiSoftwareVersion" in data:
-            wifi_sw_ver.append(data["WifiSoftwareVersion"])
-
-    # Aggregates
-    aggregates = {
-        "DishPingDropRate": min_max_last(dish_ping_drop),
-        "DishPingLatencyMs": min_max_last(dish_ping_latency),
-        "DownlinkThroughput": min_max_last(downlink),
-        "UplinkThroughput": min_max_last(uplink),
-        "ObstructionPercentTime": min_max_last(obstruction),
-        "PingDropRateAvg": min_max_last(ping_drop_avg),
-        "PingLatencyMsAvg": min_max_last(ping_latency_avg),
-        "RunningSoftwareVersion": min_max_last(run_sw_ver),
-        "SignalQuality": min_max_last(signal_quality),
-
-        "InternetPingDropRate": min_max_last(internet_drop),
-        "InternetPingLatencyMs": min_max_last(internet_lat),
-        "WifiHardwareVersion": min_max_last(wifi_hw_ver),
-        "WifiIsBypassed": min_max_last(wifi_is_bypassed),
-        "WifiIsRepeater": min_max_last(wifi_is_repeater),
-        "WifiPopPingDropRate": min_max_last(wifi_pop_drop),
-        "WifiPopPingLatencyMs": min_max_last(wifi_pop_lat),
-        "WifiSoftwareVersion": min_max_last(wifi_sw_ver),
-    }
+    if max_points:
+        # Every plotted series keeps its own extremes, not just the first one's
+        plotted = [f.name for f in fields_for_device(device_type, fields) if f.kind == "numeric"]
+        all_records = downsample_lttb_fields(all_records, max_points, plotted or [DEFAULT_PLOT_FIELD.get(device_type)])
 
     return {
         "allRecords": all_records,
-        "aggregates": aggregates
+        "aggregates": aggregator.result()
     }
 
+def get_telemetry_summary(device_type: str, device_id: str) -> dict:
+    """
+    Point read of the per-device summary document maintained by Data_Storage.store_telemetry
+    (rolling min/max/last/count/sum per field plus the latest software version).
+    """
+    doc_id = get_device_doc_id(device_type, device_id)
+    if not doc_id:
+        return None
+    doc = db.collection("telemetry_summary").document(doc_id).get()
+    return doc.to_dict() if doc.exists else None
+
 def get_telemetry_software_version(device_type: str, device_id: str) -> str:
     """
     Get software version for a device from telemetry data
     """
+    for doc_snap in software_version_query(db, device_type, device_id).stream():
+        return software_version_from(device_type, doc_snap.to_dict())
+    return None
+
+def software_version_query(client, device_type: str, device_id: str):
     doc_id = get_device_doc_id(device_type, device_id)
-    
-    query = db.collection("telemetry") \
+    version_fields = ["RunningSoftwareVersion"] if device_type == "u" else ["WifiSoftwareVersion", "SoftwareVersion"]
+    return client.collection("telemetry") \
             .where("DeviceType", "==", device_type) \
             .where("DeviceId", "==", doc_id) \
+            .select(version_fields) \
             .limit(1)
 
-    for doc_snap in query.stream():
-        data = doc_snap.to_dict()
-        if device_type == "u":
-            return data.get("RunningSoftwareVersion")
-        elif device_type == "r":
-            return data.get("WifiSoftwareVersion") or data.get("SoftwareVersion")
+def software_version_from(device_type: str, data: dict) -> str:
+    if device_type == "u":
+        return data.get("RunningSoftwareVersion")
+    elif device_type == "r":
+        return data.get("WifiSoftwareVersion") or data.get("SoftwareVersion")
     return None
 
+# --- Concurrent Fetch Graph for Dashboard Requests ---
+# Shared pool for the independent Firestore lookups behind /api/dashboard-data.
+# The graph itself is request-scoped; only the worker threads are reused.
+DASHBOARD_FETCH_WORKERS = int(os.getenv("DASHBOARD_FETCH_WORKERS", "16"))
+DASHBOARD_FETCH_TIMEOUT = float(os.getenv("DASHBOARD_FETCH_TIMEOUT", "10"))
+# A fetch that misses the deadline cannot be interrupted and keeps its worker until
+# Firestore answers; past this many such threads new requests are turned away
+# instead of queueing behind them.
+DASHBOARD_FETCH_MAX_ABANDONED = int(os.getenv("DASHBOARD_FETCH_MAX_ABANDONED", str(DASHBOARD_FETCH_WORKERS // 2)))
+fetch_pool = FetchPool(DASHBOARD_FETCH_WORKERS, DASHBOARD_FETCH_MAX_ABANDONED)
+
+def run_fetch_graph(tasks: dict, timeout: float = DASHBOARD_FETCH_TIMEOUT):
+    """Run a dashboard fetch graph on fetch_pool; see fetch_graph.run_fetch_graph."""
+    return fetch_graph.run_fetch_graph(fetch_pool, tasks, timeout)
+
 # --- Optimized Billing Records Query ---
 def get_billing_records_for_service_line(service_line_number):
     """
@@ -348,68 +433,319 @@ def get_billing_records_for_service_line(service_line_number):
 # ---------------------------------------------------
 # 4. Endpoint to Get Dashboard Data
 # ---------------------------------------------------
+# --- Authorization for Protected API Routes ---
+# ID tokens are verified locally (firebase_tokens.py) and the caller's users doc
+# comes from the login profile cache, so an authorized request normally makes
+# no network call before the handler runs.
+DASHBOARD_AUTH_REQUIRED = os.getenv("DASHBOARD_AUTH_REQUIRED", "true").lower() not in ("0", "false", "no")
+id_token_verifier = IdTokenVerifier(firebase_admin.get_app().project_id or os.getenv("FIREBASE_PROJECT_ID"))
+
+def get_user_profile(uid: str, email: str = None) -> dict:
+    """users/{uid}, from the login profile cache when possible."""
+    cached = user_profiles.get_by_uid(uid)
+    if cached:
+        return cached[1]
+    try:
+        user_doc = retry_firestore_get(db.collection('users').document(uid))
+    except (DeadlineExceeded, ResourceExhausted):
+        stale = user_profiles.get_by_uid(uid, allow_stale=True)
+        if stale:
+            return stale[1]
+        raise
+    if not user_doc.exists:
+        return None
+    profile = user_doc.to_dict()
+    if profile.get("email") or email:
+        user_profiles.set(profile.get("email") or email, uid, profile)
+    return profile
+
+def require_service_line_access(view):
+    """Require a valid Firebase ID token whose user lists the requested service line."""
+    @wraps(view)
+    def wrapper(service_line_number, *args, **kwargs):
+        if not DASHBOARD_AUTH_REQUIRED:
+            return view(service_line_number, *args, **kwargs)
+        header = request.headers.get("Authorization", "")
+        if not header.startswith("Bearer "):
+            return jsonify({"error": "Missing bearer token"}), 401
+        try:
+            claims = id_token_verifier.verify(header[len("Bearer "):].strip())
+            profile = get_user_profile(claims["sub"], claims.get("email"))
+        except InvalidIdToken as e:
+            logger.info(f"Rejected ID token: {e}")
+            return jsonify({"error": "Invalid or expired token"}), 401
+        except (CertificateFetchError, GoogleAPICallError) as e:
+            logger.warning(f"Authorization unavailable: {e}")
+            return firestore_busy_response("Authorization temporarily unavailable, please try again shortly.")
+        allowed = (profile or {}).get("serviceLineNumber") or []
+        if service_line_number not in allowed:
+            return jsonify({"error": "Not authorized for this service line"}), 403
+        g.user_claims = claims
+        return view(service_line_number, *args, **kwargs)
+    return wrapper
+
+# (fetch graph task, telemetry_data key, device type) of the telemetry sections
+DASHBOARD_DEVICES = (
+    ("user_terminal_telemetry", "userTerminal", "u"),
+    ("router_telemetry", "router", "r"),
+)
+
+def dashboard_query_cache_key(service_line_number: str, query: DashboardQuery) -> str:
+    return dashboard_cache_key(
+        service_line_number,
+        f"{query.start_ns}:{query.end_ns}:{query.max_points}:"
+        f"{','.join(sorted(query.fields or []))}:{query.include_records}:{query.columnar}",
+    )
+
+def dashboard_graph_deps(include_records: bool, streamed: bool = False) -> dict:
+    """
+    Dependencies between the dashboard fetches. Everything except the address and
+    per-device lookups is independent, so a request costs roughly the slowest
+    branch instead of the sum of all of them. Record streams only wait for the
+    summary when they are served from it. Streamed responses leave the telemetry
+    sections out; they are produced while the body is written.
+    """
+    telemetry_deps = {
+        device_type: ("user_terminal",) if include_records else ("user_terminal", f"{device_type}_summary")
+        for device_type in ("u", "r")
+    }
+    graph = {
+        "service_line": (),
+        "billing": (),
+        "user_terminal": (),
+        "address": ("service_line", "user_terminal"),
+        "u_summary": ("user_terminal",),
+        "r_summary": ("user_terminal",),
+        "user_terminal_sw": ("u_summary",),
+        "router_sw": ("r_summary",),
+    }
+    if not streamed:
+        for task, _, device_type in DASHBOARD_DEVICES:
+            graph[task] = telemetry_deps[device_type]
+    return graph
+
+def dashboard_device_id(results: dict, device_type: str) -> str:
+    key = "userTerminalId" if device_type == "u" else "routerId"
+    return (results["user_terminal"] or {}).get(key)
+
+def assemble_dashboard_response(service_line_number: str, results: dict, timed_out: list, failed: list = ()):
+    """
+    (status, body dict, cache tags) for a finished fetch graph. Tags are the
+    Firestore docs the response was built from, so the ingest side can invalidate
+    exactly the cache entries it touches; they are None when it must not be cached.
+    """
+    service_line = results["service_line"]
+    if not service_line:
+        if "service_line" in timed_out:
+            return 503, {"error": "Timed out loading service line"}, None
+        if "service_line" in failed:
+            return 503, {"error": "Error loading service line"}, None
+        return 404, {"error": "Service line not found"}, None
+
+    nickname = service_line.get("nickname")
+    formatted_address = results["address"]
+    data_usage = results["billing"] or []
+    user_terminal_doc = results["user_terminal"]
+    kit_serial = user_terminal_doc.get("kitSerialNumber") if user_terminal_doc else None
+    user_terminal_id = user_terminal_doc.get("userTerminalId") if user_terminal_doc else None
+    dish_serial = user_terminal_doc.get("dishSerialNumber") if user_terminal_doc else None
+    router_id = user_terminal_doc.get("routerId") if user_terminal_doc else None
+
+    user_terminal_sw = results["user_terminal_sw"]
+    router_sw = results["router_sw"]
+    if router_sw is None:
+        router_sw = "2025.02.12.mr46561"
+
+    # Real telemetry data from Firebase
+    user_terminal_data = results.get("user_terminal_telemetry") or {}
+    router_data = results.get("router_telemetry") or {}
+
+    # Prepare response data
+    response_data = {
+        "nickname": nickname,
+        "kitSerialNumber": kit_serial,
+        "formattedAddress": formatted_address,
+        "dataUsage": data_usage,
+        "userTerminalId": user_terminal_id,
+        "routerId": router_id,
+        "dishSerialNumber": dish_serial,
+        "user_terminal_software_version": user_terminal_sw,
+        "router_software_version": router_sw,
+        "telemetry_data": {
+            "userTerminal": user_terminal_data,  # Real telemetry data
+            "router": router_data               # Real telemetry data
+        },
+        "active": service_line.get("active")  # <-- Add this line
+    }
+    if timed_out or failed:
+        # Partial response: these sections missed the fetch deadline or failed
+        if timed_out:
+            response_data["timedOut"] = timed_out
+        if failed:
+            response_data["failed"] = failed
+        return 200, response_data, None
+
+    return 200, response_data, [
+        f"service_lines/{service_line_number}",
+        f"addresses/{service_line.get('addressReferenceId')}",
+        f"user_terminals/{user_terminal_id}",
+        f"service_line_devices/{service_line_number}",
+        f"telemetry_raw/{get_device_doc_id('u', user_terminal_id)}",
+        f"telemetry_raw/{get_device_doc_id('r', router_id)}",
+    ]
+
+def telemetry_section(device_type: str, data: dict, query: DashboardQuery) -> dict:
+    """
+    A device's telemetry_data entry in the requested wire format. format=columnar
+    replaces 'allRecords' with 'columns': each projected field once, with one
+    value per record (None where a record lacks it).
+    """
+    if not query.columnar or not data:
+        return data
+    return {
+        "columns": records_to_columns(data["allRecords"], projection_for_device(device_type, query.fields)),
+        "aggregates": data["aggregates"],
+    }
+
+def dashboard_stream_metadata(response_data: dict) -> dict:
+    """Top-level fields of an assembled response, without the telemetry sections."""
+    return {key: value for key, value in response_data.items() if key != "telemetry_data"}
+
+def dashboard_stream_columns(query: DashboardQuery) -> dict:
+    """Column names per telemetry section for a columnar stream, else None."""
+    if not query.columnar:
+        return None
+    return {label: projection_for_device(device_type, query.fields) for _, label, device_type in DASHBOARD_DEVICES}
+
+def stream_device_records(encoder: DashboardStreamEncoder, label: str, device_type: str, device_id: str,
+                          query: DashboardQuery):
+    """Encode one device's records in batches straight from Firestore, aggregating as they pass."""
+    aggregator = TelemetryAggregator(fields_for_device(device_type, query.fields))
+    projection = projection_for_device(device_type, query.fields)
+    records = iter_telemetry_records(get_device_doc_id(device_type, device_id), projection, query.start_ns, query.end_ns)
+    error = None
+    yield encoder.begin_device(label)
+    try:
+        for batch in batched(records):
+            for record in batch:
+                aggregator.add(record)
+            yield encoder.records(label, batch)
+    except Exception as e:
+        logger.error(f"Telemetry stream for {device_type}:{device_id} failed: {e}")
+        error = "Telemetry stream interrupted"
+    yield encoder.end_device(label, aggregator.result(), error)
+
+def stream_dashboard_body(encoder: DashboardStreamEncoder, metadata: dict, results: dict, query: DashboardQuery):
+    """Body of a streamed dashboard response: metadata first, then each device's telemetry."""
+    yield encoder.begin(metadata)
+    for _, label, device_type in DASHBOARD_DEVICES:
+        device_id = dashboard_device_id(results, device_type)
+        if not device_id:
+            yield encoder.device(label, {})
+        elif not query.include_records:
+            yield encoder.device(label, {
+                "allRecords": [], "aggregates": summary_to_aggregates(results[f"{device_type}_summary"])
+            })
+        elif query.max_points:
+            # LTTB needs the whole range, so only the downsampled records are streamed
+            try:
+                data = get_all_telemetry_records(
+                    device_type, device_id, query.start_ns, query.end_ns, query.max_points, query.fields
+                )
+            except Exception as e:
+                logger.error(f"Telemetry fetch for {device_type}:{device_id} failed: {e}")
+                yield encoder.begin_device(label) + encoder.end_device(label, {}, "Telemetry fetch failed")
+            else:
+                yield encoder.device(label, data)
+        else:
+            yield from stream_device_records(encoder, label, device_type, device_id, query)
+    yield encoder.end()
+
 @app.route('/api/dashboard-data/<service_line_number>', methods=['GET'])
+@require_service_line_access
 def api_get_dashboard_data(service_line_number):
     logger.info(f"Received API call for service_line_number: {service_line_number}")
     try:
-        service_line = get_service_line(service_line_number)
-        if not service_line:
-            return jsonify({"error": "Service line not found"}), 404
-
-        nickname = service_line.get("nickname")
-        address_ref_id = service_line.get("addressReferenceId")
-        formatted_address = get_formatted_address(address_ref_id) if address_ref_id else None
-        data_usage = get_billing_records_for_service_line(service_line_number)
-        user_terminal_doc = get_user_terminal_by_service_line(service_line_number)
-        kit_serial = user_terminal_doc.get("kitSerialNumber") if user_terminal_doc else None
-        user_terminal_id = user_terminal_doc.get("userTerminalId") if user_terminal_doc else None
-        dish_serial = user_terminal_doc.get("dishSerialNumber") if user_terminal_doc else None
-        router_id = user_terminal_doc.get("routerId") if user_terminal_doc else None
-
-        user_terminal_sw = get_telemetry_software_version("u", user_terminal_id) if user_terminal_id else None
-        router_sw = get_telemetry_software_version("r", router_id) if router_id else None
-        if router_sw is None:
-            router_sw = "2025.02.12.mr46561"
-            
-        # Fetch real telemetry data from Firebase
-        user_terminal_data = {}
-        router_data = {}
-
-        if user_terminal_id:
-            logger.info(f"Fetching telemetry data for user terminal: {user_terminal_id}")
-            user_terminal_data = get_all_telemetry_records("u", user_terminal_id)
-
-        if router_id:
-            logger.info(f"Fetching telemetry data for router: {router_id}")
-            router_data = get_all_telemetry_records("r", router_id)
-
-        # Update software versions using real telemetry data
-        if user_terminal_sw is None and user_terminal_id:
-            user_terminal_sw = get_telemetry_software_version("u", user_terminal_id)
-
-        if router_sw is None and router_id:
-            router_sw = get_telemetry_software_version("r", router_id)
-
-        # Prepare response data
-        response_data = {
-            "nickname": nickname,
-            "kitSerialNumber": kit_serial,
-            "formattedAddress": formatted_address,
-            "dataUsage": data_usage,
-            "userTerminalId": user_terminal_id,
-            "routerId": router_id,
-            "dishSerialNumber": dish_serial,
-            "user_terminal_software_version": user_terminal_sw,
-            "router_software_version": router_sw,
-            "telemetry_data": {
-                "userTerminal": user_terminal_data,  # Real telemetry data
-                "router": router_data               # Real telemetry data
-            },
-            "active": service_line.get("active")  # <-- Add this line
+        try:
+            query = parse_dashboard_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+        cache_key = dashboard_query_cache_key(service_line_number, query)
+        # A cached body is the same document ?stream=json would produce
+        cached_body = read_dashboard_cache(cache_key) if query.stream != "ndjson" else None
+        if cached_body is not None:
+            logger.info(f"Serving cached dashboard data for {service_line_number}")
+            return Response(cached_body, status=200, mimetype="application/json")
+
+        def fetch_summary(results, device_type):
+            device_id = dashboard_device_id(results, device_type)
+            return get_telemetry_summary(device_type, device_id) if device_id else None
+
+        def fetch_software_version(results, device_type):
+            summary = results[f"{device_type}_summary"]
+            if summary and summary.get("softwareVersion"):
+                return summary["softwareVersion"]
+            # Devices ingested before summaries existed
+            device_id = dashboard_device_id(results, device_type)
+            return get_telemetry_software_version(device_type, device_id) if device_id else None
+
+        def fetch_telemetry(results, device_type):
+            device_id = dashboard_device_id(results, device_type)
+            if not device_id:
+                return {}
+            if not query.include_records:
+                # O(1) path: aggregates straight from the ingest-time summary document
+                data = {"allRecords": [], "aggregates": summary_to_aggregates(results[f"{device_type}_summary"])}
+            else:
+                logger.info(f"Fetching telemetry data for device {device_type}: {device_id}")
+                data = get_all_telemetry_records(
+                    device_type, device_id, query.start_ns, query.end_ns, query.max_points, query.fields
+                )
+            return telemetry_section(device_type, data, query)
+
+        def fetch_address(results):
+            indexed_address = (results["user_terminal"] or {}).get("formattedAddress")
+            if indexed_address:
+                return indexed_address
+            address_ref_id = (results["service_line"] or {}).get("addressReferenceId")
+            return get_formatted_address(address_ref_id) if address_ref_id else None
+
+        fetchers = {
+            "service_line": lambda r: get_service_line(service_line_number),
+            "billing": lambda r: get_billing_records_for_service_line(service_line_number),
+            "user_terminal": lambda r: get_user_terminal_by_service_line(service_line_number),
+            "address": fetch_address,
+            "u_summary": lambda r: fetch_summary(r, "u"),
+            "r_summary": lambda r: fetch_summary(r, "r"),
+            "user_terminal_sw": lambda r: fetch_software_version(r, "u"),
+            "router_sw": lambda r: fetch_software_version(r, "r"),
+            "user_terminal_telemetry": lambda r: fetch_telemetry(r, "u"),
+            "router_telemetry": lambda r: fetch_telemetry(r, "r"),
         }
+        graph = dashboard_graph_deps(query.include_records, streamed=bool(query.stream))
+        try:
+            results, timed_out, failed = run_fetch_graph({name: (deps, fetchers[name]) for name, deps in graph.items()})
+        except FetchPoolSaturated as e:
+            logger.warning(f"Rejecting dashboard request: {e}")
+            return firestore_busy_response('Database busy, please try again shortly.')
+
+        status, response_data, cache_tags = assemble_dashboard_response(
+            service_line_number, results, timed_out, failed
+        )
+        if status != 200:
+            return jsonify(response_data), status
+
+        if query.stream:
+            encoder = DashboardStreamEncoder(query.stream, app.json.dumps, dashboard_stream_columns(query))
+            body = stream_dashboard_body(encoder, dashboard_stream_metadata(response_data), results, query)
+            return Response((chunk for chunk in body if chunk), status=200, mimetype=encoder.mimetype)
 
         logger.info(f"Response Data: {response_data}")
-        return jsonify(response_data), 200
+        body = app.json.dumps_bytes(response_data)
+        if cache_tags:
+            write_dashboard_cache(cache_key, body, tags=cache_tags)
+        return Response(body, status=200, mimetype="application/json")
 
     except ValueError as e:
         logger.error("ValueError: %s", e)
@@ -468,6 +804,7 @@ def api_register():
                 "serviceLineNumber": [service_line_number],
                 "createdAt": firestore.SERVER_TIMESTAMP
             })
+            user_profiles.invalidate(email)
             logger.info("User information stored successfully in Firestore.")
         except Exception as e:
             logger.error(f"Error storing user information in Firestore: {e}")
@@ -500,30 +837,105 @@ def api_register():
 # ---------------------------------------------------
 # 4C. New Endpoint to Handle Login
 # ---------------------------------------------------
-def retry_firestore_get(doc_ref, max_retries=3, base_delay=1):
-    """Retry Firestore .get() with exponential backoff for quota errors."""
+# --- Login pipeline ---
+# signInWithPassword goes over a pooled keep-alive session, the UID comes from the
+# returned ID token, and users/{uid} profiles are cached per email, so a repeat
+# login costs one identitytoolkit round trip.
+IDENTITY_TOOLKIT_URL = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
+SECURE_TOKEN_URL = "https://securetoken.googleapis.com/v1/token"
+LOGIN_PROFILE_TTL = float(os.getenv("LOGIN_PROFILE_TTL", "300"))
+LOGIN_PROFILE_MAX_ENTRIES = int(os.getenv("LOGIN_PROFILE_MAX_ENTRIES", "10000"))
+# Suggested client retry delay when Firestore is throttling
+FIRESTORE_RETRY_AFTER = 2
+
+identity_session = requests.Session()
+identity_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=32, max_retries=0))
+
+class UserProfileCache:
+    """
+    users/{uid} documents keyed by email, with a TTL. Expired entries are kept
+    (up to the size bound) so they can still be served while Firestore throttles.
+    """
+
+    def __init__(self, ttl=LOGIN_PROFILE_TTL, max_entries=LOGIN_PROFILE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # email -> (expires_at, uid, profile)
+        self._email_by_uid = {}
+        self._lock = threading.Lock()
+
+    def get(self, email, allow_stale=False):
+        """(uid, profile) for 'email', or None if missing (or expired, unless allow_stale)."""
+        key = email.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (not allow_stale and entry[0] < monotonic()):
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def get_by_uid(self, uid, allow_stale=False):
+        with self._lock:
+            email = self._email_by_uid.get(uid)
+        return self.get(email, allow_stale) if email else None
+
+    def set(self, email, uid, profile):
+        key = email.lower()
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, uid, profile)
+            self._entries.move_to_end(key)
+            self._email_by_uid[uid] = key
+            while len(self._entries) > self.max_entries:
+                _, (_, old_uid, _) = self._entries.popitem(last=False)
+                self._email_by_uid.pop(old_uid, None)
+
+    def invalidate(self, email):
+        with self._lock:
+            entry = self._entries.pop(email.lower(), None)
+            if entry:
+                self._email_by_uid.pop(entry[1], None)
+
+user_profiles = UserProfileCache()
+
+def uid_from_id_token(id_token):
+    """
+    UID claim of an ID token we just received from identitytoolkit over TLS.
+    The signature is not checked here; use it only for tokens fetched by this server.
+    """
+    try:
+        payload = id_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return claims.get("user_id") or claims.get("sub")
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def retry_firestore_get(doc_ref, max_retries=2):
+    """
+    Firestore .get() with an immediate retry for transient errors. Nothing sleeps
+    here: quota errors and timeouts are raised straight away so the caller can
+    answer 503 with Retry-After (or serve a cached copy) instead of pinning the worker.
+    """
     for attempt in range(max_retries):
         try:
             return doc_ref.get(timeout=5)
-        except ResourceExhausted as e:
-            if attempt < max_retries - 1:
-                sleep(base_delay * (2 ** attempt))
-            else:
-                raise
-        except DeadlineExceeded:
+        except (ResourceExhausted, DeadlineExceeded):
             raise
-        except GoogleAPICallError as e:
-            if attempt < max_retries - 1:
-                sleep(base_delay * (2 ** attempt))
-            else:
+        except GoogleAPICallError:
+            if attempt >= max_retries - 1:
                 raise
 
+def firestore_busy_response(message):
+    response = jsonify({'error': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(FIRESTORE_RETRY_AFTER)
+    return response
+
 @app.route('/api/login', methods=['POST'])
 def api_login():
     """
     Authenticates a user using Firebase Auth REST API.
     Expects JSON: {"email": ..., "password": ...}
-    Returns: {"idToken": ..., "serviceLines": ...}
+    Returns: {"idToken": ..., "refreshToken": ..., "expiresIn": ..., "serviceLines": ...}
     """
     try:
         data = request.get_json()
@@ -532,44 +944,116 @@ def api_login():
         if not email or not password:
             return jsonify({"error": "Missing email or password."}), 400
 
-        # Firebase REST API endpoint for signInWithPassword
         FIREBASE_API_KEY = os.getenv("FIREBASE_API_KEY")
         if not FIREBASE_API_KEY:
             raise ValueError("FIREBASE_API_KEY environment variable is not set")
-        url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}"
         payload = {
             "email": email,
             "password": password,
             "returnSecureToken": True
         }
-        resp = requests.post(url, json=payload)
+        resp = identity_session.post(IDENTITY_TOOLKIT_URL, params={"key": FIREBASE_API_KEY}, json=payload, timeout=10)
         if resp.status_code != 200:
             return jsonify({"error": "Invalid email or password."}), 401
-        id_token = resp.json().get("idToken")
+        sign_in = resp.json()
+        id_token = sign_in.get("idToken")
+        uid = uid_from_id_token(id_token) or sign_in.get("localId")
+
+        cached = user_profiles.get(email)
+        if cached and cached[0] == uid:
+            profile = cached[1]
+        else:
+            try:
+                user_doc = retry_firestore_get(db.collection('users').document(uid))
+            except (DeadlineExceeded, ResourceExhausted) as e:
+                stale = user_profiles.get(email, allow_stale=True)
+                if not stale or stale[0] != uid:
+                    logger.warning(f"Firestore unavailable during login: {e}")
+                    return firestore_busy_response('Database busy, please try again shortly.')
+                logger.warning(f"Serving cached profile for {uid}; Firestore unavailable: {e}")
+                profile = stale[1]
+            except GoogleAPICallError as e:
+                logger.error(f"Firestore error: {e}")
+                return jsonify({'error': 'Firestore error'}), 500
+            else:
+                if not user_doc.exists:
+                    return jsonify({'error': 'User not found'}), 401
+                profile = user_doc.to_dict()
+                user_profiles.set(email, uid, profile)
+
+        service_lines = profile.get("serviceLineNumber", [])
+        return jsonify(login_response(sign_in, service_lines)), 200
 
-        try:
-            user_record = auth.get_user_by_email(email)
-            user_doc = retry_firestore_get(db.collection('users').document(user_record.uid))
-        except DeadlineExceeded:
-            return jsonify({'error': 'Database timeout, please try again later.'}), 503
-        except ResourceExhausted:
-            return jsonify({'error': 'Firestore quota exceeded. Please try again later.'}), 503
-        except GoogleAPICallError as e:
-            logger.error(f"Firestore error: {e}")
-            return jsonify({'error': 'Firestore error'}), 500
-
-        if not user_doc.exists:
-            return jsonify({'error': 'User not found'}), 401
-
-        service_lines = user_doc.to_dict().get("serviceLineNumber", []) if user_doc.exists else []
-        return jsonify({"idToken": id_token, "serviceLines": service_lines}), 200
-
-    except auth.InvalidIdTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
     except Exception as e:
         logger.error(f"Login error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def login_response(sign_in, service_lines):
+    """Body of a successful login; the refresh token lets the dashboard renew the hour-long ID token."""
+    return {
+        "idToken": sign_in.get("idToken"),
+        "refreshToken": sign_in.get("refreshToken"),
+        "expiresIn": sign_in.get("expiresIn"),
+        "serviceLines": service_lines,
+    }
+
+@app.route('/api/refresh-token', methods=['POST'])
+def api_refresh_token():
+    """
+    Exchanges the refresh token from /api/login for a new ID token.
+    Expects JSON: {"refreshToken": ...}
+    Returns: {"idToken": ..., "refreshToken": ..., "expiresIn": ...}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        refresh_token = data.get("refreshToken")
+        if not refresh_token:
+            return jsonify({"error": "Missing refresh token."}), 400
+
+        FIREBASE_API_KEY = os.getenv("FIREBASE_API_KEY")
+        if not FIREBASE_API_KEY:
+            raise ValueError("FIREBASE_API_KEY environment variable is not set")
+        resp = identity_session.post(
+            SECURE_TOKEN_URL,
+            params={"key": FIREBASE_API_KEY},
+            data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+            timeout=10,
+        )
+        if resp.status_code != 200:
+            return jsonify({"error": "Session expired, please log in again."}), 401
+        token = resp.json()
+        return jsonify({
+            "idToken": token.get("id_token"),
+            "refreshToken": token.get("refresh_token"),
+            "expiresIn": token.get("expires_in"),
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Token refresh error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# --- Response compression for the JSON API (see response_compression.py) ---
+@app.after_request
+def compress_response(response):
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
 # --- Global error handlers to ensure JSON responses for 500/503 ---
 @app.errorhandler(500)
 def handle_500_error(e):
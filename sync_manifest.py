@@ -0,0 +1,148 @@
+"""
+Change detection for the entity sync.
+
+A local manifest keeps the last content hash written (or seen) per document
+path, so entities that have not changed since the previous sync skip the
+Firestore read. Entries are [hash, verified_at]; after SYNC_MANIFEST_TTL seconds
+the document is read and compared again, so edits or deletions made outside
+this process are repaired by a later sync.
+
+bulk_upsert_if_changed() is given the Firestore client plus the commit and
+cache invalidation callables by Data_Storage, so it runs against fakes as well.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HASH_MANIFEST_PATH = os.getenv("SYNC_HASH_MANIFEST", "sync_manifest.json")
+SYNC_MANIFEST_TTL = int(os.getenv("SYNC_MANIFEST_TTL", "86400"))
+BULK_READ_CHUNK = 100
+BULK_WRITE_CHUNK = 200
+
+
+def content_hash(data):
+    """Stable hash of a document's content, independent of key order."""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def manifest_is_current(entry, new_hash, now, ttl=SYNC_MANIFEST_TTL):
+    """True when a manifest entry vouches for 'new_hash' and was verified within the TTL."""
+    # Entries from before the TTL was introduced are bare hashes: verify those again
+    if not isinstance(entry, list) or len(entry) != 2:
+        return False
+    stored_hash, verified_at = entry
+    # 75-100% of the TTL, fixed per hash, so a full sync's entries do not all expire together
+    ttl = ttl * (0.75 + 0.25 * int(stored_hash[:8], 16) / 0xFFFFFFFF)
+    return stored_hash == new_hash and now - verified_at < ttl
+
+
+class HashManifest:
+    """The manifest file at 'path', loaded on first use and shared by every sync thread."""
+
+    def __init__(self, path=HASH_MANIFEST_PATH, ttl=SYNC_MANIFEST_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                self._entries = {}
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable hash manifest {self.path}: {e}")
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._load())
+
+    def is_current(self, entry, new_hash, now):
+        return manifest_is_current(entry, new_hash, now, self.ttl)
+
+    def record(self, hashes, now):
+        """Mark {path: hash} as verified at 'now'."""
+        with self._lock:
+            self._load().update({path: [new_hash, now] for path, new_hash in hashes.items()})
+            self._save()
+
+    def forget(self, paths):
+        """Drop entries for deleted documents, so recreating one is never skipped."""
+        with self._lock:
+            entries = self._load()
+            removed = [path for path in paths if entries.pop(path, None) is not None]
+            if removed:
+                self._save()
+
+
+def bulk_upsert_if_changed(db, manifest, entries, merge=False, commit=lambda batch: batch.commit(),
+                           invalidate=lambda *tags: None):
+    """
+    Write the (doc_ref, new_data) pairs whose content changed. Documents whose hash
+    matches a manifest entry younger than the TTL are skipped without a read; the
+    rest are read with db.get_all() in chunks, compared by content hash, and only
+    the changed ones are written through batched commit() calls. The manifest is
+    only updated once every commit succeeded. Returns the number of documents written.
+    """
+    if not entries:
+        return 0
+    known = manifest.snapshot()
+
+    now = time.time()
+    hashes = {}
+    to_check = {}
+    for doc_ref, new_data in entries:
+        new_hash = content_hash(new_data)
+        hashes[doc_ref.path] = new_hash
+        if not manifest.is_current(known.get(doc_ref.path), new_hash, now):
+            to_check[doc_ref.path] = (doc_ref, new_data)
+    skipped = len(entries) - len(to_check)
+
+    changed = []
+    paths = list(to_check)
+    for i in range(0, len(paths), BULK_READ_CHUNK):
+        refs = [to_check[path][0] for path in paths[i:i + BULK_READ_CHUNK]]
+        for snap in db.get_all(refs):
+            path = snap.reference.path
+            if snap.exists and content_hash(snap.to_dict()) == hashes[path]:
+                continue
+            changed.append(to_check[path])
+
+    for i in range(0, len(changed), BULK_WRITE_CHUNK):
+        batch = db.batch()
+        for doc_ref, new_data in changed[i:i + BULK_WRITE_CHUNK]:
+            batch.set(doc_ref, new_data, merge=merge)
+        commit(batch)
+
+    if paths:
+        manifest.record({path: hashes[path] for path in paths}, now)
+
+    tags = set()
+    for doc_ref, new_data in changed:
+        tags.add(doc_ref.path)
+        service_line = new_data.get("serviceLineNumber") if isinstance(new_data, dict) else None
+        if service_line:
+            tags.add(f"service_lines/{service_line}")
+    invalidate(*tags)
+
+    logger.info(
+        f"Bulk upsert: {len(entries)} docs, {skipped} skipped via manifest, "
+        f"{len(paths) - len(changed)} unchanged, {len(changed)} written"
+    )
+    return len(changed)
@@ -0,0 +1,112 @@
+"""
+Time-bucketed telemetry layout.
+
+Instead of one document per sample (telemetry_raw/{device}/records/{ts}), each
+device gets one document per time bucket:
+
+  telemetry_buckets/{device}/buckets/{startTs}
+    deviceType: "u"
+    startTs:    bucket start, epoch seconds
+    columns:    {schemaKey: [field names]}
+    samples:    {"<UtcTimestampNs>": [schemaKey, value, value, ...]}
+
+Only the registered telemetry fields are kept, as a positional list per sample;
+the names are stored once per bucket under 'columns'. Writes are merge-sets into
+the 'samples' map keyed by UtcTimestampNs, so they need no read and replaying a
+batch is harmless. A dashboard read costs one document per bucket instead of
+one per sample.
+
+TELEMETRY_LAYOUT selects the format:
+  "records" (default) write and read per-sample documents
+  "both"              write both, read per-sample documents (use while migrating)
+  "buckets"           write and read buckets
+
+Bucket documents hold many map keys, so exempt the 'samples' field of the
+'buckets' collection group from indexing in Firestore.
+"""
+import os
+import zlib
+from datetime import datetime, timezone
+
+from telemetry_fields import fields_for_device
+
+TELEMETRY_LAYOUT = os.getenv("TELEMETRY_LAYOUT", "records")
+TELEMETRY_BUCKET_SECONDS = int(os.getenv("TELEMETRY_BUCKET_SECONDS", "3600"))
+
+BUCKET_COLLECTION = "telemetry_buckets"
+BUCKET_SUBCOLLECTION = "buckets"
+
+
+def writes_records(layout=TELEMETRY_LAYOUT):
+    return layout in ("records", "both")
+
+
+def writes_buckets(layout=TELEMETRY_LAYOUT):
+    return layout in ("buckets", "both")
+
+
+def reads_buckets(layout=TELEMETRY_LAYOUT):
+    return layout == "buckets"
+
+
+def bucket_start(timestamp_ns, bucket_seconds=TELEMETRY_BUCKET_SECONDS):
+    """Epoch seconds of the bucket holding 'timestamp_ns'."""
+    seconds = int(timestamp_ns) // 1_000_000_000
+    return seconds - seconds % bucket_seconds
+
+
+def bucket_columns(device_type):
+    return [f.name for f in fields_for_device(device_type)]
+
+
+def schema_key(columns):
+    return format(zlib.crc32("\x1f".join(columns).encode()), "08x")
+
+
+def build_bucket_update(device_type, start_ts, samples):
+    """
+    Merge-set for one bucket document. 'samples' is an iterable of
+    (UtcTimestampNs, record dict) pairs.
+    """
+    columns = bucket_columns(device_type)
+    key = schema_key(columns)
+    return {
+        "deviceType": device_type,
+        "startTs": start_ts,
+        "columns": {key: columns},
+        "samples": {
+            str(int(ts)): [key] + [record.get(name) for name in columns]
+            for ts, record in samples
+        },
+    }
+
+
+def group_into_buckets(samples, bucket_seconds=TELEMETRY_BUCKET_SECONDS):
+    """{startTs: [(UtcTimestampNs, record), ...]} for (UtcTimestampNs, record) pairs."""
+    buckets = {}
+    for ts, record in samples:
+        buckets.setdefault(bucket_start(ts, bucket_seconds), []).append((ts, record))
+    return buckets
+
+
+def iter_bucket_records(bucket, projection, start_ns=None, end_ns=None):
+    """
+    Records of one bucket document in timestamp order, holding only the projected
+    columns (plus UtcTimestampNs and the ISO 'timestamp'), limited to [start_ns, end_ns].
+    """
+    schemas = bucket.get("columns", {})
+    wanted = set(projection)
+    samples = sorted((int(ts), values) for ts, values in bucket.get("samples", {}).items())
+    for ts, values in samples:
+        if (start_ns is not None and ts < start_ns) or (end_ns is not None and ts > end_ns):
+            continue
+        columns = schemas.get(values[0], ())
+        record = {}
+        if "UtcTimestampNs" in wanted:
+            record["UtcTimestampNs"] = ts
+        if "timestamp" in wanted:
+            record["timestamp"] = datetime.fromtimestamp(ts // 1_000_000_000, tz=timezone.utc).isoformat()
+        for name, value in zip(columns, values[1:]):
+            if value is not None and name in wanted:
+                record[name] = value
+        yield record
@@ -0,0 +1,498 @@
+"""
+Telemetry field registry and single-pass aggregation engine.
+
+TELEMETRY_FIELDS declares every telemetry column the dashboard understands, which
+device type reports it and how it is aggregated. Both server.py and Data_Storage.py
+use it, so adding a field here is enough to have it aggregated everywhere.
+
+Kinds:
+  - "numeric": accumulated into a typed array; min/max/last/mean/count/percentiles
+  - "flag":    booleans; min/max are all()/any() of the samples, plus last/count
+  - "label":   strings such as software versions; only last/count
+"""
+import math
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime, timezone
+
+TelemetryField = namedtuple("TelemetryField", ["name", "device_type", "kind"])
+
+TELEMETRY_FIELDS = (
+    # User terminal (Starlink dish) fields
+    TelemetryField("DishPingDropRate", "u", "numeric"),
+    TelemetryField("DishPingLatencyMs", "u", "numeric"),
+    TelemetryField("DownlinkThroughput", "u", "numeric"),
+    TelemetryField("UplinkThroughput", "u", "numeric"),
+    TelemetryField("ObstructionPercentTime", "u", "numeric"),
+    TelemetryField("PingDropRateAvg", "u", "numeric"),
+    TelemetryField("PingLatencyMsAvg", "u", "numeric"),
+    TelemetryField("RunningSoftwareVersion", "u", "label"),
+    TelemetryField("SignalQuality", "u", "numeric"),
+
+    # Router fields
+    TelemetryField("InternetPingDropRate", "r", "numeric"),
+    TelemetryField("InternetPingLatencyMs", "r", "numeric"),
+    TelemetryField("WifiHardwareVersion", "r", "label"),
+    TelemetryField("WifiIsBypassed", "r", "flag"),
+    TelemetryField("WifiIsRepeater", "r", "flag"),
+    TelemetryField("WifiPopPingDropRate", "r", "numeric"),
+    TelemetryField("WifiPopPingLatencyMs", "r", "numeric"),
+    TelemetryField("WifiSoftwareVersion", "r", "label"),
+)
+
+PERCENTILES = (50, 95)
+
+# Field holding the running software version for each device type
+SOFTWARE_VERSION_FIELD = {
+    "u": "RunningSoftwareVersion",
+    "r": "WifiSoftwareVersion",
+}
+
+# Columns every telemetry read carries besides the registered fields
+TIMESTAMP_FIELDS = ("UtcTimestampNs", "timestamp")
+
+
+# Prefix of the telemetry_raw / telemetry_summary document ID for each device type
+DEVICE_DOC_PREFIX = {
+    "u": "ut",
+    "r": "Router-",
+}
+
+
+def device_doc_id(device_type, device_id):
+    """Telemetry document ID for a device ("ut..." / "Router-..."), as the stream names them."""
+    if not device_id:
+        return ""
+    prefix = DEVICE_DOC_PREFIX.get(device_type, "")
+    return device_id if device_id.startswith(prefix) else f"{prefix}{device_id}"
+
+
+def fields_for_device(device_type, names=None):
+    """Registered fields for a device type, optionally restricted to 'names'."""
+    return tuple(
+        f for f in TELEMETRY_FIELDS
+        if f.device_type == device_type and (not names or f.name in names)
+    )
+
+
+def projection_for_device(device_type, names=None):
+    """
+    Field paths to pass to Firestore select() for a device's telemetry records.
+    Unknown names are dropped, so callers can pass user input straight through.
+    """
+    return list(TIMESTAMP_FIELDS) + [f.name for f in fields_for_device(device_type, names)]
+
+
+def serialize_projected(snapshot, projection):
+    """Record dict holding only the projected columns, in projection order."""
+    data = snapshot.to_dict() or {}
+    return {name: data[name] for name in projection if name in data}
+
+
+def records_to_columns(records, names):
+    """{name: [value per record]} for a list of record dicts; missing values are None."""
+    return {name: [record.get(name) for record in records] for name in names}
+
+
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted sequence."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = math.floor(k)
+    hi = math.ceil(k)
+    if lo == hi:
+        return sorted_values[int(k)]
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class TelemetryAggregator:
+    """
+    Accumulates records in one pass and computes per-field statistics at the end.
+    Only the fields passed in are inspected per record; every registered field is
+    still present in the result so the response shape stays the same for both devices.
+    """
+
+    def __init__(self, fields=TELEMETRY_FIELDS):
+        self.fields = tuple(fields)
+        self._numeric = {f.name: array("d") for f in self.fields if f.kind == "numeric"}
+        self._flags = {f.name: [True, False, 0] for f in self.fields if f.kind == "flag"}  # all, any, count
+        self._counts = {f.name: 0 for f in self.fields}
+        self._last = {}
+
+    def add(self, record):
+        numeric = self._numeric
+        flags = self._flags
+        counts = self._counts
+        last = self._last
+        for name in counts:
+            if name not in record:
+                continue
+            value = record[name]
+            counts[name] += 1
+            last[name] = value
+            if name in numeric:
+                if type(value) in (int, float):
+                    numeric[name].append(value)
+            elif name in flags and isinstance(value, bool):
+                acc = flags[name]
+                acc[0] = acc[0] and value
+                acc[1] = acc[1] or value
+                acc[2] += 1
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def add_columns(self, columns):
+        """
+        Fold column-wise samples ({name: sequence of values}) in. Equivalent to
+        add() on every row when each row carries every column.
+        """
+        for name, values in columns.items():
+            if name not in self._counts or not values:
+                continue
+            self._counts[name] += len(values)
+            self._last[name] = values[-1]
+            if name in self._numeric:
+                self._numeric[name].extend(v for v in values if type(v) in (int, float))
+            elif name in self._flags:
+                bools = [v for v in values if isinstance(v, bool)]
+                if bools:
+                    acc = self._flags[name]
+                    acc[0] = acc[0] and all(bools)
+                    acc[1] = acc[1] or any(bools)
+                    acc[2] += len(bools)
+
+    def result(self):
+        aggregates = {}
+        for field in TELEMETRY_FIELDS:
+            name = field.name
+            last = self._last.get(name)
+            count = self._counts.get(name, 0)
+            if name in self._numeric and len(self._numeric[name]):
+                values = self._numeric[name]
+                ordered = sorted(values)
+                total = math.fsum(values)
+                stats = {
+                    "min": ordered[0],
+                    "max": ordered[-1],
+                    "last": values[-1],
+                    "mean": total / len(values),
+                    "sum": total,
+                    "count": len(values),
+                }
+                for pct in PERCENTILES:
+                    stats[f"p{pct}"] = percentile(ordered, pct)
+            elif name in self._flags and self._flags[name][2]:
+                all_true, any_true, _ = self._flags[name]
+                stats = {"min": all_true, "max": any_true, "last": last, "count": count}
+            elif name in self._numeric:
+                # numeric counts cover numeric samples only, as in the branch above
+                stats = {"min": None, "max": None, "last": last, "count": 0}
+            else:
+                stats = {"min": None, "max": None, "last": last, "count": count}
+            aggregates[name] = stats
+        return aggregates
+
+
+def summary_to_aggregates(summary):
+    """
+    Convert a telemetry_summary document (per-field min/max/last/count/sum kept
+    at ingest time) into the same shape TelemetryAggregator.result() returns.
+    Percentiles cannot be kept incrementally, so numeric fields report p50/p95
+    as None; their count is the number of numeric samples, as in result().
+    """
+    stored = (summary or {}).get("fields", {})
+    aggregates = {}
+    for field in TELEMETRY_FIELDS:
+        entry = stored.get(field.name, {})
+        count = entry.get("count", 0)
+        stats = {
+            "min": entry.get("min"),
+            "max": entry.get("max"),
+            "last": entry.get("last"),
+            "count": count,
+        }
+        if field.kind == "numeric" and count:
+            stats["mean"] = entry.get("sum", 0) / count
+            stats["sum"] = entry.get("sum", 0)
+            for pct in PERCENTILES:
+                stats[f"p{pct}"] = None
+        aggregates[field.name] = stats
+    return aggregates
+
+
+def aggregate_records(records, device_type=None):
+    """Aggregate an iterable of record dicts; restrict to one device's fields if given."""
+    aggregator = TelemetryAggregator(fields_for_device(device_type) if device_type else TELEMETRY_FIELDS)
+    aggregator.extend(records)
+    return aggregator.result()
+
+
+# Series used for downsampling when the requested fields include no numeric one
+DEFAULT_PLOT_FIELD = {
+    "u": "DownlinkThroughput",
+    "r": "InternetPingLatencyMs",
+}
+
+
+def downsample_lttb(records, max_points, y_field, x_field="UtcTimestampNs"):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a time-ordered list of records.
+    Whole records are kept (not interpolated), chosen so the shape of 'y_field'
+    is preserved; the first and last records are always included.
+    """
+    return [records[i] for i in lttb_indices(records, max_points, y_field, x_field)]
+
+
+def downsample_lttb_fields(records, max_points, y_fields, x_field="UtcTimestampNs"):
+    """
+    LTTB per field over an equal share of 'max_points' each, keeping the union of
+    the chosen records, so every series keeps its own peaks and dips. Returns at
+    most max(max_points, 3 * len(y_fields)) records in time order.
+    """
+    if not max_points or len(records) <= max_points or not y_fields:
+        return records
+    share = max(3, max_points // len(y_fields))
+    chosen = set()
+    for y_field in y_fields:
+        chosen.update(lttb_indices(records, share, y_field, x_field))
+    return [records[i] for i in sorted(chosen)]
+
+
+def lttb_indices(records, max_points, y_field, x_field="UtcTimestampNs"):
+    """Indices of the records downsample_lttb() keeps, ascending."""
+    n = len(records)
+    if not max_points or n <= max_points:
+        return list(range(n))
+    if max_points < 3:
+        return [0, n - 1][:max_points]
+
+    def xy(index):
+        rec = records[index]
+        x = rec.get(x_field)
+        y = rec.get(y_field)
+        return (
+            x if type(x) in (int, float) else index,
+            y if type(y) in (int, float) else 0.0,
+        )
+
+    points = [xy(i) for i in range(n)]
+    sampled = [0]
+    every = (n - 2) / (max_points - 2)
+    a = 0
+    for i in range(max_points - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        avg_x = sum(p[0] for p in points[avg_start:avg_end]) / span
+        avg_y = sum(p[1] for p in points[avg_start:avg_end]) / span
+
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = points[a]
+        best_area = -1.0
+        best = range_start
+        for j in range(range_start, range_end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(best)
+        a = best
+    sampled.append(n - 1)
+    return sampled
+
+
+# -------------------------------------------------------------------
+# Stream payload decoding
+# -------------------------------------------------------------------
+class DecodedDeviceBatch:
+    """
+    Rows of one device type (and row width) from a telemetry stream payload,
+    transposed into columns. Timestamps are parsed once into an int64 array and
+    record dicts are only built by record(), at write time.
+    """
+
+    __slots__ = ("device_type", "column_names", "rows", "columns", "_index",
+                 "timestamps", "iso_timestamps", "device_rows")
+
+    def __init__(self, device_type, column_names, rows):
+        self.device_type = device_type
+        self.column_names = tuple(column_names)
+        self.rows = rows
+        self.columns = list(zip(*rows))[:len(self.column_names)]
+        self._index = {name: i for i, name in enumerate(self.column_names)}
+        self.timestamps = array("q", map(_timestamp_ns, self.column("UtcTimestampNs")))
+        self.iso_timestamps = iso_timestamps(self.timestamps)
+        # device_id -> row indexes, in payload order; rows without a DeviceId are dropped
+        self.device_rows = {}
+        for i, device_id in enumerate(self.column("DeviceId")):
+            if device_id:
+                self.device_rows.setdefault(device_id, []).append(i)
+
+    def column(self, name, default=None):
+        i = self._index.get(name)
+        return self.columns[i] if i is not None else (default,) * len(self.rows)
+
+    def device_columns(self, device_id, names, rows=None):
+        """
+        {name: values} for one device's rows (or the given subset of them),
+        restricted to columns present in the payload.
+        """
+        rows = self.device_rows[device_id] if rows is None else rows
+        whole = len(rows) == len(self.rows)
+        return {
+            name: self.columns[i] if whole else [self.columns[i][r] for r in rows]
+            for name in names
+            for i in (self._index.get(name),)
+            if i is not None
+        }
+
+    def record(self, row):
+        record = dict(zip(self.column_names, self.rows[row]))
+        iso = self.iso_timestamps[row]
+        if iso is not None:
+            record["timestamp"] = iso
+        return record
+
+
+def _timestamp_ns(value):
+    try:
+        return int(value) if value else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def iso_timestamps(timestamps_ns):
+    """ISO 8601 (UTC, whole seconds) for each nanosecond timestamp; None where it is 0."""
+    memo = {}
+    out = []
+    append = out.append
+    for ns in timestamps_ns:
+        if not ns:
+            append(None)
+            continue
+        seconds = ns // 1_000_000_000
+        iso = memo.get(seconds)
+        if iso is None:
+            iso = memo[seconds] = datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+        append(iso)
+    return out
+
+
+def decode_telemetry_payload(values, column_names_by_device_type):
+    """
+    Group stream rows by device type and transpose them into DecodedDeviceBatch
+    objects. Rows of a type whose columns do not include DeviceId are dropped,
+    as are empty rows.
+    """
+    grouped = {}
+    for row in values:
+        if row:
+            grouped.setdefault((row[0], len(row)), []).append(row)
+    batches = []
+    for (device_type, width), rows in grouped.items():
+        names = tuple(column_names_by_device_type.get(device_type, ()))[:width]
+        if "DeviceId" not in names:
+            continue
+        batches.append(DecodedDeviceBatch(device_type, names, rows))
+    return batches
+
+
+def benchmark_decode(num_records=4000, num_devices=200, repeat=20):
+    """
+    Time decode_telemetry_payload plus aggregation against the row-by-row dict
+    decode on a synthetic payload, with no Firestore involved.
+    """
+    cols = ["DeviceType", "DeviceId", "UtcTimestampNs"] + [f.name for f in fields_for_device("u")]
+    base_ns = time.time_ns()
+    values = []
+    for i in range(num_records):
+        row = ["u", f"ut{i % num_devices:08d}", base_ns + i * 1_000_000_000]
+        for f in fields_for_device("u"):
+            row.append("2024.1" if f.kind == "label" else float(i % 97))
+        values.append(row)
+    column_names = {"u": cols}
+
+    def row_by_row():
+        aggregators = {}
+        for record in values:
+            record_dict = dict(zip(column_names.get(record[0], []), record))
+            ts = record_dict.get("UtcTimestampNs")
+            if ts:
+                record_dict["timestamp"] = datetime.fromtimestamp(int(ts) // 1_000_000_000, tz=timezone.utc).isoformat()
+            device_id = record_dict.get("DeviceId")
+            aggregator = aggregators.get(device_id)
+            if aggregator is None:
+                aggregator = aggregators[device_id] = TelemetryAggregator(fields_for_device("u"))
+            aggregator.add(record_dict)
+
+    def columnar():
+        names = [f.name for f in fields_for_device("u")]
+        for batch in decode_telemetry_payload(values, column_names):
+            for device_id in batch.device_rows:
+                TelemetryAggregator(fields_for_device("u")).add_columns(batch.device_columns(device_id, names))
+
+    results = {}
+    for label, fn in (("row_by_row", row_by_row), ("columnar", columnar)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        results[label] = (time.perf_counter() - started) / repeat
+    return results
+
+
+def benchmark_wire_format(num_records=4000, repeat=10):
+    """
+    Encoded size and encode time of one device's telemetry section as row records
+    versus columns, with the standard library encoder and (if installed) orjson,
+    plus the size after gzip / brotli.
+    """
+    import json
+    from response_compression import compress, supported_encodings
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    names = projection_for_device("u")
+    base_ns = time.time_ns()
+    records = []
+    for i in range(num_records):
+        ts = base_ns + i * 1_000_000_000
+        record = {"UtcTimestampNs": ts, "timestamp": datetime.fromtimestamp(ts // 1_000_000_000, tz=timezone.utc).isoformat()}
+        for f in fields_for_device("u"):
+            record[f.name] = "2024.1" if f.kind == "label" else round((i % 97) * 1.37, 3)
+        records.append(record)
+    sections = {
+        "records": {"allRecords": records},
+        "columnar": {"columns": records_to_columns(records, names)},
+    }
+    encoders = {"stdlib": lambda obj: json.dumps(obj, sort_keys=True).encode("utf-8")}
+    if orjson:
+        encoders["orjson"] = lambda obj: orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+    results = {}
+    for layout, section in sections.items():
+        for encoder_name, encode in encoders.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                body = encode(section)
+            results[(layout, encoder_name)] = {
+                "encode_ms": (time.perf_counter() - started) / repeat * 1000,
+                "bytes": len(body),
+                **{f"{encoding}_bytes": len(compress(body, encoding)) for encoding in supported_encodings()},
+            }
+    return results
+
+
+if __name__ == "__main__":
+    for label, seconds in benchmark_decode().items():
+        print(f"{label:>10}: {seconds * 1000:.1f} ms per 4000-record batch")
+    for (layout, encoder_name), stats in benchmark_wire_format().items():
+        sizes = "  ".join(f"{key}={value:,}" for key, value in stats.items() if key != "encode_ms")
+        print(f"{layout:>10} {encoder_name:>7}: {stats['encode_ms']:.1f} ms  {sizes}")
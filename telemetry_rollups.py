@@ -0,0 +1,82 @@
+"""
+Planning of 15m rollup folds.
+
+Ingest adds every new sample to its 15m bucket (telemetry_rollup_15m) with
+Increment transforms. Whether a sample was already folded is tracked per device
+and bucket: rollup_seen/{deviceId}_{startTs} lists the UtcTimestampNs values
+folded into that bucket, and is written in the same atomic batch as the
+increments. A replayed batch finds its samples listed and adds nothing, while a
+sample that arrives late (older than ones already folded) is still counted.
+
+This module only decides what to write; Data_Storage.fold_into_rollups reads
+the seen lists and commits the batches.
+"""
+from collections import namedtuple
+
+ROLLUP_BASE_MINUTES = 15
+
+# buckets: {start_ts: [sum_ping, sum_signal, count]} to add to the 15m buckets
+# seen:    {(device_id, start_ts): [UtcTimestampNs, ...]} newly folded samples
+RollupBatch = namedtuple("RollupBatch", ["buckets", "seen"])
+
+
+def rollup_bucket_start(ts_seconds, minutes):
+    return ts_seconds - ts_seconds % (minutes * 60)
+
+
+def rollup_values(ping, signal):
+    try:
+        return float(ping), float(signal)
+    except (TypeError, ValueError):
+        return 0, 0
+
+
+def sample_bucket(ts_ns):
+    """Start (epoch seconds) of the 15m bucket holding a UtcTimestampNs."""
+    return rollup_bucket_start(ts_ns // 1_000_000_000, ROLLUP_BASE_MINUTES)
+
+
+def plan_rollup_batches(device_samples, seen, max_writes, floors=None):
+    """
+    The increments for samples not folded yet, as RollupBatch lists of at most
+    'max_writes' writes each (one per bucket plus one per seen entry), oldest
+    buckets first. A (device, bucket) entry never spans two batches, so its
+    increments and its seen list always commit together.
+
+    device_samples: {device_id: [(utc_timestamp_ns, ping, signal), ...]}
+    seen:           {(device_id, start_ts): timestamps already folded}
+    floors:         {device_id: UtcTimestampNs} at or below which samples count as
+                    folded (device watermarks from before the seen lists)
+    """
+    floors = floors or {}
+    pieces = {}  # (device_id, start_ts) -> [sum_ping, sum_signal, {timestamps}]
+    for device_id, samples in device_samples.items():
+        floor = floors.get(device_id, 0)
+        for ts_ns, ping, signal in samples:
+            if ts_ns <= floor:
+                continue
+            key = (device_id, sample_bucket(ts_ns))
+            if ts_ns in seen.get(key, ()):
+                continue
+            piece = pieces.setdefault(key, [0.0, 0.0, set()])
+            if ts_ns in piece[2]:
+                continue
+            piece[0] += ping
+            piece[1] += signal
+            piece[2].add(ts_ns)
+
+    batches = []
+    current = None
+    for key in sorted(pieces, key=lambda k: (k[1], str(k[0]))):
+        device_id, start_ts = key
+        sum_ping, sum_signal, timestamps = pieces[key]
+        cost = 1 + (current is None or start_ts not in current.buckets)
+        if current is None or len(current.buckets) + len(current.seen) + cost > max_writes:
+            current = RollupBatch({}, {})
+            batches.append(current)
+        acc = current.buckets.setdefault(start_ts, [0.0, 0.0, 0])
+        acc[0] += sum_ping
+        acc[1] += sum_signal
+        acc[2] += len(timestamps)
+        current.seen[key] = sorted(timestamps)
+    return batches
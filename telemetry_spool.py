@@ -0,0 +1,270 @@
+"""
+Durable write-ahead spool for telemetry stream batches.
+
+The consumer appends every batch here before anything is written to Firestore,
+and a drainer replays entries in order and advances a checkpoint only after the
+write succeeded. A crash or a Firestore outage therefore leaves unwritten batches
+on disk to be replayed on the next start; telemetry documents are keyed by
+UtcTimestampNs, so replaying a batch that was partly written is harmless.
+
+Layout of a spool directory:
+  000000000000.seg, 000000000001.seg, ...   append-only segments of entries
+  checkpoint.json                           {"segment": n, "offset": bytes} already drained
+
+Each entry is a big-endian (length, crc32) header followed by the compact JSON
+payload. A torn entry at the end of the newest segment (crash mid-append) is
+truncated away when the spool is opened.
+
+SpoolDrainer stores entries in order and retries transient failures with
+backoff. An entry that fails with a permanent error, or fails
+TELEMETRY_MAX_ATTEMPTS times, is moved to the spool's dead-letter spool
+(a 'dead-letter' subdirectory with the same format) and committed, so a poison
+batch cannot stall its partition. Dead-lettered entries keep the original
+payload and can be replayed once the cause is fixed.
+"""
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_SPOOL_DIR = os.getenv("TELEMETRY_SPOOL_DIR", "telemetry_spool")
+TELEMETRY_SPOOL_SEGMENT_BYTES = int(os.getenv("TELEMETRY_SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# fsync after every append; each append is a whole stream batch, so this is already batched
+TELEMETRY_SPOOL_FSYNC = os.getenv("TELEMETRY_SPOOL_FSYNC", "true").lower() in ("1", "true", "yes")
+
+# Attempts for an entry that keeps failing with transient errors before it is dead-lettered
+TELEMETRY_MAX_ATTEMPTS = int(os.getenv("TELEMETRY_MAX_ATTEMPTS", "20"))
+
+HEADER = struct.Struct(">II")
+CHECKPOINT_FILE = "checkpoint.json"
+DEAD_LETTER_DIR = "dead-letter"
+
+
+class TelemetrySpool:
+    """
+    One append-only spool with a single appender and a single reader.
+    Positions are (segment, offset) tuples pointing just past an entry.
+    """
+
+    def __init__(self, directory, segment_bytes=TELEMETRY_SPOOL_SEGMENT_BYTES, fsync=TELEMETRY_SPOOL_FSYNC):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._checkpoint = self._load_checkpoint()
+        segments = self._segments()
+        self._write_seq = max(segments[-1] if segments else 0, self._checkpoint[0])
+        self._write_offset = self._recover_tail(self._write_seq)
+        self._file = open(self._segment_path(self._write_seq), "ab")
+        self._read_pos = self._checkpoint
+        self._dead_letters = None
+        # Entries up to here were left over from a previous run and may be partly stored
+        self.recovered_end = (self._write_seq, self._write_offset)
+
+    # ---- appending ----
+    def append(self, payload):
+        """Append one payload; it is on disk (and fsynced, if enabled) when this returns."""
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        entry = HEADER.pack(len(body), zlib.crc32(body)) + body
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Spool {self.directory} is closed.")
+            if self._write_offset and self._write_offset + len(entry) > self.segment_bytes:
+                self._file.close()
+                self._write_seq += 1
+                self._write_offset = 0
+                self._file = open(self._segment_path(self._write_seq), "ab")
+            self._file.write(entry)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._write_offset += len(entry)
+            self._cond.notify_all()
+
+    # ---- draining ----
+    def read_next(self, timeout=None):
+        """
+        Next entry after the read position as (position, payload), waiting up to
+        'timeout' seconds for one to be appended. Returns None on timeout or close.
+        Call commit(position) once the payload has been stored.
+        """
+        while True:
+            with self._cond:
+                seq, offset = self._read_pos
+                end = self._write_offset if seq == self._write_seq else None
+                if end is not None and offset >= end:
+                    if self._closed or not self._cond.wait(timeout):
+                        return None
+                    continue
+            body = self._read_at(seq, offset)
+            if body is None:
+                if end is not None:
+                    raise RuntimeError(f"Corrupt spool entry in {self._segment_path(seq)} at {offset}.")
+                size = os.path.getsize(self._segment_path(seq))
+                if offset < size:
+                    logger.warning(f"Skipping {size - offset} unreadable bytes at the end of {self._segment_path(seq)}")
+                self._read_pos = (seq + 1, 0)
+                continue
+            position = (seq, offset + HEADER.size + len(body))
+            self._read_pos = position
+            return position, json.loads(body)
+
+    def commit(self, position):
+        """Record everything up to 'position' as drained and delete finished segments."""
+        seq, offset = position
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": seq, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        with self._cond:
+            self._checkpoint = position
+        for old_seq in self._segments():
+            if old_seq < seq:
+                os.remove(self._segment_path(old_seq))
+
+    def dead_letter(self, position, payload, reason):
+        """Move the entry ending at 'position' to the dead-letter spool and commit past it."""
+        self.dead_letter_spool().append({"reason": reason, "deadLetteredAt": time.time(), "payload": payload})
+        self.commit(position)
+
+    def dead_letter_spool(self):
+        if self._dead_letters is None:
+            self._dead_letters = TelemetrySpool(
+                os.path.join(self.directory, DEAD_LETTER_DIR), self.segment_bytes, self.fsync
+            )
+        return self._dead_letters
+
+    def pending_bytes(self):
+        """Bytes appended but not yet committed."""
+        with self._cond:
+            seq, offset = self._checkpoint
+            write_seq, write_offset = self._write_seq, self._write_offset
+        total = write_offset - offset if seq == write_seq else write_offset
+        for s in self._segments():
+            if seq <= s < write_seq:
+                try:
+                    total += os.path.getsize(self._segment_path(s)) - (offset if s == seq else 0)
+                except FileNotFoundError:
+                    pass  # drained and removed meanwhile
+        return total
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._file.close()
+            self._cond.notify_all()
+        if self._dead_letters is not None:
+            self._dead_letters.close()
+
+    # ---- internals ----
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.seg")
+
+    def _segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["offset"])
+        except FileNotFoundError:
+            return 0, 0
+
+    def _read_at(self, seq, offset):
+        with open(self._segment_path(seq), "rb") as f:
+            f.seek(offset)
+            return self._read_entry(f)
+
+    @staticmethod
+    def _read_entry(f):
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length, crc = HEADER.unpack(header)
+        body = f.read(length)
+        if len(body) < length or zlib.crc32(body) != crc:
+            return None
+        return body
+
+    def _recover_tail(self, seq):
+        """Truncate a torn entry off the newest segment; return its valid length."""
+        path = self._segment_path(seq)
+        if not os.path.exists(path):
+            return 0
+        valid = 0
+        with open(path, "rb") as f:
+            while self._read_entry(f) is not None:
+                valid = f.tell()
+        size = os.path.getsize(path)
+        if valid < size:
+            logger.warning(f"Truncating {size - valid} torn bytes from {path}")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+        return valid
+
+
+class SpoolDrainer:
+    """
+    Drains one spool in order through store(payload, replay). 'replay' is True
+    when the entry may already be partly stored: it was left over from a previous
+    run, or an earlier attempt failed.
+    """
+
+    def __init__(self, spool, store, is_permanent=lambda error: False, max_attempts=TELEMETRY_MAX_ATTEMPTS,
+                 backoff_initial=1.0, backoff_max=60.0, stop_event=None):
+        self.spool = spool
+        self.store = store
+        self.is_permanent = is_permanent
+        self.max_attempts = max_attempts
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stop_event = stop_event or threading.Event()
+        self.retries = 0
+        self.dead_lettered = 0
+
+    def drain_next(self, timeout=None):
+        """
+        Store the next entry, waiting up to 'timeout' seconds for one. Returns
+        ("stored" or "dead_lettered", payload), or None if no entry arrived or a
+        stop was requested while backing off (the entry is then left uncommitted).
+        """
+        entry = self.spool.read_next(timeout)
+        if entry is None:
+            return None
+        position, payload = entry
+        replay = position <= self.spool.recovered_end
+        delay = self.backoff_initial
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.store(payload, replay)
+                break
+            except Exception as e:
+                permanent = self.is_permanent(e)
+                if permanent or attempt >= self.max_attempts:
+                    reason = f"{'permanent error' if permanent else f'{attempt} attempts'}: {type(e).__name__}: {e}"
+                    logger.error(f"Dead-lettering spooled entry from {self.spool.directory} ({reason})")
+                    self.spool.dead_letter(position, payload, reason)
+                    self.dead_lettered += 1
+                    return "dead_lettered", payload
+                self.retries += 1
+                logger.error(f"Error storing spooled entry (attempt {attempt}, retrying in {delay}s): {e}")
+                if self.stop_event.wait(delay):
+                    return None
+                delay = min(delay * 2, self.backoff_max)
+                replay = True
+        self.spool.commit(position)
+        return "stored", payload
@@ -0,0 +1,251 @@
+"""
+Batched, non-atomic telemetry writes.
+
+TelemetryWriter queues document sets and deletes, coalesces them per document
+path and commits them in BulkWriteBatch-style batches that report a status per
+document, retrying only the documents that failed. RampUpLimiter paces those
+commits.
+
+This module does not talk to Firestore itself: the writer is given a
+'new_batch' factory (Data_Storage passes BulkWriteBatch bound to its client)
+and an 'is_permanent' predicate for commit exceptions, so it can be exercised
+with fake batches.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Writer tuning. Batch size adapts between the min/max to keep commit latency
+# near the target; the ramp-up follows Firestore's 500/50/5 guidance (start at
+# 500 writes/s, grow by 50% every 5 minutes).
+WRITE_MAX_IN_FLIGHT = int(os.getenv("TELEMETRY_WRITE_MAX_IN_FLIGHT", "8"))
+WRITE_BATCH_MIN = int(os.getenv("TELEMETRY_WRITE_BATCH_MIN", "20"))
+WRITE_BATCH_MAX = 500  # Firestore limit per commit
+WRITE_BATCH_INITIAL = int(os.getenv("TELEMETRY_WRITE_BATCH_INITIAL", "200"))
+WRITE_TARGET_LATENCY = float(os.getenv("TELEMETRY_WRITE_TARGET_LATENCY", "1.0"))
+WRITE_MAX_ATTEMPTS = int(os.getenv("TELEMETRY_WRITE_MAX_ATTEMPTS", "5"))
+WRITE_BACKOFF_BASE = 0.5
+WRITE_BACKOFF_MAX = 30.0
+WRITE_RAMP_START = int(os.getenv("TELEMETRY_WRITE_RAMP_START", "500"))
+WRITE_RAMP_MAX = int(os.getenv("TELEMETRY_WRITE_RAMP_MAX", "10000"))
+WRITE_RAMP_STEP_SECONDS = 5 * 60
+WRITE_RAMP_FACTOR = 1.5
+
+
+class RampUpLimiter:
+    """
+    Token bucket whose rate starts at 'start' ops/s and is multiplied by 'factor'
+    every 'step_seconds' of use, up to 'maximum'. Shared by every writer in the
+    process so concurrent ingest threads ramp up together.
+    """
+
+    def __init__(self, start=WRITE_RAMP_START, maximum=WRITE_RAMP_MAX,
+                 step_seconds=WRITE_RAMP_STEP_SECONDS, factor=WRITE_RAMP_FACTOR,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.start = start
+        self.maximum = maximum
+        self.step_seconds = step_seconds
+        self.factor = factor
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._tokens = 0.0
+        self._last_refill = None
+
+    def rate(self, now=None):
+        if self._started_at is None:
+            return self.start
+        now = self.clock() if now is None else now
+        steps = int((now - self._started_at) // self.step_seconds)
+        return min(self.maximum, self.start * self.factor ** steps)
+
+    def acquire(self, count):
+        """Block until 'count' operations may be sent."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                if self._started_at is None:
+                    self._started_at = now
+                    self._last_refill = now
+                    self._tokens = float(self.start)
+                rate = self.rate(now)
+                self._tokens = min(rate, self._tokens + (now - self._last_refill) * rate)
+                self._last_refill = now
+                # A batch larger than one second of budget is let through once the bucket is full
+                needed = min(count, rate)
+                if self._tokens >= needed:
+                    self._tokens -= count
+                    return
+                wait_time = (needed - self._tokens) / rate
+            self.sleep(wait_time)
+
+
+write_rate_limiter = RampUpLimiter()
+
+# google.rpc codes for writes that fail the same way however often they are retried:
+# INVALID_ARGUMENT, FAILED_PRECONDITION, OUT_OF_RANGE, UNIMPLEMENTED
+PERMANENT_WRITE_CODES = {3, 9, 11, 12}
+
+WriteFailure = namedtuple("WriteFailure", ["path", "error", "permanent"])
+
+
+class PermanentWriteError(RuntimeError):
+    """Firestore rejected the writes as invalid; storing the same batch again cannot succeed."""
+
+
+class TelemetryWriter:
+    """
+    High-throughput, non-atomic writer for telemetry ingest.
+
+    Writes are grouped into batches from 'new_batch' (a BulkWriteBatch, i.e. the
+    Firestore BatchWrite RPC), which report a status per document, so only the
+    documents that failed are retried. Up to 'max_in_flight' commits run
+    concurrently; the batch size grows while commits come back under
+    WRITE_TARGET_LATENCY and halves on slow or failed commits. Every commit passes
+    through the shared ramp-up limiter. A commit that raises fails all of its
+    writes, permanently if 'is_permanent' says so.
+
+    BatchWrite rejects a request that touches the same document twice, so queued
+    writes are coalesced by path: a merge-set is folded into the write already
+    queued for that document (nested maps merged, other values replaced) and a
+    plain set or delete replaces it.
+
+    Usage:
+        writer = TelemetryWriter(lambda: BulkWriteBatch(db))
+        writer.set(doc_ref, data)
+        writer.delete(other_ref)
+        failed = writer.close()   # [WriteFailure(path, error, permanent), ...] after all retries
+    """
+
+    def __init__(self, new_batch, is_permanent=lambda error: isinstance(error, PermanentWriteError),
+                 max_in_flight=WRITE_MAX_IN_FLIGHT, batch_size=WRITE_BATCH_INITIAL,
+                 limiter=write_rate_limiter, backoff_base=WRITE_BACKOFF_BASE):
+        self.new_batch = new_batch
+        self.is_permanent = is_permanent
+        self.max_in_flight = max_in_flight
+        self.batch_size = max(WRITE_BATCH_MIN, min(WRITE_BATCH_MAX, batch_size))
+        self.limiter = limiter
+        self.backoff_base = backoff_base
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="telemetry-writer")
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._pending = {}  # doc path -> (doc_ref, data, merge)
+        self._futures = []
+        self._failed = []
+        self.written = 0
+        self.retried = 0
+        self.commits = 0
+        self.coalesced = 0
+
+    def set(self, doc_ref, data, merge=False):
+        queued = self._pending.get(doc_ref.path)
+        if queued is not None:
+            self.coalesced += 1
+            _, queued_data, queued_merge = queued
+            if merge and queued_data is not None:
+                data, merge = merge_write_data(queued_data, data), queued_merge
+            elif merge:
+                merge = False  # merge onto a queued delete: the doc ends up holding just 'data'
+        self._pending[doc_ref.path] = (doc_ref, data, merge)
+        if len(self._pending) >= self.batch_size:
+            self._dispatch()
+
+    def delete(self, doc_ref):
+        self.set(doc_ref, None)
+
+    def flush(self):
+        """Send everything queued so far and wait for it (including retries) to finish."""
+        if self._pending:
+            self._dispatch()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+        if self.retried or self._failed:
+            logger.info(
+                f"[WRITER] {self.written} writes in {self.commits} commits, "
+                f"{self.retried} retried, {len(self._failed)} failed, batch size now {self.batch_size}"
+            )
+        return list(self._failed)
+
+    def _dispatch(self):
+        ops, self._pending = list(self._pending.values()), {}
+        self._slots.acquire()  # backpressure: at most max_in_flight commits outstanding
+        self._futures.append(self._executor.submit(self._commit_with_retry, ops))
+        self._futures = [f for f in self._futures if not f.done() or f.exception()]
+
+    def _commit_with_retry(self, ops):
+        try:
+            attempt = 0
+            while ops:
+                attempt += 1
+                # Invalid writes are not retried
+                failures, given_up = [], []
+                for op, error, permanent in self._commit(ops):
+                    (given_up if permanent or attempt >= WRITE_MAX_ATTEMPTS else failures).append((op, error, permanent))
+                if given_up:
+                    with self._lock:
+                        self._failed.extend(WriteFailure(op[0].path, error, permanent) for op, error, permanent in given_up)
+                    logger.error(f"[WRITER] {len(given_up)} writes failed after {attempt} attempts: {given_up[0][1]}")
+                if not failures:
+                    return
+                with self._lock:
+                    self.retried += len(failures)
+                time.sleep(random.uniform(0, min(WRITE_BACKOFF_MAX, self.backoff_base * 2 ** attempt)))
+                ops = [op for op, _, _ in failures]
+        finally:
+            self._slots.release()
+
+    def _commit(self, ops):
+        """Commit one batch; return [(op, error, permanent)] for the documents that failed."""
+        self.limiter.acquire(len(ops))
+        batch = self.new_batch()
+        for doc_ref, data, merge in ops:
+            if data is None:
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data, merge=merge)
+        started = time.monotonic()
+        try:
+            response = batch.commit()
+        except Exception as e:
+            self._adapt(time.monotonic() - started, failed=True)
+            return [(op, str(e), self.is_permanent(e)) for op in ops]
+        failures = [
+            (op, status.message or f"code {status.code}", status.code in PERMANENT_WRITE_CODES)
+            for op, status in zip(ops, response.status)
+            if status.code != 0
+        ]
+        self._adapt(time.monotonic() - started, failed=bool(failures))
+        with self._lock:
+            self.commits += 1
+            self.written += len(ops) - len(failures)
+        return failures
+
+    def _adapt(self, latency, failed):
+        with self._lock:
+            if failed or latency > 2 * WRITE_TARGET_LATENCY:
+                self.batch_size = max(WRITE_BATCH_MIN, self.batch_size // 2)
+            elif latency < WRITE_TARGET_LATENCY:
+                self.batch_size = min(WRITE_BATCH_MAX, int(self.batch_size * 1.25) + 1)
+
+
+def merge_write_data(base, update):
+    """What set(base) or set(base, merge=True) followed by set(update, merge=True) stores."""
+    merged = dict(base)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_write_data(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
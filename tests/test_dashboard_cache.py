@@ -0,0 +1,75 @@
+import dashboard_cache
+from dashboard_cache import MemoryCacheBackend, invalidate_dashboard_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_returns_what_was_set():
+    cache = MemoryCacheBackend()
+    assert cache.get("k") is None
+    cache.set("k", b"body")
+    assert cache.get("k") == b"body"
+    cache.set("k", b"newer")
+    assert cache.get("k") == b"newer"
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = MemoryCacheBackend(clock=clock)
+    cache.set("k", b"body", ttl=60)
+    clock.now += 60
+    assert cache.get("k") == b"body"
+    clock.now += 1
+    assert cache.get("k") is None
+    assert cache._bytes == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MemoryCacheBackend(max_entries=2)
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    assert cache.get("a") == b"1"  # "b" is now the least recently used
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+
+
+def test_total_bytes_stay_bounded():
+    cache = MemoryCacheBackend(max_bytes=10)
+    cache.set("a", b"xxxx")
+    cache.set("b", b"yyyy")
+    cache.set("c", b"zzzz")
+    assert cache.get("a") is None
+    assert cache.get("b") == b"yyyy" and cache.get("c") == b"zzzz"
+    assert cache._bytes == 8
+    cache.set("huge", b"h" * 11)  # larger than the whole cache: not stored, nothing evicted
+    assert cache.get("huge") is None
+    assert cache.get("b") == b"yyyy"
+
+
+def test_invalidate_drops_tagged_entries_only():
+    cache = MemoryCacheBackend()
+    cache.set("sl1", b"1", tags=["service_lines/SL-1", "telemetry_raw/ut1"])
+    cache.set("sl2", b"2", tags=["service_lines/SL-2", "telemetry_raw/ut1"])
+    cache.set("sl3", b"3", tags=["service_lines/SL-3"])
+    assert cache.invalidate("telemetry_raw/ut1", "unknown") == 2
+    assert cache.get("sl1") is None and cache.get("sl2") is None
+    assert cache.get("sl3") == b"3"
+    assert cache.invalidate("service_lines/SL-1") == 0
+    assert set(cache._tags) == {"service_lines/SL-3"}
+
+
+def test_local_invalidation_warns_once(monkeypatch, caplog):
+    monkeypatch.setattr(dashboard_cache, "cache", MemoryCacheBackend())
+    monkeypatch.setattr(dashboard_cache, "_warned_local_invalidation", False)
+    invalidate_dashboard_cache("service_lines/SL-1")
+    invalidate_dashboard_cache("service_lines/SL-2")
+    warnings = [r for r in caplog.records if "in-process" in r.getMessage()]
+    assert len(warnings) == 1
@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from dashboard_query import parse_time_param, parse_dashboard_query
+
+NS = 1_000_000_000
+
+
+def test_parse_time_param_epoch_milliseconds():
+    assert parse_time_param("1700000000123") == 1_700_000_000_123 * 1_000_000
+    assert parse_time_param(None) is None
+    assert parse_time_param("") is None
+
+
+def test_parse_time_param_iso():
+    expected = int(datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc).timestamp()) * NS
+    assert parse_time_param("2024-05-01T12:30:00Z") == expected
+    assert parse_time_param("2024-05-01T12:30:00") == expected  # naive means UTC
+    assert parse_time_param("2024-05-01T14:30:00+02:00") == expected
+    assert parse_time_param("2024-05-01T12:30:00.250Z") == expected + 250_000_000
+
+
+def test_parse_time_param_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_time_param("yesterday")
+
+
+def test_defaults():
+    query = parse_dashboard_query({})
+    assert query.start_ns is None and query.end_ns is None
+    assert query.max_points is None
+    assert query.fields is None
+    assert query.include_records is True
+    assert query.stream is None
+    assert query.columnar is False
+
+
+def test_parses_every_parameter():
+    query = parse_dashboard_query({
+        "from": "1000", "to": "2000", "maxPoints": "300", "fields": "SignalQuality,,DownlinkThroughput",
+        "records": "false", "stream": "ndjson", "format": "columnar",
+    })
+    assert (query.start_ns, query.end_ns) == (1000 * 1_000_000, 2000 * 1_000_000)
+    assert query.max_points == 300
+    assert query.fields == ["SignalQuality", "DownlinkThroughput"]
+    assert query.include_records is False
+    assert query.stream == "ndjson"
+    assert query.columnar is True
+
+
+# The views answer these ValueErrors with 400
+@pytest.mark.parametrize("max_points, message", [
+    ("abc", "maxPoints must be an integer"),
+    ("2.5", "maxPoints must be an integer"),
+    ("1", "maxPoints must be at least 2"),
+    ("-10", "maxPoints must be at least 2"),
+])
+def test_bad_max_points(max_points, message):
+    with pytest.raises(ValueError, match=message):
+        parse_dashboard_query({"maxPoints": max_points})
+
+
+@pytest.mark.parametrize("args", [
+    {"stream": "xml"},
+    {"format": "csv"},
+    {"format": "columnar", "stream": "json"},
+])
+def test_bad_stream_or_format(args):
+    with pytest.raises(ValueError):
+        parse_dashboard_query(args)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fetch_graph import FetchPool, FetchPoolSaturated, run_fetch_graph, run_fetch_graph_async
+
+
+@pytest.fixture
+def pool():
+    pool = FetchPool(workers=4, max_abandoned=1, thread_name_prefix="test-fetch")
+    yield pool
+    pool.executor.shutdown(wait=False)
+
+
+def boom(results):
+    raise RuntimeError("lookup failed")
+
+
+def test_dependents_receive_results(pool):
+    seen = {}
+
+    def child(results):
+        seen.update(results)
+        return results["a"] + results["b"]
+
+    results, timed_out, failed = run_fetch_graph(pool, {
+        "a": ((), lambda r: 1),
+        "b": ((), lambda r: 2),
+        "child": (("a", "b"), child),
+    }, timeout=5)
+    assert results == {"a": 1, "b": 2, "child": 3}
+    assert seen == {"a": 1, "b": 2}
+    assert timed_out == [] and failed == []
+
+
+def test_failed_branch_reports_failed_and_dependents_get_none(pool):
+    results, timed_out, failed = run_fetch_graph(pool, {
+        "ok": ((), lambda r: "fine"),
+        "bad": ((), boom),
+        "child": (("bad",), lambda r: ("ran", r["bad"])),
+    }, timeout=5)
+    assert failed == ["bad"]
+    assert timed_out == []
+    assert results == {"ok": "fine", "bad": None, "child": ("ran", None)}
+
+
+def test_timeout_reports_branch_and_dependents(pool):
+    release = threading.Event()
+
+    def slow(results):
+        release.wait(5)
+        return "late"
+
+    try:
+        results, timed_out, failed = run_fetch_graph(pool, {
+            "fast": ((), lambda r: "fast"),
+            "slow": ((), slow),
+            "child": (("slow",), lambda r: "never"),
+        }, timeout=0.2)
+        assert results == {"fast": "fast", "slow": None, "child": None}
+        assert sorted(timed_out) == ["child", "slow"]
+        assert failed == []
+        # the slow thread keeps its worker, so the pool turns new graphs away
+        assert pool.abandoned == 1
+        with pytest.raises(FetchPoolSaturated):
+            run_fetch_graph(pool, {"a": ((), lambda r: 1)}, timeout=1)
+    finally:
+        release.set()
+    deadline = time.monotonic() + 5
+    while pool.abandoned and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.abandoned == 0
+    assert run_fetch_graph(pool, {"a": ((), lambda r: 1)}, timeout=1)[0] == {"a": 1}
+
+
+def test_async_graph():
+    async def value(results):
+        return 1
+
+    async def bad(results):
+        raise RuntimeError("lookup failed")
+
+    async def slow(results):
+        await asyncio.sleep(5)
+
+    async def child(results):
+        return results["bad"]
+
+    results, timed_out, failed = asyncio.run(run_fetch_graph_async({
+        "a": ((), value),
+        "bad": ((), bad),
+        "child": (("bad",), child),
+        "slow": ((), slow),
+        "after_slow": (("slow",), value),
+    }, timeout=0.2))
+    assert results == {"a": 1, "bad": None, "child": None, "slow": None, "after_slow": None}
+    assert failed == ["bad"]
+    assert sorted(timed_out) == ["after_slow", "slow"]
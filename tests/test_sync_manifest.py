@@ -0,0 +1,146 @@
+import json
+from collections import namedtuple
+
+import pytest
+
+from sync_manifest import HashManifest, bulk_upsert_if_changed, content_hash, manifest_is_current
+
+DocRef = namedtuple("DocRef", ["path"])
+TTL = 3600
+
+
+class Snapshot:
+    def __init__(self, path, data):
+        self.reference = DocRef(path)
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.sets = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.sets.append((doc_ref.path, data))
+
+    def commit(self):
+        if self.db.fail_commits:
+            raise ConnectionError("commit failed")
+        self.db.docs.update(self.sets)
+
+
+class FakeDb:
+    def __init__(self, docs=None):
+        self.docs = dict(docs or {})
+        self.reads = []
+        self.fail_commits = False
+
+    def get_all(self, refs):
+        refs = list(refs)
+        self.reads.extend(ref.path for ref in refs)
+        return [Snapshot(ref.path, self.docs.get(ref.path)) for ref in refs]
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def make_manifest(tmp_path, entries=None):
+    path = tmp_path / "manifest.json"
+    if entries is not None:
+        path.write_text(json.dumps(entries))
+    return HashManifest(str(path), ttl=TTL)
+
+
+def upsert(db, manifest, entries, invalidated=None):
+    return bulk_upsert_if_changed(
+        db, manifest, [(DocRef(path), data) for path, data in entries],
+        invalidate=lambda *tags: invalidated.update(tags) if invalidated is not None else None,
+    )
+
+
+def test_new_and_changed_documents_are_written(tmp_path):
+    db = FakeDb({"accounts/a": {"name": "old"}, "accounts/b": {"name": "same"}})
+    manifest = make_manifest(tmp_path)
+    invalidated = set()
+    written = upsert(db, manifest, [
+        ("accounts/a", {"name": "new", "serviceLineNumber": "SL-1"}),
+        ("accounts/b", {"name": "same"}),
+        ("accounts/c", {"name": "created"}),
+    ], invalidated)
+    assert written == 2
+    assert db.docs["accounts/a"]["name"] == "new"
+    assert db.docs["accounts/c"] == {"name": "created"}
+    assert invalidated == {"accounts/a", "accounts/c", "service_lines/SL-1"}
+    # unchanged documents are recorded too, so the next sync skips their read
+    assert set(manifest.snapshot()) == {"accounts/a", "accounts/b", "accounts/c"}
+
+
+def test_manifest_hit_skips_the_read(tmp_path):
+    db = FakeDb()
+    manifest = make_manifest(tmp_path)
+    upsert(db, manifest, [("accounts/a", {"name": "x"})])
+    db.reads.clear()
+    assert upsert(db, manifest, [("accounts/a", {"name": "x"})]) == 0
+    assert db.reads == []
+
+
+def test_changed_content_is_read_despite_manifest(tmp_path):
+    db = FakeDb()
+    manifest = make_manifest(tmp_path)
+    upsert(db, manifest, [("accounts/a", {"name": "x"})])
+    db.reads.clear()
+    assert upsert(db, manifest, [("accounts/a", {"name": "y"})]) == 1
+    assert db.reads == ["accounts/a"]
+
+
+def test_expired_entry_is_verified_again(tmp_path):
+    data = {"name": "x"}
+    db = FakeDb()  # deleted outside the sync since it was recorded
+    manifest = make_manifest(tmp_path, {"accounts/a": [content_hash(data), 0]})
+    assert upsert(db, manifest, [("accounts/a", data)]) == 1
+    assert db.reads == ["accounts/a"]
+    assert db.docs["accounts/a"] == data
+
+
+def test_legacy_bare_hash_entry_is_verified_again(tmp_path):
+    data = {"name": "x"}
+    db = FakeDb({"accounts/a": data})
+    manifest = make_manifest(tmp_path, {"accounts/a": content_hash(data)})
+    assert upsert(db, manifest, [("accounts/a", data)]) == 0
+    assert db.reads == ["accounts/a"]
+    assert isinstance(manifest.snapshot()["accounts/a"], list)
+
+
+def test_manifest_is_only_updated_after_commit(tmp_path):
+    db = FakeDb()
+    db.fail_commits = True
+    manifest = make_manifest(tmp_path)
+    with pytest.raises(ConnectionError):
+        upsert(db, manifest, [("accounts/a", {"name": "x"})])
+    assert manifest.snapshot() == {}
+    assert not (tmp_path / "manifest.json").exists()
+
+    db.fail_commits = False
+    db.reads.clear()
+    assert upsert(db, manifest, [("accounts/a", {"name": "x"})]) == 1
+    assert db.reads == ["accounts/a"]
+
+
+def test_forget_drops_entries_and_persists(tmp_path):
+    manifest = make_manifest(tmp_path, {"a": ["00", 1], "b": ["00", 1], "c": ["00", 1]})
+    manifest.forget(["a", "c", "missing"])
+    assert manifest.snapshot() == {"b": ["00", 1]}
+    assert json.loads((tmp_path / "manifest.json").read_text()) == {"b": ["00", 1]}
+
+
+def test_ttl_is_jittered_between_75_and_100_percent():
+    for data in range(50):
+        new_hash = content_hash({"n": data})
+        entry = [new_hash, 0]
+        assert manifest_is_current(entry, new_hash, 0.75 * TTL - 1, ttl=TTL)
+        assert not manifest_is_current(entry, new_hash, TTL, ttl=TTL)
+        assert not manifest_is_current(entry, content_hash("other"), 0, ttl=TTL)
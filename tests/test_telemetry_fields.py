@@ -0,0 +1,91 @@
+import math
+
+from telemetry_fields import TelemetryAggregator, summary_to_aggregates, lttb_indices, downsample_lttb_fields
+
+
+def summary_from(stats):
+    """A telemetry_summary document holding one batch, as build_summary_update writes it."""
+    fields = {}
+    for name, field_stats in stats.items():
+        if not field_stats["count"]:
+            continue
+        entry = {"last": field_stats["last"], "count": field_stats["count"]}
+        if "sum" in field_stats:
+            entry.update(min=field_stats["min"], max=field_stats["max"], sum=field_stats["sum"])
+        fields[name] = entry
+    return {"fields": fields}
+
+
+def aggregate(records):
+    aggregator = TelemetryAggregator()
+    aggregator.extend(records)
+    return aggregator.result()
+
+
+def test_numeric_count_skips_non_numeric_samples():
+    stats = aggregate([{"SignalQuality": 0.5}, {"SignalQuality": None}, {"SignalQuality": 0.7}])
+    assert stats["SignalQuality"]["count"] == 2
+    assert stats["SignalQuality"]["sum"] == 1.2
+
+
+def test_numeric_field_without_numeric_samples_counts_zero():
+    stats = aggregate([{"SignalQuality": None}, {"SignalQuality": "n/a"}])
+    assert stats["SignalQuality"]["count"] == 0
+    assert summary_from(stats)["fields"] == {}
+
+
+def test_summary_matches_result_shape():
+    records = [
+        {"SignalQuality": 0.5, "RunningSoftwareVersion": "a", "WifiIsBypassed": False},
+        {"SignalQuality": None, "RunningSoftwareVersion": "b", "WifiIsBypassed": True},
+        {"SignalQuality": 0.7},
+    ]
+    stats = aggregate(records)
+    converted = summary_to_aggregates(summary_from(stats))
+    assert converted.keys() == stats.keys()
+    for name, field_stats in stats.items():
+        assert converted[name].keys() == field_stats.keys(), name
+        assert converted[name]["count"] == field_stats["count"], name
+    assert converted["SignalQuality"]["p50"] is None
+    assert converted["SignalQuality"]["mean"] == stats["SignalQuality"]["mean"]
+
+
+def wave_records(n, spike_at=None, dip_at=None):
+    records = []
+    for i in range(n):
+        a = math.sin(i / 20.0)
+        b = math.cos(i / 15.0)
+        if i == spike_at:
+            a = 50.0
+        if i == dip_at:
+            b = -50.0
+        records.append({"UtcTimestampNs": 1_700_000_000_000_000_000 + i * 1_000_000_000, "a": a, "b": b})
+    return records
+
+
+def test_lttb_keeps_endpoints_and_bound():
+    records = wave_records(1000)
+    for max_points in (2, 3, 10, 137, 999):
+        indices = lttb_indices(records, max_points, "a")
+        assert len(indices) == max_points
+        assert indices[0] == 0 and indices[-1] == len(records) - 1
+        assert indices == sorted(set(indices))
+
+
+def test_lttb_returns_everything_when_under_max_points():
+    records = wave_records(50)
+    assert lttb_indices(records, 50, "a") == list(range(50))
+    assert lttb_indices(records, None, "a") == list(range(50))
+    assert downsample_lttb_fields(records, 50, ["a", "b"]) is records
+    assert downsample_lttb_fields(records, 500, ["a", "b"]) is records
+
+
+def test_downsample_fields_keeps_each_fields_extremes():
+    records = wave_records(2000, spike_at=613, dip_at=1411)
+    sampled = downsample_lttb_fields(records, 100, ["a", "b"])
+    assert len(sampled) <= 100
+    assert sampled[0] is records[0] and sampled[-1] is records[-1]
+    assert records[613] in sampled
+    assert records[1411] in sampled
+    timestamps = [r["UtcTimestampNs"] for r in sampled]
+    assert timestamps == sorted(set(timestamps))
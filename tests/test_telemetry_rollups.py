@@ -0,0 +1,79 @@
+from telemetry_rollups import plan_rollup_batches, sample_bucket
+
+NS = 1_000_000_000
+
+
+def fold(state, device_samples, max_writes=450, floors=None):
+    """Apply planned batches to an in-memory {buckets, seen} state, like fold_into_rollups."""
+    batches = plan_rollup_batches(device_samples, state["seen"], max_writes, floors)
+    for batch in batches:
+        assert len(batch.buckets) + len(batch.seen) <= max_writes
+        for start_ts, (ping, signal, count) in batch.buckets.items():
+            acc = state["buckets"].setdefault(start_ts, [0.0, 0.0, 0])
+            acc[0] += ping
+            acc[1] += signal
+            acc[2] += count
+        for key, timestamps in batch.seen.items():
+            state["seen"].setdefault(key, set()).update(timestamps)
+    return batches
+
+
+def new_state():
+    return {"buckets": {}, "seen": {}}
+
+
+def test_late_sample_is_counted():
+    state = new_state()
+    t1, t2 = 1000 * NS, 1010 * NS
+    fold(state, {"ut1": [(t2, 20.0, 0.5)]})
+    fold(state, {"ut1": [(t1, 10.0, 0.5)]})
+    assert state["buckets"][sample_bucket(t1)] == [30.0, 1.0, 2]
+
+
+def test_late_sample_in_an_older_bucket_is_counted():
+    state = new_state()
+    t1, t2 = 1000 * NS, 10000 * NS
+    fold(state, {"ut1": [(t2, 20.0, 1.0)]})
+    fold(state, {"ut1": [(t1, 10.0, 1.0)]})
+    assert state["buckets"][sample_bucket(t1)][2] == 1
+    assert state["buckets"][sample_bucket(t2)][2] == 1
+
+
+def test_replay_adds_nothing():
+    state = new_state()
+    samples = {"ut1": [(1000 * NS, 10.0, 1.0), (1010 * NS, 20.0, 1.0)], "rt1": [(1000 * NS, 5.0, 0.0)]}
+    fold(state, samples)
+    assert fold(state, samples) == []
+    assert state["buckets"][sample_bucket(1000 * NS)] == [35.0, 2.0, 3]
+
+
+def test_partial_replay_counts_only_the_new_samples():
+    state = new_state()
+    fold(state, {"ut1": [(1000 * NS, 10.0, 1.0)]})
+    fold(state, {"ut1": [(1000 * NS, 10.0, 1.0), (1005 * NS, 1.0, 1.0)]})
+    assert state["buckets"][sample_bucket(1000 * NS)] == [11.0, 2.0, 2]
+
+
+def test_duplicate_samples_within_a_batch_count_once():
+    state = new_state()
+    fold(state, {"ut1": [(1000 * NS, 10.0, 1.0), (1000 * NS, 10.0, 1.0)]})
+    assert state["buckets"][sample_bucket(1000 * NS)][2] == 1
+
+
+def test_samples_at_or_below_a_legacy_watermark_are_skipped():
+    state = new_state()
+    fold(state, {"ut1": [(1000 * NS, 10.0, 1.0), (2000 * NS, 20.0, 1.0)]}, floors={"ut1": 1000 * NS})
+    assert sum(acc[2] for acc in state["buckets"].values()) == 1
+
+
+def test_batches_respect_the_write_limit_and_keep_entries_whole():
+    state = new_state()
+    samples = {
+        f"ut{d}": [((b * 900 + s) * NS, 1.0, 1.0) for b in range(1, 21) for s in range(3)]
+        for d in range(10)
+    }
+    batches = fold(state, samples, max_writes=25)
+    assert len(batches) > 1
+    keys = [key for batch in batches for key in batch.seen]
+    assert len(keys) == len(set(keys)) == 200
+    assert sum(acc[2] for acc in state["buckets"].values()) == 600
@@ -0,0 +1,162 @@
+import os
+import threading
+
+import pytest
+
+from telemetry_spool import TelemetrySpool, SpoolDrainer, DEAD_LETTER_DIR
+
+
+class InvalidWrite(Exception):
+    pass
+
+
+def make_spool(tmp_path, **kwargs):
+    kwargs.setdefault("fsync", False)
+    return TelemetrySpool(str(tmp_path / "spool"), **kwargs)
+
+
+def drain_all(spool):
+    entries = []
+    while True:
+        entry = spool.read_next(timeout=0)
+        if entry is None:
+            return entries
+        entries.append(entry)
+
+
+def test_entries_are_read_in_order(tmp_path):
+    spool = make_spool(tmp_path)
+    for i in range(3):
+        spool.append({"batch": i})
+    assert [payload for _, payload in drain_all(spool)] == [{"batch": 0}, {"batch": 1}, {"batch": 2}]
+    spool.close()
+
+
+def test_reopen_resumes_after_commit(tmp_path):
+    spool = make_spool(tmp_path)
+    for i in range(3):
+        spool.append({"batch": i})
+    first, second, _ = drain_all(spool)
+    spool.commit(first[0])
+    spool.close()
+
+    reopened = make_spool(tmp_path)
+    replayed = drain_all(reopened)
+    assert [payload for _, payload in replayed] == [{"batch": 1}, {"batch": 2}]
+    # Uncommitted entries from the previous run are flagged as possibly stored
+    assert all(position <= reopened.recovered_end for position, _ in replayed)
+    reopened.append({"batch": 3})
+    position, payload = reopened.read_next(timeout=0)
+    assert payload == {"batch": 3} and position > reopened.recovered_end
+    reopened.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append({"batch": 0})
+    spool.close()
+    segment = tmp_path / "spool" / "000000000000.seg"
+    with open(segment, "ab") as f:
+        f.write(b"\x00\x00\x01\x00garbage")
+
+    reopened = make_spool(tmp_path)
+    assert [payload for _, payload in drain_all(reopened)] == [{"batch": 0}]
+    reopened.append({"batch": 1})
+    assert [payload for _, payload in drain_all(reopened)] == [{"batch": 1}]
+    reopened.close()
+
+
+def test_commit_removes_drained_segments(tmp_path):
+    spool = make_spool(tmp_path, segment_bytes=64)
+    for i in range(5):
+        spool.append({"batch": i, "padding": "x" * 40})
+    entries = drain_all(spool)
+    assert len(entries) == 5
+    assert len([n for n in os.listdir(tmp_path / "spool") if n.endswith(".seg")]) == 5
+    spool.commit(entries[-1][0])
+    assert [n for n in os.listdir(tmp_path / "spool") if n.endswith(".seg")] == ["000000000004.seg"]
+    assert spool.pending_bytes() == 0
+    spool.close()
+
+
+def test_drainer_retries_transient_errors_as_replays(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append({"batch": 0})
+    calls = []
+
+    def store(payload, replay):
+        calls.append(replay)
+        if len(calls) < 3:
+            raise ConnectionError("unavailable")
+
+    drainer = SpoolDrainer(spool, store, backoff_initial=0)
+    assert drainer.drain_next(timeout=0) == ("stored", {"batch": 0})
+    assert calls == [False, True, True]
+    assert drainer.retries == 2 and drainer.dead_lettered == 0
+    assert spool.pending_bytes() == 0
+    spool.close()
+
+
+def test_drainer_dead_letters_permanent_errors_immediately(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append({"batch": "poison"})
+    spool.append({"batch": "good"})
+    stored = []
+
+    def store(payload, replay):
+        if payload["batch"] == "poison":
+            raise InvalidWrite("document too large")
+        stored.append(payload)
+
+    drainer = SpoolDrainer(spool, store, is_permanent=lambda e: isinstance(e, InvalidWrite), backoff_initial=0)
+    assert drainer.drain_next(timeout=0) == ("dead_lettered", {"batch": "poison"})
+    assert drainer.drain_next(timeout=0) == ("stored", {"batch": "good"})
+    assert stored == [{"batch": "good"}]
+    assert drainer.retries == 0 and drainer.dead_lettered == 1
+    assert spool.pending_bytes() == 0
+    spool.close()
+
+    dead_letters = TelemetrySpool(str(tmp_path / "spool" / DEAD_LETTER_DIR), fsync=False)
+    (_, dead_letter), = drain_all(dead_letters)
+    assert dead_letter["payload"] == {"batch": "poison"}
+    assert "InvalidWrite" in dead_letter["reason"]
+    dead_letters.close()
+
+
+def test_drainer_dead_letters_after_max_attempts(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append({"batch": 0})
+
+    def store(payload, replay):
+        raise ConnectionError("unavailable")
+
+    drainer = SpoolDrainer(spool, store, max_attempts=4, backoff_initial=0)
+    assert drainer.drain_next(timeout=0) == ("dead_lettered", {"batch": 0})
+    assert drainer.retries == 3 and drainer.dead_lettered == 1
+    assert spool.pending_bytes() == 0
+    spool.close()
+
+
+def test_stop_during_backoff_leaves_entry_uncommitted(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append({"batch": 0})
+    stop = threading.Event()
+
+    def store(payload, replay):
+        stop.set()
+        raise ConnectionError("unavailable")
+
+    drainer = SpoolDrainer(spool, store, backoff_initial=10, stop_event=stop)
+    assert drainer.drain_next(timeout=0) is None
+    spool.close()
+
+    reopened = make_spool(tmp_path)
+    assert [payload for _, payload in drain_all(reopened)] == [{"batch": 0}]
+    reopened.close()
+
+
+def test_closed_spool_rejects_appends(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.close()
+    with pytest.raises(RuntimeError):
+        spool.append({"batch": 0})
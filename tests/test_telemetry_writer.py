@@ -0,0 +1,186 @@
+from collections import namedtuple
+
+from telemetry_writer import (
+    RampUpLimiter, TelemetryWriter, PermanentWriteError, merge_write_data,
+    WRITE_MAX_ATTEMPTS, WRITE_RAMP_STEP_SECONDS,
+)
+
+Status = namedtuple("Status", ["code", "message"])
+Response = namedtuple("Response", ["status"])
+DocRef = namedtuple("DocRef", ["path"])
+
+
+class FakeBatch:
+    """Records BulkWriteBatch calls; commit() answers with the next scripted outcome."""
+
+    def __init__(self, store):
+        self.store = store
+        self.ops = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.ops.append(("set", doc_ref.path, data, merge))
+
+    def delete(self, doc_ref):
+        self.ops.append(("delete", doc_ref.path, None, False))
+
+    def commit(self):
+        self.store.commits.append(self.ops)
+        outcome = self.store.outcomes.pop(0) if self.store.outcomes else {}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response([Status(outcome.get(path, 0), f"error for {path}") for _, path, _, _ in self.ops])
+
+
+class FakeStore:
+    def __init__(self, outcomes=()):
+        self.outcomes = list(outcomes)  # per commit: {path: status code} or an exception to raise
+        self.commits = []
+
+    def new_batch(self):
+        return FakeBatch(self)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_writer(store, **kwargs):
+    limiter = RampUpLimiter(start=10 ** 6, maximum=10 ** 6)
+    return TelemetryWriter(store.new_batch, limiter=limiter, backoff_base=0, **kwargs)
+
+
+def test_merge_sets_to_one_path_are_coalesced():
+    store = FakeStore()
+    writer = make_writer(store)
+    doc = DocRef("telemetry_summary/ut1")
+    writer.set(doc, {"fields": {"a": 1}, "deviceType": "u"}, merge=True)
+    writer.set(doc, {"fields": {"b": 2}}, merge=True)
+    assert writer.close() == []
+    assert store.commits == [[("set", doc.path, {"fields": {"a": 1, "b": 2}, "deviceType": "u"}, True)]]
+    assert writer.coalesced == 1
+
+
+def test_plain_set_replaces_queued_merge():
+    store = FakeStore()
+    writer = make_writer(store)
+    doc = DocRef("d/1")
+    writer.set(doc, {"a": 1}, merge=True)
+    writer.set(doc, {"b": 2})
+    writer.close()
+    assert store.commits == [[("set", doc.path, {"b": 2}, False)]]
+
+
+def test_merge_onto_plain_set_stays_a_plain_set():
+    store = FakeStore()
+    writer = make_writer(store)
+    doc = DocRef("d/1")
+    writer.set(doc, {"a": 1})
+    writer.set(doc, {"b": 2}, merge=True)
+    writer.close()
+    assert store.commits == [[("set", doc.path, {"a": 1, "b": 2}, False)]]
+
+
+def test_delete_then_merge_stores_only_the_merge():
+    store = FakeStore()
+    writer = make_writer(store)
+    doc = DocRef("d/1")
+    writer.set(doc, {"a": 1})
+    writer.delete(doc)
+    writer.set(doc, {"b": 2}, merge=True)
+    writer.close()
+    assert store.commits == [[("set", doc.path, {"b": 2}, False)]]
+
+
+def test_set_then_delete_deletes():
+    store = FakeStore()
+    writer = make_writer(store)
+    doc = DocRef("d/1")
+    writer.set(doc, {"a": 1}, merge=True)
+    writer.delete(doc)
+    writer.close()
+    assert store.commits == [[("delete", doc.path, None, False)]]
+
+
+def test_merge_write_data_merges_nested_maps_only():
+    base = {"fields": {"a": {"last": 1, "count": 2}}, "tags": [1]}
+    update = {"fields": {"a": {"last": 3}}, "tags": [2]}
+    assert merge_write_data(base, update) == {"fields": {"a": {"last": 3, "count": 2}}, "tags": [2]}
+    assert base == {"fields": {"a": {"last": 1, "count": 2}}, "tags": [1]}
+
+
+def test_transient_status_retries_only_failed_documents():
+    store = FakeStore([{"d/2": 14}])  # UNAVAILABLE for d/2 on the first commit
+    writer = make_writer(store)
+    for i in range(3):
+        writer.set(DocRef(f"d/{i}"), {"i": i})
+    assert writer.close() == []
+    assert [[path for _, path, _, _ in ops] for ops in store.commits] == [["d/0", "d/1", "d/2"], ["d/2"]]
+    assert writer.retried == 1
+    assert writer.written == 3
+
+
+def test_permanent_status_is_not_retried():
+    store = FakeStore([{"d/1": 3}])  # INVALID_ARGUMENT
+    writer = make_writer(store)
+    writer.set(DocRef("d/0"), {"i": 0})
+    writer.set(DocRef("d/1"), {"i": 1})
+    failed = writer.close()
+    assert len(store.commits) == 1
+    assert [(f.path, f.permanent) for f in failed] == [("d/1", True)]
+    assert writer.written == 1
+
+
+def test_transient_status_gives_up_after_max_attempts():
+    store = FakeStore([{"d/0": 14}] * WRITE_MAX_ATTEMPTS)
+    writer = make_writer(store)
+    writer.set(DocRef("d/0"), {"i": 0})
+    failed = writer.close()
+    assert len(store.commits) == WRITE_MAX_ATTEMPTS
+    assert [(f.path, f.permanent) for f in failed] == [("d/0", False)]
+
+
+def test_commit_exception_uses_is_permanent():
+    store = FakeStore([PermanentWriteError("rejected")])
+    writer = make_writer(store)
+    writer.set(DocRef("d/0"), {"i": 0})
+    failed = writer.close()
+    assert len(store.commits) == 1
+    assert [(f.path, f.permanent) for f in failed] == [("d/0", True)]
+
+    store = FakeStore([ConnectionError("reset")])
+    writer = make_writer(store)
+    writer.set(DocRef("d/0"), {"i": 0})
+    assert writer.close() == []
+    assert len(store.commits) == 2
+
+
+def test_limiter_rate_ramps_every_step():
+    clock = FakeClock()
+    limiter = RampUpLimiter(start=500, maximum=10000, factor=1.5, clock=clock, sleep=clock.sleep)
+    assert limiter.rate() == 500
+    limiter.acquire(1)
+    for steps in range(8):
+        clock.now = 1000.0 + steps * WRITE_RAMP_STEP_SECONDS
+        assert limiter.rate() == min(10000, 500 * 1.5 ** steps)
+        clock.now += WRITE_RAMP_STEP_SECONDS - 1
+        assert limiter.rate() == min(10000, 500 * 1.5 ** steps)
+    clock.now = 1000.0 + 100 * WRITE_RAMP_STEP_SECONDS
+    assert limiter.rate() == 10000
+
+
+def test_limiter_paces_to_the_rate():
+    clock = FakeClock()
+    limiter = RampUpLimiter(start=100, maximum=100, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        limiter.acquire(100)
+    # the first second of budget is available at once, each further 100 ops wait a second
+    assert sum(clock.slept) == 4.0